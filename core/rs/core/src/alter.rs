@@ -1,51 +1,264 @@
 // Not yet fully migrated from `crsqlite.c`
 
 use alloc::boxed::Box;
+use alloc::collections::BTreeMap;
 use alloc::format;
-use alloc::string::String;
+use alloc::string::{String, ToString};
 use alloc::vec::Vec;
-use core::ffi::{c_char, c_int, CStr};
+use core::ffi::{c_char, c_int, c_void, CStr};
 use core::mem;
 #[cfg(not(feature = "std"))]
 use num_traits::FromPrimitive;
-use sqlite_nostd::{sqlite3, Connection, ResultCode, StrRef};
+use sqlite_nostd::{sqlite3, Connection, Destructor, ResultCode};
 
 use crate::c::crsql_ExtData;
-use crate::db_version::fill_db_version_if_needed;
-use crate::tableinfo::{crsql_ensure_table_infos_are_up_to_date, TableInfo};
+use crate::create_crr::{create_crr, create_crr_without_backfill};
+use crate::tableinfo::{
+    crsql_clear_merged_rows, crsql_ensure_table_infos_are_up_to_date, find_table_info_index,
+    TableInfo,
+};
+use crate::teardown::remove_crr_triggers_if_exist;
+
+/**
+ * What a table looked like when `crsql_begin_alter` was called on it.
+ */
+pub struct AlterSnapshot {
+    // name and pk index of each column, in cid order.
+    columns: Vec<(String, i32)>,
+    // rowid and root page of the table's row in `sqlite_master`. Dropping and re-creating the
+    // table changes them but, unlike writes to its rows, does not count towards `total_changes()`.
+    schema_entry: (i64, i64),
+    total_changes: i64,
+}
+
+/**
+ * What an alter did to a table, as far as its clocks are concerned.
+ */
+enum AlterKind {
+    // No columns changed and no rows were written.
+    Unchanged,
+    // Columns were appended with ALTER TABLE ADD COLUMN and no rows were written so
+    // every row holds the new columns' defaults, which are never backfilled.
+    AddedColumns,
+    // Columns were removed with ALTER TABLE DROP COLUMN and no rows were written.
+    DroppedColumns(Vec<String>),
+    // Anything else: primary key changes, renames, rows written during the alter, the table
+    // being dropped and re-created or no snapshot to compare against.
+    Rebuild,
+}
 
 #[no_mangle]
-pub unsafe extern "C" fn crsql_compact_post_alter(
+pub extern "C" fn crsql_init_alter_snapshots(ext_data: *mut crsql_ExtData) {
+    let snapshots: BTreeMap<String, AlterSnapshot> = BTreeMap::new();
+    unsafe { (*ext_data).alterSnapshots = Box::into_raw(Box::new(snapshots)) as *mut c_void }
+}
+
+#[no_mangle]
+pub extern "C" fn crsql_drop_alter_snapshots(ext_data: *mut crsql_ExtData) {
+    unsafe {
+        drop(Box::from_raw(
+            (*ext_data).alterSnapshots as *mut BTreeMap<String, AlterSnapshot>,
+        ));
+    }
+}
+
+// Alters begin and commit within a single transaction.
+#[no_mangle]
+pub extern "C" fn crsql_clear_alter_snapshots(ext_data: *mut crsql_ExtData) {
+    get_alter_snapshots(ext_data).clear();
+}
+
+fn get_alter_snapshots<'a>(
+    ext_data: *mut crsql_ExtData,
+) -> &'a mut BTreeMap<String, AlterSnapshot> {
+    unsafe { &mut *((*ext_data).alterSnapshots as *mut BTreeMap<String, AlterSnapshot>) }
+}
+
+fn pull_columns(db: *mut sqlite3, table: &str) -> Result<Vec<(String, i32)>, ResultCode> {
+    let stmt = db.prepare_v2("SELECT name, pk FROM pragma_table_info(?) ORDER BY cid")?;
+    stmt.bind_text(1, table, Destructor::STATIC)?;
+    let mut columns = Vec::new();
+    while stmt.step()? == ResultCode::ROW {
+        columns.push((stmt.column_text(0)?.to_string(), stmt.column_int(1)));
+    }
+    Ok(columns)
+}
+
+fn pull_schema_entry(db: *mut sqlite3, table: &str) -> Result<(i64, i64), ResultCode> {
+    let stmt = db.prepare_v2(
+        "SELECT rowid, rootpage FROM sqlite_master WHERE type = 'table' AND name = ?",
+    )?;
+    stmt.bind_text(1, table, Destructor::STATIC)?;
+    if stmt.step()? == ResultCode::ROW {
+        Ok((stmt.column_int64(0), stmt.column_int64(1)))
+    } else {
+        Ok((0, 0))
+    }
+}
+
+fn total_changes(db: *mut sqlite3) -> Result<i64, ResultCode> {
+    let stmt = db.prepare_v2("SELECT total_changes()")?;
+    stmt.step()?;
+    Ok(stmt.column_int64(0))
+}
+
+/**
+ * Records the table's columns, its schema entry and the connection's change count then drops the crr triggers
+ * so the table can be altered.
+ */
+pub fn begin_alter(
+    db: *mut sqlite3,
+    ext_data: *mut crsql_ExtData,
+    table: &str,
+) -> Result<ResultCode, ResultCode> {
+    remove_crr_triggers_if_exist(db, table)?;
+    let snapshot = AlterSnapshot {
+        columns: pull_columns(db, table)?,
+        schema_entry: pull_schema_entry(db, table)?,
+        total_changes: total_changes(db)?,
+    };
+    get_alter_snapshots(ext_data).insert(table.to_string(), snapshot);
+    Ok(ResultCode::OK)
+}
+
+fn classify_alter(before: &AlterSnapshot, after: &AlterSnapshot) -> AlterKind {
+    if after.total_changes != before.total_changes || after.schema_entry != before.schema_entry {
+        return AlterKind::Rebuild;
+    }
+    if after.columns == before.columns {
+        return AlterKind::Unchanged;
+    }
+    let pks = |columns: &Vec<(String, i32)>| {
+        let mut pks = columns
+            .iter()
+            .filter(|(_, pk)| *pk > 0)
+            .cloned()
+            .collect::<Vec<_>>();
+        pks.sort_by_key(|(_, pk)| *pk);
+        pks
+    };
+    if pks(&before.columns) != pks(&after.columns) {
+        return AlterKind::Rebuild;
+    }
+    if after.columns.starts_with(&before.columns) {
+        return AlterKind::AddedColumns;
+    }
+
+    // Dropping columns leaves the rest in the same order.
+    let mut remaining = after.columns.iter().peekable();
+    let mut dropped = Vec::new();
+    for (name, pk) in &before.columns {
+        if remaining.peek().map_or(false, |(n, _)| n == name) {
+            remaining.next();
+        } else if *pk == 0 {
+            dropped.push(name.clone());
+        } else {
+            return AlterKind::Rebuild;
+        }
+    }
+    if remaining.next().is_some() {
+        return AlterKind::Rebuild;
+    }
+    AlterKind::DroppedColumns(dropped)
+}
+
+/**
+ * Brings the clock tables in line with the altered table and re-creates the crr triggers.
+ *
+ * Compaction and backfill scan every row of the table so they are only done when the
+ * alter could have invalidated clocks: the primary key changed, columns were renamed or rows
+ * were written between `crsql_begin_alter` and `crsql_commit_alter`.
+ *
+ * When `staged` is set and the primary key changed, the clock tables are re-created empty
+ * and the backfill is left to `crsql_backfill_step` so it can be run in batches, in their own
+ * transactions, rather than holding the write lock for the whole table.
+ *
+ * Until the backfill reaches a row, the row has no clocks:
+ * - `crsql_changes` does not report it to peers.
+ * - Merges into it always win, as there is no local col_version to compare against.
+ *   An unstaged alter would have compared them against col_version 1 and, on a tie,
+ *   against the value. The backfill keeps the clocks those merges write.
+ */
+pub unsafe fn commit_alter(
     db: *mut sqlite3,
-    tbl_name: *const c_char,
     ext_data: *mut crsql_ExtData,
+    schema: &str,
+    table: &str,
+    staged: bool,
     errmsg: *mut *mut c_char,
-) -> c_int {
-    match compact_post_alter(db, tbl_name, ext_data, errmsg) {
-        Ok(rc) | Err(rc) => rc as c_int,
+) -> Result<ResultCode, ResultCode> {
+    let kind = match get_alter_snapshots(ext_data).remove(table) {
+        Some(before) => {
+            let after = AlterSnapshot {
+                columns: pull_columns(db, table)?,
+                schema_entry: pull_schema_entry(db, table)?,
+                total_changes: total_changes(db)?,
+            };
+            classify_alter(&before, &after)
+        }
+        None => AlterKind::Rebuild,
+    };
+
+    match kind {
+        AlterKind::Unchanged | AlterKind::AddedColumns => {}
+        AlterKind::DroppedColumns(dropped) => {
+            let stmt = db.prepare_v2(&format!(
+                "DELETE FROM \"{table}__crsql_clock\" WHERE col_name = ?",
+                table = crate::util::escape_ident(table),
+            ))?;
+            for col_name in &dropped {
+                stmt.bind_text(1, col_name, Destructor::STATIC)?;
+                stmt.step()?;
+                stmt.reset()?;
+            }
+        }
+        AlterKind::Rebuild => {
+            let pks_changed = pks_changed(db, table)?;
+            if pks_changed {
+                // The position of an unfinished backfill is a primary key in the old layout.
+                crate::backfill::clear_backfill(db, table)?;
+            }
+            if staged && pks_changed {
+                compact_post_alter(db, table, ext_data, errmsg)?;
+                create_crr_without_backfill(db, table, errmsg)?;
+                crate::backfill::start_backfill(db, table, true)?;
+                return Ok(ResultCode::OK);
+            }
+            compact_post_alter(db, table, ext_data, errmsg)?;
+            return create_crr(db, schema, table, true, false, errmsg);
+        }
     }
+
+    create_crr_without_backfill(db, table, errmsg)?;
+    Ok(ResultCode::OK)
 }
 
-unsafe fn compact_post_alter(
+#[no_mangle]
+pub unsafe extern "C" fn crsql_compact_post_alter(
     db: *mut sqlite3,
     tbl_name: *const c_char,
     ext_data: *mut crsql_ExtData,
     errmsg: *mut *mut c_char,
-) -> Result<ResultCode, ResultCode> {
-    let tbl_name_str = CStr::from_ptr(tbl_name).to_str()?;
-    fill_db_version_if_needed(db, ext_data).or_else(|msg| {
-        errmsg.set(&msg);
-        Err(ResultCode::ERROR)
-    })?;
-    let current_db_version = (*ext_data).dbVersion;
-
-    // If primary key columns change (in the schema)
-    // We need to drop, re-create and backfill
-    // the clock table.
-    // A change in pk columns means a change in all identities
-    // of all rows.
-    // We can determine this by comparing unique index on lookaside table vs
-    // pks on source table
+) -> c_int {
+    let tbl_name_str = match CStr::from_ptr(tbl_name).to_str() {
+        Ok(tbl_name_str) => tbl_name_str,
+        Err(_) => return ResultCode::ERROR as c_int,
+    };
+    match compact_post_alter(db, tbl_name_str, ext_data, errmsg) {
+        Ok(rc) | Err(rc) => rc as c_int,
+    }
+}
+
+/**
+ * If primary key columns change (in the schema)
+ * We need to drop, re-create and backfill
+ * the clock table.
+ * A change in pk columns means a change in all identities
+ * of all rows.
+ * We can determine this by comparing unique index on lookaside table vs
+ * pks on source table
+ */
+fn pks_changed(db: *mut sqlite3, tbl_name_str: &str) -> Result<bool, ResultCode> {
     let stmt = db.prepare_v2(&format!(
         "SELECT count(name) FROM (
         SELECT name FROM pragma_table_info('{table_name}')
@@ -58,11 +271,16 @@ unsafe fn compact_post_alter(
     ))?;
     stmt.step()?;
 
-    let pk_diff = stmt.column_int(0);
-    // immediately drop stmt, otherwise clock table is considered locked.
-    drop(stmt);
+    Ok(stmt.column_int(0) > 0)
+}
 
-    if pk_diff > 0 {
+unsafe fn compact_post_alter(
+    db: *mut sqlite3,
+    tbl_name_str: &str,
+    ext_data: *mut crsql_ExtData,
+    errmsg: *mut *mut c_char,
+) -> Result<ResultCode, ResultCode> {
+    if pks_changed(db, tbl_name_str)? {
         // drop the clock table so we can re-create it
         db.exec_safe(&format!(
             "DROP TABLE \"{table_name}__crsql_clock\";
@@ -102,12 +320,10 @@ unsafe fn compact_post_alter(
         }
         let table_infos =
             mem::ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>));
-        let table_info = table_infos.iter().find(|x| x.tbl_name == tbl_name_str);
-        if table_info.is_none() {
-            return Err(ResultCode::ERROR);
-        }
-        // TODO: safe since we checked above but make more idiomatic
-        let table_info = table_info.unwrap();
+        let table_info = match find_table_info_index(ext_data, tbl_name_str) {
+            Some(idx) => &table_infos[idx],
+            None => return Err(ResultCode::ERROR),
+        };
 
         // for each pk col, append \"%w\".\"%w\" = \"%w__crsql_pks\".\"%w\"
         // to the where clause then close the statement.
@@ -139,11 +355,10 @@ unsafe fn compact_post_alter(
         );
         db.exec_safe(&sql)?;
     }
+    // Compaction may have removed keys that were remembered by the merge path.
+    crsql_clear_merged_rows(ext_data);
 
-    let stmt = db.prepare_v2(
-        "INSERT OR REPLACE INTO crsql_master (key, value) VALUES ('pre_compact_dbversion', ?)",
-    )?;
-    stmt.bind_int64(1, current_db_version)?;
-    stmt.step()?;
+    // Compaction may remove the clock rows holding the highest db_version. That
+    // is fine since the version persisted in `crsql_db_version` never goes down.
     Ok(ResultCode::OK)
 }
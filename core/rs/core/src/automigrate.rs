@@ -1,8 +1,6 @@
 extern crate alloc;
 
-// nit: use vecs rather than btreesets. Likely never enough elements
-// for a btreeset to perform better.
-use alloc::collections::BTreeSet;
+use alloc::collections::BTreeMap;
 use alloc::format;
 use alloc::string::String;
 use alloc::string::ToString;
@@ -12,17 +10,16 @@ use core::ffi::{c_char, c_int};
 use sqlite::ColumnType;
 use sqlite_nostd as sqlite;
 
-use sqlite::{args, sqlite3, ManagedConnection, Value};
+use sqlite::{args, sqlite3, ManagedConnection};
 use sqlite::{strlit, Context};
 use sqlite::{Connection, ResultCode};
 
-static IS_UNIQUE_IDX_SQL: &str = "SELECT \"unique\" FROM pragma_index_list(?) WHERE name = ?";
-static IDX_COLS_SQL: &str = "SELECT name FROM pragma_index_info(?) ORDER BY seqno ASC";
-
 /**
 * Automigrate args:
 * 1 - the schema content
 * Users are responsible for tracking schema version and applying the migration or not.
+* A schema that was already applied, to a database whose schema was not changed since,
+* returns straight away.
 *
 * We may want to move automigrate to its own crate.
 * It is rather limited in completeness and may only be
@@ -66,6 +63,10 @@ fn automigrate_impl(
     };
     let local_db = ctx.db_handle();
     let desired_schema = args[0].text();
+    let digest = schema_digest(desired_schema);
+    if is_schema_applied(local_db, &digest)? {
+        return Ok(ResultCode::OK);
+    }
     let stripped_schema = strip_crr_statements(desired_schema);
 
     let result = sqlite::open(strlit!(":memory:"));
@@ -95,6 +96,7 @@ fn automigrate_impl(
         if !desired_schema.is_empty() {
             local_db.exec_safe(desired_schema)?;
         }
+        record_schema_applied(local_db, &digest)?;
         local_db.exec_safe("RELEASE automigrate_tables")
     } else {
         ctx.result_error("could not open the temporary migration db");
@@ -103,40 +105,181 @@ fn automigrate_impl(
     }
 }
 
+static SCHEMA_DIGEST_KEY: &str = "automigrate_schema";
+
+/**
+* FNV-1a of the schema and the commit this extension was built from, since another build may
+* migrate the same schema differently.
+*/
+fn schema_digest(schema: &str) -> String {
+    let mut hash: u64 = 0xcbf29ce484222325;
+    for byte in crate::sha::SHA.bytes().chain(schema.bytes()) {
+        hash ^= byte as u64;
+        hash = hash.wrapping_mul(0x100000001b3);
+    }
+    format!("{:016x}", hash)
+}
+
+/**
+* Whether the last schema applied by automigrate had this digest and the local schema has not
+* been changed since, in which case there is nothing to migrate and the in-memory db does not
+* need to be created.
+*
+* The local schema is checked through `schema_version` which SQLite bumps on every schema
+* change.
+*/
+fn is_schema_applied(local_db: *mut sqlite3, digest: &str) -> Result<bool, ResultCode> {
+    let stmt = local_db.prepare_v2(
+        "SELECT value = ? || ':' || (SELECT schema_version FROM pragma_schema_version)
+        FROM crsql_master WHERE key = ?",
+    )?;
+    stmt.bind_text(1, digest, sqlite::Destructor::STATIC)?;
+    stmt.bind_text(2, SCHEMA_DIGEST_KEY, sqlite::Destructor::STATIC)?;
+    if stmt.step()? != ResultCode::ROW {
+        return Ok(false);
+    }
+    Ok(stmt.column_int(0) == 1)
+}
+
+fn record_schema_applied(local_db: *mut sqlite3, digest: &str) -> Result<ResultCode, ResultCode> {
+    let stmt = local_db.prepare_v2(
+        "INSERT OR REPLACE INTO crsql_master (key, value)
+        SELECT ?, ? || ':' || schema_version FROM pragma_schema_version",
+    )?;
+    stmt.bind_text(1, SCHEMA_DIGEST_KEY, sqlite::Destructor::STATIC)?;
+    stmt.bind_text(2, digest, sqlite::Destructor::STATIC)?;
+    stmt.step()?;
+    Ok(ResultCode::OK)
+}
+
+// A column as `pragma_table_info` reports it.
+struct ColumnDef {
+    name: String,
+    col_type: String,
+    notnull: bool,
+    dflt_value: Option<String>,
+    pk: bool,
+}
+
+// An index as `pragma_index_list` and `pragma_index_info` report it.
+#[derive(PartialEq)]
+struct IndexDef {
+    unique: bool,
+    // `None` for expressions
+    columns: Vec<Option<String>>,
+}
+
+struct TableDef {
+    columns: Vec<ColumnDef>,
+    indices: BTreeMap<String, IndexDef>,
+}
+
+static USER_TABLES_WHERE: &str = "m.type = 'table'
+        AND m.name NOT LIKE 'sqlite_%'
+        AND m.name NOT LIKE 'crsql_%'
+        AND m.name NOT LIKE '__crsql_%'
+        AND m.name NOT LIKE '%__crsql_%'";
+
+/**
+* Reads the tables, columns and indices of a schema in two queries so the local and desired
+* schemas can be compared in memory rather than with queries per table and index.
+*/
+fn pull_schema(db: &impl Connection) -> Result<BTreeMap<String, TableDef>, ResultCode> {
+    let mut tables: BTreeMap<String, TableDef> = BTreeMap::new();
+
+    let columns_stmt = db.prepare_v2(&format!(
+        "SELECT m.name, c.name, c.type, c.\"notnull\", c.dflt_value, c.pk
+        FROM sqlite_master AS m JOIN pragma_table_info(m.name) AS c
+        WHERE {user_tables} ORDER BY m.name, c.cid",
+        user_tables = USER_TABLES_WHERE
+    ))?;
+    while columns_stmt.step()? == ResultCode::ROW {
+        let table = columns_stmt.column_text(0)?;
+        let column = ColumnDef {
+            name: columns_stmt.column_text(1)?.to_string(),
+            col_type: columns_stmt.column_text(2)?.to_string(),
+            notnull: columns_stmt.column_int(3) == 1,
+            dflt_value: match columns_stmt.column_type(4)? {
+                ColumnType::Null => None,
+                _ => Some(columns_stmt.column_text(4)?.to_string()),
+            },
+            pk: columns_stmt.column_int(5) > 0,
+        };
+        match tables.get_mut(table) {
+            Some(table_def) => table_def.columns.push(column),
+            None => {
+                tables.insert(
+                    table.to_string(),
+                    TableDef {
+                        columns: vec![column],
+                        indices: BTreeMap::new(),
+                    },
+                );
+            }
+        }
+    }
+
+    // We do not pull PK indices because we do not support alterations that changes
+    // primary key definitions.
+    // User would need to perform a manual migration for that.
+    // This is due to the fact that SQLite itself does not support changing primary key
+    // definitions in alter table statements.
+    let indices_stmt = db.prepare_v2(&format!(
+        "SELECT m.name, il.name, il.\"unique\", ii.name
+        FROM sqlite_master AS m
+          JOIN pragma_index_list(m.name) AS il
+          JOIN pragma_index_info(il.name) AS ii
+        WHERE {user_tables} AND il.origin != 'pk'
+        ORDER BY m.name, il.name, ii.seqno",
+        user_tables = USER_TABLES_WHERE
+    ))?;
+    while indices_stmt.step()? == ResultCode::ROW {
+        let table_def = match tables.get_mut(indices_stmt.column_text(0)?) {
+            Some(table_def) => table_def,
+            None => continue,
+        };
+        let column = match indices_stmt.column_type(3)? {
+            ColumnType::Null => None,
+            _ => Some(indices_stmt.column_text(3)?.to_string()),
+        };
+        let idx = indices_stmt.column_text(1)?;
+        match table_def.indices.get_mut(idx) {
+            Some(idx_def) => idx_def.columns.push(column),
+            None => {
+                table_def.indices.insert(
+                    idx.to_string(),
+                    IndexDef {
+                        unique: indices_stmt.column_int(2) == 1,
+                        columns: vec![column],
+                    },
+                );
+            }
+        }
+    }
+
+    Ok(tables)
+}
+
 fn migrate_to(
     local_db: *mut sqlite3,
     mem_db: &ManagedConnection,
 ) -> Result<ResultCode, ResultCode> {
-    // TODO: why not HashSet?
-    let mut mem_tables: BTreeSet<String> = BTreeSet::new();
-
-    let sql = "SELECT name FROM sqlite_master WHERE type = 'table'
-        AND name NOT LIKE 'sqlite_%'
-        AND name NOT LIKE 'crsql_%'
-        AND name NOT LIKE '__crsql_%'
-        AND name NOT LIKE '%__crsql_%'";
-    let fetch_mem_tables = mem_db.prepare_v2(sql)?;
-    let fetch_local_tables = local_db.prepare_v2(sql)?;
-
-    while fetch_mem_tables.step()? == ResultCode::ROW {
-        mem_tables.insert(fetch_mem_tables.column_text(0)?.to_string());
-    }
+    let mem_tables = pull_schema(mem_db)?;
+    let local_tables = pull_schema(&local_db)?;
 
-    let mut removed_tables: Vec<String> = vec![];
-    let mut maybe_modified_tables: Vec<String> = vec![];
+    let mut removed_tables: Vec<&String> = vec![];
+    let mut maybe_modified_tables: Vec<(&String, &TableDef, &TableDef)> = vec![];
 
-    while fetch_local_tables.step()? == ResultCode::ROW {
-        let table_name = fetch_local_tables.column_text(0)?;
-        if mem_tables.contains(table_name) {
-            maybe_modified_tables.push(table_name.to_string());
-        } else {
-            removed_tables.push(table_name.to_string());
+    for (table, local_def) in local_tables.iter() {
+        match mem_tables.get(table) {
+            Some(mem_def) => maybe_modified_tables.push((table, local_def, mem_def)),
+            None => removed_tables.push(table),
         }
     }
 
     drop_tables(local_db, removed_tables)?;
-    for table in maybe_modified_tables {
-        maybe_modify_table(local_db, &table, &mem_db)?;
+    for (table, local_def, mem_def) in maybe_modified_tables {
+        maybe_modify_table(local_db, table, local_def, mem_def)?;
     }
     // no add tables. Schema file application will add tables.
     Ok(ResultCode::OK)
@@ -166,11 +309,11 @@ fn strip_crr_statements(schema: &str) -> String {
         .join("\n")
 }
 
-fn drop_tables(local_db: *mut sqlite3, tables: Vec<String>) -> Result<ResultCode, ResultCode> {
+fn drop_tables(local_db: *mut sqlite3, tables: Vec<&String>) -> Result<ResultCode, ResultCode> {
     for table in tables {
         local_db.exec_safe(&format!(
             "DROP TABLE \"{table}\"",
-            table = crate::util::escape_ident(&table)
+            table = crate::util::escape_ident(table)
         ))?;
     }
 
@@ -181,36 +324,32 @@ fn drop_tables(local_db: *mut sqlite3, tables: Vec<String>) -> Result<ResultCode
 fn maybe_modify_table(
     local_db: *mut sqlite3,
     table: &str,
-    mem_db: &ManagedConnection,
+    local_def: &TableDef,
+    mem_def: &TableDef,
 ) -> Result<ResultCode, ResultCode> {
-    let mut local_columns = BTreeSet::new();
-    let mut mem_columns = BTreeSet::new();
-
-    let sql = "SELECT name FROM pragma_table_info(?)";
-    let local_stmt = local_db.prepare_v2(sql)?;
-    let mem_stmt = mem_db.prepare_v2(sql)?;
-    local_stmt.bind_text(1, table, sqlite::Destructor::STATIC)?;
-    mem_stmt.bind_text(1, table, sqlite::Destructor::STATIC)?;
-
-    while mem_stmt.step()? == ResultCode::ROW {
-        mem_columns.insert(mem_stmt.column_text(0)?.to_string());
-    }
-
-    let mut removed_columns: Vec<String> = vec![];
-    let mut added_columns: Vec<String> = vec![];
-
-    while local_stmt.step()? == ResultCode::ROW {
-        let col_name = local_stmt.column_text(0)?;
-        local_columns.insert(col_name.to_string());
-        if !mem_columns.contains(col_name) {
-            removed_columns.push(col_name.to_string());
-        }
-    }
-
-    for mem_col in mem_columns {
-        if !local_columns.contains(&mem_col) {
-            added_columns.push(mem_col);
-        }
+    let removed_columns: Vec<&String> = local_def
+        .columns
+        .iter()
+        .filter(|local_col| !mem_def.columns.iter().any(|c| c.name == local_col.name))
+        .map(|local_col| &local_col.name)
+        .collect();
+    let added_columns: Vec<&ColumnDef> = mem_def
+        .columns
+        .iter()
+        .filter(|mem_col| !local_def.columns.iter().any(|c| c.name == mem_col.name))
+        .collect();
+    // SQLite does not support alter index statements. Indices that were removed or whose
+    // definition changed are dropped. Schema application will re-create the changed ones.
+    let removed_indices: Vec<&String> = local_def
+        .indices
+        .iter()
+        .filter(|(name, local_idx)| mem_def.indices.get(*name) != Some(local_idx))
+        .map(|(name, _)| name)
+        .collect();
+
+    if removed_columns.is_empty() && added_columns.is_empty() && removed_indices.is_empty() {
+        // Nothing to alter so the crr does not need to be re-created either.
+        return Ok(ResultCode::OK);
     }
 
     let is_a_crr = crate::is_crr(local_db, table)?;
@@ -221,8 +360,8 @@ fn maybe_modify_table(
     }
 
     drop_columns(local_db, table, removed_columns)?;
-    add_columns(local_db, table, added_columns, mem_db)?;
-    maybe_update_indices(local_db, table, mem_db)?;
+    add_columns(local_db, table, added_columns)?;
+    drop_indices(local_db, removed_indices)?;
 
     if is_a_crr {
         let stmt = local_db.prepare_v2("SELECT crsql_commit_alter(?)")?;
@@ -236,8 +375,11 @@ fn maybe_modify_table(
 fn drop_columns(
     local_db: *mut sqlite3,
     table: &str,
-    columns: Vec<String>,
+    columns: Vec<&String>,
 ) -> Result<ResultCode, ResultCode> {
+    if columns.is_empty() {
+        return Ok(ResultCode::OK);
+    }
     local_db.exec_safe(&format!(
         "DROP VIEW IF EXISTS \"{table}_fractindex\"",
         table = crate::util::escape_ident(table)
@@ -246,7 +388,7 @@ fn drop_columns(
         local_db.exec_safe(&format!(
             "ALTER TABLE \"{table}\" DROP \"{column}\"",
             table = crate::util::escape_ident(table),
-            column = crate::util::escape_ident(&col)
+            column = crate::util::escape_ident(col)
         ))?;
     }
 
@@ -256,43 +398,14 @@ fn drop_columns(
 fn add_columns(
     local_db: *mut sqlite3,
     table: &str,
-    columns: Vec<String>,
-    mem_db: &ManagedConnection,
+    columns: Vec<&ColumnDef>,
 ) -> Result<ResultCode, ResultCode> {
-    if columns.is_empty() {
-        return Ok(ResultCode::OK);
-    }
-    let sql = format!(
-        "SELECT name, type, \"notnull\", dflt_value, pk FROM pragma_table_info(?) WHERE name IN ({qs})",
-        qs = columns.iter().map(|_| "?").collect::<Vec<_>>().join(", "),
-    );
-    let stmt = mem_db.prepare_v2(&sql)?;
-    stmt.bind_text(1, table, sqlite::Destructor::STATIC)?;
-    let mut b = 2;
-    for col in &columns {
-        stmt.bind_text(b, &col, sqlite::Destructor::STATIC)?;
-        b += 1;
-    }
-
-    let mut processed_cols = 0;
-    while stmt.step()? == ResultCode::ROW {
-        let is_pk = stmt.column_int(4) == 1;
-
-        if is_pk {
+    for col in columns {
+        if col.pk {
             // We do not support adding PK columns to existing tables in auto-migration
             return Err(ResultCode::MISUSE);
         }
-
-        let name = stmt.column_text(0)?;
-        let col_type = stmt.column_text(1)?;
-        let notnull = stmt.column_int(2) == 1;
-        let dflt_val = stmt.column_value(3)?;
-
-        add_column(local_db, table, name, col_type, notnull, dflt_val)?;
-        processed_cols += 1;
-    }
-    if processed_cols != columns.len() {
-        return Err(ResultCode::ERROR_MISSING_COLLSEQ);
+        add_column(local_db, table, col)?;
     }
 
     Ok(ResultCode::OK)
@@ -301,153 +414,35 @@ fn add_columns(
 fn add_column(
     local_db: *mut sqlite3,
     table: &str,
-    name: &str,
-    col_type: &str,
-    notnull: bool,
-    dflt_val: *mut sqlite::value,
+    col: &ColumnDef,
 ) -> Result<ResultCode, ResultCode> {
     // ideally we'd extract out the SQL for the specific column
     // so we can get all constraints
     // as it is now, we don't support many things in auto-migration
-    let dflt_val_str = if dflt_val.value_type() == ColumnType::Null {
-        String::from("")
-    } else {
-        format!("DEFAULT {}", dflt_val.text())
+    let dflt_val_str = match &col.dflt_value {
+        Some(dflt_value) => format!("DEFAULT {}", dflt_value),
+        None => String::from(""),
     };
 
     local_db.exec_safe(&format!(
         "ALTER TABLE \"{table}\" ADD COLUMN \"{name}\" {col_type} {notnull} {dflt}",
         table = crate::util::escape_ident(table),
-        name = crate::util::escape_ident(name),
-        col_type = col_type,
-        notnull = if notnull { "NOT NULL " } else { "" },
+        name = crate::util::escape_ident(&col.name),
+        col_type = col.col_type,
+        notnull = if col.notnull { "NOT NULL " } else { "" },
         dflt = dflt_val_str
     ))
 }
 
-fn maybe_update_indices(
-    local_db: *mut sqlite3,
-    table: &str,
-    mem_db: &ManagedConnection,
-) -> Result<ResultCode, ResultCode> {
-    // We do not pull PK indices because we do not support alterations that changes
-    // primary key definitions.
-    // User would need to perform a manual migration for that.
-    // This is due to the fact that SQLite itself does not support changing primary key
-    // definitions in alter table statements.
-    let sql = "SELECT name FROM pragma_index_list(?) WHERE origin != 'pk';";
-    let local_fetch = local_db.prepare_v2(sql)?;
-    let mem_fetch = mem_db.prepare_v2(sql)?;
-    local_fetch.bind_text(1, table, sqlite::Destructor::STATIC)?;
-    mem_fetch.bind_text(1, table, sqlite::Destructor::STATIC)?;
-
-    let mut local_indices = BTreeSet::new();
-    let mut mem_indices = BTreeSet::new();
-
-    while mem_fetch.step()? == ResultCode::ROW {
-        mem_indices.insert(mem_fetch.column_text(0)?.to_string());
-    }
-
-    let mut removed: Vec<String> = vec![];
-    let mut maybe_modified: Vec<String> = vec![];
-
-    while local_fetch.step()? == ResultCode::ROW {
-        let name = local_fetch.column_text(0)?;
-        local_indices.insert(name.to_string());
-        if !mem_indices.contains(name) {
-            removed.push(name.to_string());
-        } else {
-            maybe_modified.push(name.to_string());
-        }
-    }
-
-    drop_indices(local_db, &removed)?;
-    // no add, schema file application will add
-
-    for idx in maybe_modified {
-        maybe_recreate_index(local_db, table, &idx, mem_db)?;
-    }
-
-    Ok(ResultCode::OK)
-}
-
-fn drop_indices(local_db: *mut sqlite3, dropped: &Vec<String>) -> Result<ResultCode, ResultCode> {
+fn drop_indices(local_db: *mut sqlite3, dropped: Vec<&String>) -> Result<ResultCode, ResultCode> {
     // drop if exists given column dropping could have destroyed the index
     // already.
     for idx in dropped {
         let sql = format!(
             "DROP INDEX IF EXISTS \"{}\"",
-            crate::util::escape_ident(&idx)
+            crate::util::escape_ident(idx)
         );
-        if let Err(e) = local_db.exec_safe(&sql) {
-            return Err(e);
-        }
+        local_db.exec_safe(&sql)?;
     }
     Ok(ResultCode::OK)
 }
-
-/**
-* SQLite does not support alter index statements.
-* What we are doing here is looking to see if indices with the same
-* name have different definitions.
-*
-* If so, drop the index and re-create it with the new definiton.
-*/
-fn maybe_recreate_index(
-    local_db: *mut sqlite3,
-    table: &str,
-    idx: &str,
-    mem_db: &ManagedConnection,
-) -> Result<ResultCode, ResultCode> {
-    let fetch_is_unique_mem = mem_db.prepare_v2(IS_UNIQUE_IDX_SQL)?;
-    fetch_is_unique_mem.bind_text(1, table, sqlite::Destructor::STATIC)?;
-    fetch_is_unique_mem.bind_text(2, idx, sqlite::Destructor::STATIC)?;
-    let fetch_is_unique_local = local_db.prepare_v2(IS_UNIQUE_IDX_SQL)?;
-    fetch_is_unique_local.bind_text(1, table, sqlite::Destructor::STATIC)?;
-    fetch_is_unique_local.bind_text(2, idx, sqlite::Destructor::STATIC)?;
-
-    if fetch_is_unique_mem.step()? != ResultCode::ROW
-        || fetch_is_unique_local.step()? != ResultCode::ROW
-    {
-        return Err(ResultCode::CONSTRAINT);
-    }
-
-    if fetch_is_unique_mem.column_int(0) != fetch_is_unique_local.column_int(0) {
-        // We cannot alter a table against which we have open statements
-        // drop to finalize those statements
-        drop(fetch_is_unique_mem);
-        drop(fetch_is_unique_local);
-        return recreate_index(local_db, idx);
-    }
-
-    let fetch_idx_cols_mem = mem_db.prepare_v2(IDX_COLS_SQL)?;
-    let fetch_idx_cols_local = local_db.prepare_v2(IDX_COLS_SQL)?;
-
-    let mem_result = fetch_idx_cols_mem.step()?;
-    let local_result = fetch_idx_cols_local.step()?;
-    while mem_result == ResultCode::ROW && local_result == ResultCode::ROW {
-        if fetch_idx_cols_mem.column_text(0) != fetch_idx_cols_local.column_text(0) {
-            // We cannot alter a table against which we have open statements
-            // drop to finalize those statements
-            drop(fetch_idx_cols_local);
-            drop(fetch_idx_cols_mem);
-            return recreate_index(local_db, idx);
-        }
-        fetch_idx_cols_mem.step()?;
-        fetch_idx_cols_local.step()?;
-    }
-
-    if mem_result != local_result {
-        return recreate_index(local_db, idx);
-    }
-
-    Ok(ResultCode::OK)
-}
-
-fn recreate_index(local_db: *mut sqlite3, idx: &str) -> Result<ResultCode, ResultCode> {
-    let indices = vec![idx.to_string()];
-    drop_indices(local_db, &indices)?;
-    // no need to call add_indices
-    // they'll be added later with schema reapplication
-    Ok(ResultCode::OK)
-}
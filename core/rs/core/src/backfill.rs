@@ -1,10 +1,18 @@
-use sqlite_nostd::{sqlite3, Connection, Destructor, ManagedStmt, ResultCode};
+use sqlite_nostd::{sqlite3, Connection, Context, Destructor, ManagedStmt, ResultCode, Value};
 extern crate alloc;
-use crate::tableinfo::ColumnInfo;
+use crate::c::crsql_ExtData;
+use crate::create_crr::create_crr_without_backfill;
+use crate::pack_columns::{bind_package_to_stmt, unpack_columns_ref};
+use crate::stats;
+use crate::tableinfo::{pull_table_info, ColumnInfo};
 use crate::util::get_dflt_value;
+use alloc::ffi::CString;
 use alloc::format;
-use alloc::string::String;
+use alloc::string::{String, ToString};
 use alloc::{vec, vec::Vec};
+use core::ffi::c_char;
+use core::ptr::null_mut;
+use sqlite::ColumnType;
 use sqlite_nostd as sqlite;
 
 /**
@@ -63,6 +71,16 @@ pub fn backfill_table(
         return Err(e);
     }
 
+    if !is_commit_alter {
+        if let Err(e) = persist_backfilled_db_version(db, table) {
+            if !no_tx {
+                db.exec_safe("ROLLBACK")?;
+            }
+
+            return Err(e);
+        }
+    }
+
     if !no_tx {
         db.exec_safe("RELEASE backfill")
     } else {
@@ -70,6 +88,247 @@ pub fn backfill_table(
     }
 }
 
+/**
+ * Turns a table into a crr a batch of rows at a time rather than in one transaction.
+ *
+ * `SELECT crsql_backfill_step('foo', 50000)`
+ *
+ * The first call creates the clock table and triggers. Every call, the first included,
+ * then creates the clock rows for the next `batch_size` rows in primary key order and records
+ * the primary key it stopped at in `crsql_master` as part of the same transaction.
+ * Run each call in its own transaction so writers get in between batches and a backfill
+ * that is interrupted picks up after the last committed batch.
+ *
+ * It also finishes the backfill left by `crsql_commit_alter(schema, table, 1)` after a primary
+ * key change. Those clock rows are written at the current db version, as a migration's are.
+ *
+ * Returns the number of rows backfilled, 0 once the whole table has been.
+ * `backfilled_rows` in `crsql_stats` has the rows backfilled and the time it took.
+ */
+pub unsafe extern "C" fn crsql_backfill_step(
+    ctx: *mut sqlite::context,
+    argc: i32,
+    argv: *mut *mut sqlite::value,
+) {
+    if argc != 2 {
+        ctx.result_error("crsql_backfill_step expects a table name and a batch size");
+        return;
+    }
+    let args = sqlite::args!(argc, argv);
+    let table = args[0].text();
+    let batch_size = args[1].int64();
+    if args[1].value_type() != ColumnType::Integer || batch_size <= 0 {
+        ctx.result_error("crsql_backfill_step batch size must be a positive integer");
+        ctx.result_error_code(ResultCode::MISUSE);
+        return;
+    }
+
+    let ext_data = ctx.user_data() as *mut crsql_ExtData;
+    let db = ctx.db_handle();
+    if let Err(_) = db.exec_safe("SAVEPOINT backfill_step") {
+        ctx.result_error("failed to start backfill_step savepoint");
+        return;
+    }
+
+    let mut err_msg: *mut c_char = null_mut();
+    let start = stats::now();
+    match backfill_step(db, table, batch_size, &mut err_msg as *mut _) {
+        Ok(rows) => {
+            if let Err(_) = db.exec_safe("RELEASE backfill_step") {
+                ctx.result_error("failed to release backfill_step savepoint");
+                return;
+            }
+            stats::get_stats(ext_data).backfilled_rows.add(rows, start);
+            ctx.result_int64(rows);
+        }
+        Err(rc) => {
+            if err_msg.is_null() {
+                ctx.result_error("failed to backfill table");
+            } else {
+                let msg = CString::from_raw(err_msg);
+                ctx.result_error(msg.to_str().unwrap_or("failed to backfill table"));
+            }
+            ctx.result_error_code(rc);
+            // Only undo this step. The caller's transaction is theirs to keep or roll back.
+            let _ = db.exec_safe("ROLLBACK TO backfill_step; RELEASE backfill_step");
+        }
+    }
+}
+
+fn backfill_step(
+    db: *mut sqlite3,
+    table: &str,
+    batch_size: i64,
+    err: *mut *mut c_char,
+) -> Result<i64, ResultCode> {
+    let (table_info, progress) = match create_crr_without_backfill(db, table, err)? {
+        Some(table_info) => (table_info, start_backfill(db, table, false)?),
+        None => match get_backfill_progress(db, table)? {
+            // Already a crr and not being backfilled.
+            None => return Ok(0),
+            Some(progress) => (pull_table_info(db, table, err)?, progress),
+        },
+    };
+    let progress_key = &progress.key;
+    let cursor = &progress.last_pks;
+
+    let pk_list = crate::util::as_identifier_list(&table_info.pks, None)?;
+    let sql = format!(
+        "SELECT {pk_list}, crsql_pack_columns({pk_list}) FROM \"{table}\" {after_cursor}
+          ORDER BY {pk_list} LIMIT ?",
+        table = crate::util::escape_ident(table),
+        after_cursor = if cursor.is_some() {
+            format!(
+                "WHERE ({pk_list}) > ({})",
+                crate::util::binding_list(table_info.pks.len())
+            )
+        } else {
+            String::from("")
+        },
+    );
+    let read_stmt = db.prepare_v2(&sql)?;
+    let mut limit_slot = 1;
+    if let Some(cursor) = cursor {
+        bind_package_to_stmt(read_stmt.stmt, &unpack_columns_ref(cursor)?, 0)?;
+        limit_slot += table_info.pks.len() as i32;
+    }
+    read_stmt.bind_int64(limit_slot, batch_size)?;
+
+    let writer = ClockRowWriter::new(db, table, &table_info.pks, progress.is_commit_alter)?;
+    let non_pk_cols = table_info.non_pks.iter().collect::<Vec<_>>();
+    let mut rows = 0;
+    while read_stmt.step()? == ResultCode::ROW {
+        writer.write(&read_stmt, &table_info.pks, &non_pk_cols)?;
+        rows += 1;
+        if rows == batch_size {
+            let last_pks = read_stmt.column_blob(table_info.pks.len() as i32)?;
+            set_backfill_progress(db, progress_key, Some(last_pks))?;
+        }
+    }
+    if rows < batch_size {
+        // Ran out of rows so the table is done.
+        let stmt = db.prepare_v2("DELETE FROM crsql_master WHERE key = ?")?;
+        stmt.bind_text(1, progress_key, Destructor::STATIC)?;
+        stmt.step()?;
+    }
+
+    if !progress.is_commit_alter {
+        persist_backfilled_db_version(db, table)?;
+    }
+    Ok(rows)
+}
+
+/**
+ * Where a backfill run through `crsql_backfill_step` got to.
+ */
+pub struct BackfillProgress {
+    // Key of the row in `crsql_master` recording the progress.
+    key: String,
+    // Backfills left by `crsql_commit_alter` write clocks at the current db version, as a
+    // migration does, rather than at a new one.
+    is_commit_alter: bool,
+    // The packed primary key of the last row backfilled, if there is one yet.
+    last_pks: Option<Vec<u8>>,
+}
+
+fn backfill_progress_key(table: &str, is_commit_alter: bool) -> String {
+    if is_commit_alter {
+        format!("alter_backfill.{}", table)
+    } else {
+        format!("backfill.{}", table)
+    }
+}
+
+/**
+ * Records that `table` has rows still to be backfilled by `crsql_backfill_step`,
+ * starting from its first row.
+ */
+pub fn start_backfill(
+    db: *mut sqlite3,
+    table: &str,
+    is_commit_alter: bool,
+) -> Result<BackfillProgress, ResultCode> {
+    let progress = BackfillProgress {
+        key: backfill_progress_key(table, is_commit_alter),
+        is_commit_alter,
+        last_pks: None,
+    };
+    set_backfill_progress(db, &progress.key, None)?;
+    Ok(progress)
+}
+
+/**
+ * Forgets any backfill of `table` left unfinished.
+ */
+pub fn clear_backfill(db: *mut sqlite3, table: &str) -> Result<ResultCode, ResultCode> {
+    let stmt = db.prepare_v2("DELETE FROM crsql_master WHERE key IN (?, ?)")?;
+    let as_crr_key = backfill_progress_key(table, false);
+    let alter_key = backfill_progress_key(table, true);
+    stmt.bind_text(1, &as_crr_key, Destructor::STATIC)?;
+    stmt.bind_text(2, &alter_key, Destructor::STATIC)?;
+    stmt.step()
+}
+
+/**
+ * `None` if the table is not being backfilled. A backfill left by `crsql_commit_alter` is
+ * finished before one left by `crsql_as_crr`.
+ */
+fn get_backfill_progress(
+    db: *mut sqlite3,
+    table: &str,
+) -> Result<Option<BackfillProgress>, ResultCode> {
+    let stmt = db.prepare_v2(
+        "SELECT key, value FROM crsql_master WHERE key IN (?1, ?2) ORDER BY key = ?2 DESC LIMIT 1",
+    )?;
+    let as_crr_key = backfill_progress_key(table, false);
+    let alter_key = backfill_progress_key(table, true);
+    stmt.bind_text(1, &as_crr_key, Destructor::STATIC)?;
+    stmt.bind_text(2, &alter_key, Destructor::STATIC)?;
+    if stmt.step()? != ResultCode::ROW {
+        return Ok(None);
+    }
+    let key = stmt.column_text(0)?.to_string();
+    let last_pks = if stmt.column_type(1)? == ColumnType::Null {
+        None
+    } else {
+        Some(stmt.column_blob(1)?.to_vec())
+    };
+    Ok(Some(BackfillProgress {
+        is_commit_alter: key == alter_key,
+        key,
+        last_pks,
+    }))
+}
+
+fn set_backfill_progress(
+    db: *mut sqlite3,
+    progress_key: &str,
+    last_pks: Option<&[u8]>,
+) -> Result<ResultCode, ResultCode> {
+    let stmt = db.prepare_v2("INSERT OR REPLACE INTO crsql_master (key, value) VALUES (?, ?)")?;
+    stmt.bind_text(1, progress_key, Destructor::STATIC)?;
+    match last_pks {
+        Some(last_pks) => stmt.bind_blob(2, last_pks, Destructor::STATIC)?,
+        None => stmt.bind_null(2)?,
+    };
+    stmt.step()
+}
+
+/**
+ * Backfilled clock rows are written with `crsql_next_db_version()` which, unlike the
+ * write paths, does not persist the version it hands out.
+ */
+fn persist_backfilled_db_version(db: *mut sqlite3, table: &str) -> Result<ResultCode, ResultCode> {
+    db.exec_safe(&format!(
+        "INSERT INTO \"{db_version_tbl}\" (id, db_version)
+          SELECT 0, max(db_version) FROM \"{table}__crsql_clock\" HAVING max(db_version) IS NOT NULL
+          ON CONFLICT (id) DO UPDATE SET db_version = excluded.db_version
+          WHERE excluded.db_version > db_version",
+        db_version_tbl = crate::consts::TBL_DB_VERSION,
+        table = crate::util::escape_ident(table),
+    ))
+}
+
 /**
 * Given a statement that returns rows in the source table not present
 * in the clock table, create those rows in the clock table.
@@ -82,43 +341,83 @@ fn create_clock_rows_from_stmt(
     non_pk_cols: &Vec<&ColumnInfo>,
     is_commit_alter: bool,
 ) -> Result<ResultCode, ResultCode> {
-    let select_key = db.prepare_v2(&format!(
-        "SELECT __crsql_key FROM \"{table}__crsql_pks\" WHERE {pk_where_conditions}",
-        table = crate::util::escape_ident(table),
-        pk_where_conditions = crate::util::where_list(pk_cols, None)?
-    ))?;
-    let create_key = db.prepare_v2(&format!(
-        "INSERT INTO \"{table}__crsql_pks\" ({pk_cols}) VALUES ({pk_values}) RETURNING __crsql_key",
-        table = crate::util::escape_ident(table),
-        pk_cols = pk_cols
-            .iter()
-            .map(|f| format!("\"{}\"", crate::util::escape_ident(&f.name)))
-            .collect::<Vec<_>>()
-            .join(", "),
-        pk_values = pk_cols.iter().map(|_| "?").collect::<Vec<_>>().join(", "),
-    ))?;
-    // We do not grab nextdbversion on migration.
-    // The idea is that other nodes will apply the same migration
-    // in the future so if they have already seen this node up
-    // to the current db version then the migration will place them into the correct
-    // state. No need to re-sync post migration.
-    // or-ignore since we do not drop sentinel values during compaction as they act as our metadata
-    // to determine if rows should resurrect on a future insertion event provided by a peer.
-    let sql = format!(
-        "INSERT OR IGNORE INTO \"{table}__crsql_clock\"
-          (key, col_name, col_version, db_version, seq) VALUES
-          (?, ?, 1, {dbversion_getter}, crsql_increment_and_get_seq())",
-        table = crate::util::escape_ident(table),
-        dbversion_getter = if is_commit_alter {
-            "crsql_db_version()"
-        } else {
-            "crsql_next_db_version()"
-        }
-    );
-    let write_stmt = db.prepare_v2(&sql)?;
-
+    let writer = ClockRowWriter::new(db, table, pk_cols, is_commit_alter)?;
     while read_stmt.step()? == ResultCode::ROW {
-        let key = get_or_create_key(&select_key, &create_key, pk_cols, &read_stmt)?;
+        writer.write(&read_stmt, pk_cols, non_pk_cols)?;
+    }
+
+    Ok(ResultCode::OK)
+}
+
+/**
+ * The statements needed to create the clock rows of a row read from the source table.
+ */
+struct ClockRowWriter {
+    select_key: ManagedStmt,
+    create_key: ManagedStmt,
+    write_stmt: ManagedStmt,
+}
+
+impl ClockRowWriter {
+    fn new(
+        db: *mut sqlite3,
+        table: &str,
+        pk_cols: &Vec<ColumnInfo>,
+        is_commit_alter: bool,
+    ) -> Result<Self, ResultCode> {
+        let select_key = db.prepare_v2(&format!(
+            "SELECT __crsql_key FROM \"{table}__crsql_pks\" WHERE {pk_where_conditions}",
+            table = crate::util::escape_ident(table),
+            pk_where_conditions = crate::util::where_list(pk_cols, None)?
+        ))?;
+        let create_key = db.prepare_v2(&format!(
+            "INSERT INTO \"{table}__crsql_pks\" ({pk_cols}) VALUES ({pk_values}) RETURNING __crsql_key",
+            table = crate::util::escape_ident(table),
+            pk_cols = pk_cols
+                .iter()
+                .map(|f| format!("\"{}\"", crate::util::escape_ident(&f.name)))
+                .collect::<Vec<_>>()
+                .join(", "),
+            pk_values = pk_cols.iter().map(|_| "?").collect::<Vec<_>>().join(", "),
+        ))?;
+        // We do not grab nextdbversion on migration.
+        // The idea is that other nodes will apply the same migration
+        // in the future so if they have already seen this node up
+        // to the current db version then the migration will place them into the correct
+        // state. No need to re-sync post migration.
+        // or-ignore since we do not drop sentinel values during compaction as they act as our metadata
+        // to determine if rows should resurrect on a future insertion event provided by a peer.
+        let sql = format!(
+            "INSERT OR IGNORE INTO \"{table}__crsql_clock\"
+              (key, col_name, col_version, db_version, seq) VALUES
+              (?, ?, 1, {dbversion_getter}, crsql_increment_and_get_seq())",
+            table = crate::util::escape_ident(table),
+            dbversion_getter = if is_commit_alter {
+                "crsql_db_version()"
+            } else {
+                "crsql_next_db_version()"
+            }
+        );
+        let write_stmt = db.prepare_v2(&sql)?;
+
+        Ok(ClockRowWriter {
+            select_key,
+            create_key,
+            write_stmt,
+        })
+    }
+
+    /**
+     * Creates the clock rows for the row `read_stmt` is on. Its first columns must be the pks.
+     */
+    fn write(
+        &self,
+        read_stmt: &ManagedStmt,
+        pk_cols: &Vec<ColumnInfo>,
+        non_pk_cols: &Vec<&ColumnInfo>,
+    ) -> Result<ResultCode, ResultCode> {
+        let key = get_or_create_key(&self.select_key, &self.create_key, pk_cols, read_stmt)?;
+        let write_stmt = &self.write_stmt;
         write_stmt.bind_int64(1, key)?;
 
         for col in non_pk_cols.iter() {
@@ -133,9 +432,9 @@ fn create_clock_rows_from_stmt(
             write_stmt.step()?;
             write_stmt.reset()?;
         }
-    }
 
-    Ok(ResultCode::OK)
+        Ok(ResultCode::OK)
+    }
 }
 
 fn get_or_create_key(
@@ -173,8 +472,8 @@ fn get_or_create_key(
 * For each column, make sure there was a clock table entry.
 * If not, fill the data in for it for each row.
 *
-* Can we optimize and skip cases where it is equivalent to the default value?
-* E.g., adding a new column set to default values should not require a backfill...
+* Rows whose value is the column's default are skipped.
+* This is done in a single `INSERT ... SELECT` that visits each row once for all columns.
 */
 fn backfill_missing_columns(
     db: *mut sqlite3,
@@ -183,37 +482,45 @@ fn backfill_missing_columns(
     non_pk_cols: &Vec<ColumnInfo>,
     is_commit_alter: bool,
 ) -> Result<ResultCode, ResultCode> {
-    for non_pk_col in non_pk_cols {
-        fill_column(db, table, pk_cols, &non_pk_col, is_commit_alter)?;
+    if non_pk_cols.len() == 0 {
+        return Ok(ResultCode::OK);
     }
 
-    Ok(ResultCode::OK)
-}
+    // A row per column and, for each, when a row needs a clock entry for it.
+    let mut col_names = vec![];
+    let mut needs_clock = vec![];
+    for non_pk_col in non_pk_cols {
+        let col_name = crate::util::escape_ident_as_value(&non_pk_col.name);
+        col_names.push(format!("SELECT '{col_name}' AS name"));
+        needs_clock.push(format!(
+            "WHEN '{col_name}' THEN {condition}",
+            condition = match get_dflt_value(db, table, &non_pk_col.name)? {
+                Some(dflt) => format!(
+                    "t1.\"{}\" IS NOT {}",
+                    crate::util::escape_ident(&non_pk_col.name),
+                    dflt
+                ),
+                None => String::from("1"),
+            }
+        ));
+    }
 
-// This doesn't fill compeltely new columns...
-// Wel... does it not? The on condition x left join should do it.
-fn fill_column(
-    db: *mut sqlite3,
-    table: &str,
-    pk_cols: &Vec<ColumnInfo>,
-    non_pk_col: &ColumnInfo,
-    is_commit_alter: bool,
-) -> Result<ResultCode, ResultCode> {
-    // Only fill rows for which
-    // - a row does not exist for that pk combo _and_ the cid in the clock table.
-    // - the value is not the default value for that column.
-    let dflt_value = get_dflt_value(db, table, &non_pk_col.name)?;
-    let sql = format!(
-        "SELECT {pk_cols} FROM {table} as t1
-          JOIN \"{table}__crsql_pks\" as t2 ON {pk_on_conditions}
-          LEFT JOIN \"{table}__crsql_clock\" as t3 ON t3.key = t2.__crsql_key AND t3.col_name = ?
-          WHERE t3.key IS NULL {dflt_value_condition}",
+    db.exec_safe(&format!(
+        "INSERT INTO \"{table}__crsql_clock\" (key, col_name, col_version, db_version, seq)
+          SELECT t2.__crsql_key, cols.name, 1, {dbversion_getter}, crsql_increment_and_get_seq()
+          FROM \"{table}\" AS t1
+          JOIN \"{table}__crsql_pks\" AS t2 ON {pk_on_conditions}
+          JOIN ({col_names}) AS cols
+          WHERE NOT EXISTS (
+            SELECT 1 FROM \"{table}__crsql_clock\" AS t3
+            WHERE t3.key = t2.__crsql_key AND t3.col_name = cols.name
+          ) AND CASE cols.name {needs_clock} END",
         table = crate::util::escape_ident(table),
-        pk_cols = pk_cols
-            .iter()
-            .map(|f| format!("t1.\"{}\"", crate::util::escape_ident(&f.name)))
-            .collect::<Vec<_>>()
-            .join(", "),
+        dbversion_getter = if is_commit_alter {
+            "crsql_db_version()"
+        } else {
+            "crsql_next_db_version()"
+        },
         pk_on_conditions = pk_cols
             .iter()
             .map(|f| format!(
@@ -223,16 +530,7 @@ fn fill_column(
             ))
             .collect::<Vec<_>>()
             .join(" AND "),
-        dflt_value_condition = if let Some(dflt) = dflt_value {
-            format!("AND t1.\"{}\" IS NOT {}", &non_pk_col.name, dflt)
-        } else {
-            String::from("")
-        },
-    );
-    let read_stmt = db.prepare_v2(&sql)?;
-    read_stmt.bind_text(1, &non_pk_col.name, Destructor::STATIC)?;
-
-    // TODO: rm clone?
-    let non_pk_cols = vec![non_pk_col];
-    create_clock_rows_from_stmt(read_stmt, db, table, pk_cols, &non_pk_cols, is_commit_alter)
+        col_names = col_names.join(" UNION ALL "),
+        needs_clock = needs_clock.join(" "),
+    ))
 }
@@ -1,7 +1,9 @@
 use core::ffi::{c_char, c_int};
 
+use crate::util::get_db_version_union_query;
 use crate::{consts, tableinfo::TableInfo};
-use alloc::{ffi::CString, format};
+use alloc::string::ToString;
+use alloc::{ffi::CString, format, vec};
 use core::slice;
 use sqlite::{sqlite3, Connection, Destructor, ResultCode};
 use sqlite_nostd as sqlite;
@@ -165,6 +167,12 @@ fn maybe_update_db_inner(
     //     update_to_0_15_0(db)?;
     // }
 
+    if !has_table(db, consts::TBL_DB_VERSION)? {
+        create_db_version_table(db)?;
+    }
+
+    update_clock_indices(db)?;
+
     // write the db version if we migrated to a new one or we are a blank slate db
     if recorded_version < consts::CRSQLITE_VERSION || is_blank_slate {
         let stmt =
@@ -176,6 +184,75 @@ fn maybe_update_db_inner(
     Ok(ResultCode::OK)
 }
 
+/**
+ * Creates the single row table that holds the db version.
+ *
+ * The row is seeded from the clock tables, which were the only record of the db version
+ * before this table existed. After that the write paths keep it up to date so reading
+ * the db version no longer depends on how many crrs exist.
+ */
+fn create_db_version_table(db: *mut sqlite3) -> Result<ResultCode, ResultCode> {
+    db.exec_safe(&format!(
+        "CREATE TABLE \"{tbl}\" (id INTEGER PRIMARY KEY CHECK (id = 0), db_version INTEGER NOT NULL);",
+        tbl = consts::TBL_DB_VERSION
+    ))?;
+
+    let mut clock_tbl_names = vec![];
+    let stmt = db.prepare_v2(
+        "SELECT tbl_name FROM sqlite_master WHERE type='table' AND tbl_name LIKE '%__crsql_clock'",
+    )?;
+    while stmt.step()? == ResultCode::ROW {
+        clock_tbl_names.push(stmt.column_text(0)?.to_string());
+    }
+
+    let seed = if clock_tbl_names.len() == 0 {
+        format!("{}", consts::MIN_POSSIBLE_DB_VERSION)
+    } else {
+        format!(
+            "coalesce(({}), {})",
+            get_db_version_union_query(&clock_tbl_names),
+            consts::MIN_POSSIBLE_DB_VERSION
+        )
+    };
+    db.exec_safe(&format!(
+        "INSERT INTO \"{tbl}\" (id, db_version) VALUES (0, {seed});",
+        tbl = consts::TBL_DB_VERSION,
+        seed = seed
+    ))
+}
+
+/**
+ * Clock tables created before their index covered `seq` have an index on `db_version` alone.
+ * That index is replaced so that changes are read in `(db_version, seq)` order without sorting
+ * the changes of each db version.
+ */
+fn update_clock_indices(db: *mut sqlite3) -> Result<ResultCode, ResultCode> {
+    let mut clock_tbl_names = vec![];
+    let stmt = db.prepare_v2(
+        "SELECT tbl_name FROM sqlite_master AS m WHERE type = 'table' AND tbl_name LIKE '%__crsql_clock'
+        AND NOT EXISTS (SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = m.tbl_name || '_dbv_seq_idx')",
+    )?;
+    while stmt.step()? == ResultCode::ROW {
+        clock_tbl_names.push(stmt.column_text(0)?.to_string());
+    }
+
+    for clock_tbl_name in clock_tbl_names {
+        db.exec_safe(&format!(
+            "DROP INDEX IF EXISTS \"{clock_tbl_name}_dbv_idx\"",
+            clock_tbl_name = crate::util::escape_ident(&clock_tbl_name),
+        ))?;
+        create_clock_index(db, &clock_tbl_name)?;
+    }
+    Ok(ResultCode::OK)
+}
+
+fn create_clock_index(db: *mut sqlite3, clock_tbl_name: &str) -> Result<ResultCode, ResultCode> {
+    db.exec_safe(&format!(
+        "CREATE INDEX IF NOT EXISTS \"{clock_tbl_name}_dbv_seq_idx\" ON \"{clock_tbl_name}\" (\"db_version\", \"seq\")",
+        clock_tbl_name = crate::util::escape_ident(clock_tbl_name),
+    ))
+}
+
 /**
  * The clock table holds the versions for each column of a given row.
  *
@@ -213,11 +290,8 @@ pub fn create_clock_table(
         table_name = crate::util::escape_ident(table_name),
     ))?;
 
-    db.exec_safe(
-      &format!(
-        "CREATE INDEX IF NOT EXISTS \"{table_name}__crsql_clock_dbv_idx\" ON \"{table_name}__crsql_clock\" (\"db_version\")",
-        table_name = crate::util::escape_ident(table_name),
-      ))?;
+    // Changes are read in `(db_version, seq)` order.
+    create_clock_index(db, &format!("{}__crsql_clock", table_name))?;
     db.exec_safe(
       &format!(
         "CREATE TABLE IF NOT EXISTS \"{table_name}__crsql_pks\" (__crsql_key INTEGER PRIMARY KEY, {pk_list})",
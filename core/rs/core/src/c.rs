@@ -68,6 +68,14 @@ pub struct crsql_ExtData {
     pub pSelectSiteIdOrdinalStmt: *mut sqlite::stmt,
     pub pSelectClockTablesStmt: *mut sqlite::stmt,
     pub mergeEqualValues: ::core::ffi::c_int,
+    pub tableInfosByName: *mut ::core::ffi::c_void,
+    pub dataVersionCheckedThisTx: ::core::ffi::c_int,
+    pub pSetDbVersionStmt: *mut sqlite::stmt,
+    pub stats: *mut ::core::ffi::c_void,
+    pub stmtCacheSize: ::core::ffi::c_int,
+    pub stmtUseClock: sqlite::int64,
+    pub alterSnapshots: *mut ::core::ffi::c_void,
+    pub coalesceLocalWrites: ::core::ffi::c_int,
 }
 
 #[repr(C)]
@@ -91,6 +99,7 @@ pub struct crsql_Changes_cursor {
     pub rowType: ::core::ffi::c_int,
     pub changesRowid: sqlite::int64,
     pub tblInfoIdx: ::core::ffi::c_int,
+    pub pReadState: *mut ::core::ffi::c_void,
 }
 
 extern "C" {
@@ -166,7 +175,7 @@ fn bindgen_test_layout_crsql_Changes_cursor() {
     let ptr = UNINIT.as_ptr();
     assert_eq!(
         ::core::mem::size_of::<crsql_Changes_cursor>(),
-        64usize,
+        72usize,
         concat!("Size of: ", stringify!(crsql_Changes_cursor))
     );
     assert_eq!(
@@ -254,6 +263,16 @@ fn bindgen_test_layout_crsql_Changes_cursor() {
             stringify!(tblInfoIdx)
         )
     );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).pReadState) as usize - ptr as usize },
+        64usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_Changes_cursor),
+            "::",
+            stringify!(pReadState)
+        )
+    );
 }
 
 #[test]
@@ -263,7 +282,7 @@ fn bindgen_test_layout_crsql_ExtData() {
     let ptr = UNINIT.as_ptr();
     assert_eq!(
         ::core::mem::size_of::<crsql_ExtData>(),
-        136usize,
+        200usize,
         concat!("Size of: ", stringify!(crsql_ExtData))
     );
     assert_eq!(
@@ -463,4 +482,84 @@ fn bindgen_test_layout_crsql_ExtData() {
             stringify!(mergeEqualValues)
         )
     );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).tableInfosByName) as usize - ptr as usize },
+        136usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(tableInfosByName)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).dataVersionCheckedThisTx) as usize - ptr as usize },
+        144usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(dataVersionCheckedThisTx)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).pSetDbVersionStmt) as usize - ptr as usize },
+        152usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(pSetDbVersionStmt)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).stats) as usize - ptr as usize },
+        160usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(stats)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).stmtCacheSize) as usize - ptr as usize },
+        168usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(stmtCacheSize)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).stmtUseClock) as usize - ptr as usize },
+        176usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(stmtUseClock)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).alterSnapshots) as usize - ptr as usize },
+        184usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(alterSnapshots)
+        )
+    );
+    assert_eq!(
+        unsafe { ::core::ptr::addr_of!((*ptr).coalesceLocalWrites) as usize - ptr as usize },
+        192usize,
+        concat!(
+            "Offset of field: ",
+            stringify!(crsql_ExtData),
+            "::",
+            stringify!(coalesceLocalWrites)
+        )
+    );
 }
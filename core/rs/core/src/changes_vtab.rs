@@ -2,47 +2,207 @@ extern crate alloc;
 use crate::alloc::string::ToString;
 use crate::changes_vtab_write::crsql_merge_insert;
 use crate::stmt_cache::reset_cached_stmt;
-use crate::tableinfo::{crsql_ensure_table_infos_are_up_to_date, TableInfo};
+use crate::tableinfo::{
+    crsql_clear_merged_rows, crsql_ensure_table_infos_are_up_to_date, find_table_info_index,
+    TableInfo,
+};
 use alloc::boxed::Box;
+use alloc::collections::BinaryHeap;
 use alloc::format;
 use alloc::string::String;
 use alloc::vec::Vec;
-use core::ffi::{c_char, c_int, CStr};
-use core::mem::{self, forget};
+use core::cmp::Reverse;
+use core::ffi::{c_char, c_int, c_void, CStr};
+use core::mem;
 use core::ptr::null_mut;
 
 use alloc::ffi::CString;
 #[cfg(not(feature = "std"))]
 use num_traits::FromPrimitive;
-use sqlite::{ColumnType, Connection, Context, Stmt, Value};
+use sqlite::{ColumnType, Connection, Context, ManagedStmt, Stmt, Value};
 use sqlite_nostd as sqlite;
 use sqlite_nostd::ResultCode;
 
 use crate::c::{
-    crsql_Changes_cursor, crsql_Changes_vtab, ChangeRowType, ClockUnionColumn, CrsqlChangesColumn,
+    crsql_Changes_cursor, crsql_Changes_vtab, crsql_ExtData, ChangeRowType, ClockUnionColumn,
+    CrsqlChangesColumn,
 };
-use crate::changes_vtab_read::changes_union_query;
+use crate::changes_vtab_read::{changes_query_for_table, changes_union_query};
 use crate::pack_columns::bind_package_to_stmt;
-use crate::pack_columns::unpack_columns;
+use crate::pack_columns::unpack_columns_ref;
+
+/// Bit set in `idxNum` when changes are requested in `(db_vrsn, seq)` order.
+/// Such queries are served by merging per clock table statements
+/// rather than sorting the union of all clock tables.
+const IDX_MERGE_ORDERED: c_int = 8;
+/// Bit set in `idxNum` when only the changes of the table named by a `[table] =` constraint
+/// are requested. Its value is passed after those of the clock table constraints.
+const IDX_TBL: c_int = 16;
+/// Bit set in `idxNum` when only the changes of the row with the primary key of a `pk =`
+/// constraint are requested. Its value is passed after the table's.
+const IDX_PK: c_int = 32;
+/// Bit set in `idxNum`, along with `IDX_MERGE_ORDERED`, when changes are requested in
+/// descending `(db_vrsn, seq)` order.
+const IDX_MERGE_DESC: c_int = 64;
+/// Bit set in `idxNum` when no more than the `LIMIT` of the query need be read.
+/// Its value is passed last.
+const IDX_LIMIT: c_int = 128;
+
+/// Rows SQLite assumes a table has when it has no statistics for it.
+const DEFAULT_CLOCK_TABLE_ROWS: i64 = 1048576;
+/// Rough number of clock rows, one per column, a single row has.
+const ROW_CLOCK_ROWS: i64 = 10;
+
+/// Rust owned state for the query a cursor is running.
+/// Lives in `crsql_Changes_cursor.pReadState`.
+pub struct ChangesReadState {
+    // Statements producing changes. When merging, one per clock table, each
+    // returning changes in (db_vrsn, seq) order. Otherwise a single union query
+    // already in the requested order.
+    streams: Vec<ManagedStmt>,
+    // (db_vrsn, seq, stream) of the next row of each stream that has rows left.
+    // When reading in descending order db_vrsn and seq are stored inverted.
+    heads: BinaryHeap<Reverse<(i64, i64, usize)>>,
+    desc: bool,
+    // Stream the cursor is currently positioned on.
+    current: Option<usize>,
+    // Per table statements selecting all non-pk columns of a row, indexed like table infos.
+    row_stmts: Vec<Option<ManagedStmt>>,
+    // (table info index, clock key, row exists) of the row the row statements are positioned on.
+    // Consecutive changes to the same row are served from that one lookup.
+    loaded_row: Option<(usize, i64, bool)>,
+    // Column of the loaded row holding the current change's value.
+    row_col: c_int,
+}
+
+impl ChangesReadState {
+    fn new(desc: bool) -> Self {
+        ChangesReadState {
+            streams: Vec::new(),
+            heads: BinaryHeap::new(),
+            desc,
+            current: None,
+            row_stmts: Vec::new(),
+            loaded_row: None,
+            row_col: 0,
+        }
+    }
+
+    fn add_stream(&mut self, stmt: ManagedStmt) -> Result<(), ResultCode> {
+        self.streams.push(stmt);
+        self.step_stream(self.streams.len() - 1)
+    }
+
+    fn step_stream(&mut self, i: usize) -> Result<(), ResultCode> {
+        let stmt = &self.streams[i];
+        if stmt.step()? == ResultCode::ROW {
+            let db_vrsn = stmt.column_int64(ClockUnionColumn::DbVrsn as i32);
+            let seq = stmt.column_int64(ClockUnionColumn::Seq as i32);
+            // `!` reverses the order of i64s without overflowing as negating would.
+            self.heads.push(Reverse(if self.desc {
+                (!db_vrsn, !seq, i)
+            } else {
+                (db_vrsn, seq, i)
+            }));
+        }
+        Ok(())
+    }
+
+    /// Advances to the next change across all streams.
+    /// Returns the statement positioned on that change or `None` once every stream is exhausted.
+    fn next(&mut self) -> Result<Option<*mut sqlite::stmt>, ResultCode> {
+        if let Some(i) = self.current.take() {
+            self.step_stream(i)?;
+        }
+        match self.heads.pop() {
+            Some(Reverse((_, _, i))) => {
+                self.current = Some(i);
+                Ok(Some(self.streams[i].stmt))
+            }
+            None => Ok(None),
+        }
+    }
+
+    /// Positions the row statement of the table on the row identified by `key`,
+    /// re-using the previous lookup if the change is for the same row.
+    /// Returns the row statement or null if the row no longer exists.
+    fn load_row(
+        &mut self,
+        db: *mut sqlite::sqlite3,
+        tbl_info: &TableInfo,
+        tbl_info_index: usize,
+        key: i64,
+        packed_pks: &[u8],
+    ) -> Result<*mut sqlite::stmt, ResultCode> {
+        if let Some((loaded_idx, loaded_key, exists)) = self.loaded_row {
+            if loaded_idx == tbl_info_index && loaded_key == key {
+                if exists {
+                    return Ok(self.row_stmts[tbl_info_index]
+                        .as_ref()
+                        .ok_or(ResultCode::ERROR)?
+                        .stmt);
+                }
+                return Ok(null_mut());
+            }
+            self.loaded_row = None;
+            if let Some(Some(stmt)) = self.row_stmts.get(loaded_idx) {
+                reset_cached_stmt(stmt.stmt)?;
+            }
+        }
+
+        if self.row_stmts.len() <= tbl_info_index {
+            self.row_stmts.resize_with(tbl_info_index + 1, || None);
+        }
+        if self.row_stmts[tbl_info_index].is_none() {
+            self.row_stmts[tbl_info_index] = Some(tbl_info.prepare_row_patch_data_stmt(db)?);
+        }
+        let row_stmt = self.row_stmts[tbl_info_index]
+            .as_ref()
+            .ok_or(ResultCode::ERROR)?;
+
+        let unpacked_pks = unpack_columns_ref(packed_pks)?;
+        bind_package_to_stmt(row_stmt.stmt, &unpacked_pks, 0)?;
+
+        let exists = match row_stmt.step() {
+            Ok(ResultCode::ROW) => true,
+            Ok(_) => {
+                reset_cached_stmt(row_stmt.stmt)?;
+                false
+            }
+            Err(rc) => {
+                reset_cached_stmt(row_stmt.stmt)?;
+                return Err(rc);
+            }
+        };
+        self.loaded_row = Some((tbl_info_index, key, exists));
+        if exists {
+            Ok(row_stmt.stmt)
+        } else {
+            Ok(null_mut())
+        }
+    }
+}
+
+#[no_mangle]
+pub extern "C" fn crsql_changes_crsr_finalize(crsr: *mut crsql_Changes_cursor) -> c_int {
+    changes_crsr_finalize(crsr)
+}
 
 fn changes_crsr_finalize(crsr: *mut crsql_Changes_cursor) -> c_int {
     // Assign pointers to null after freeing
     // since we can get into this twice for the same cursor object.
     unsafe {
-        let mut rc = 0;
-        rc += match (*crsr).pChangesStmt.finalize() {
-            Ok(rc) => rc as c_int,
-            Err(rc) => rc as c_int,
-        };
+        // pChangesStmt and pRowStmt point into the read state's statements
+        // which are finalized when the state is dropped.
         (*crsr).pChangesStmt = null_mut();
-        let reset_rc = reset_cached_stmt((*crsr).pRowStmt);
-        match reset_rc {
-            Ok(r) | Err(r) => rc += r as c_int,
-        }
         (*crsr).pRowStmt = null_mut();
+        if !(*crsr).pReadState.is_null() {
+            drop(Box::from_raw((*crsr).pReadState as *mut ChangesReadState));
+            (*crsr).pReadState = null_mut();
+        }
         (*crsr).dbVersion = crate::consts::MIN_POSSIBLE_DB_VERSION;
 
-        return rc;
+        return ResultCode::OK as c_int;
     }
 }
 
@@ -59,10 +219,12 @@ pub unsafe extern "C" fn crsql_changes_best_index(
 }
 
 fn changes_best_index(
-    _vtab: *mut sqlite::vtab,
+    vtab: *mut sqlite::vtab,
     index_info: *mut sqlite::index_info,
 ) -> Result<ResultCode, ResultCode> {
     let mut idx_num: i32 = 0;
+    let mut db_vrsn_eq = false;
+    let mut db_vrsn_range = false;
 
     let mut first_constraint = true;
     let mut str = String::new();
@@ -101,78 +263,118 @@ fn changes_best_index(
 
         // idx bit mask
         match col {
-            Some(CrsqlChangesColumn::DbVrsn) => idx_num |= 2,
+            Some(CrsqlChangesColumn::DbVrsn) => {
+                idx_num |= 2;
+                match constraint.op as u32 {
+                    sqlite::INDEX_CONSTRAINT_EQ | sqlite::INDEX_CONSTRAINT_IS => db_vrsn_eq = true,
+                    sqlite::INDEX_CONSTRAINT_GT
+                    | sqlite::INDEX_CONSTRAINT_GE
+                    | sqlite::INDEX_CONSTRAINT_LT
+                    | sqlite::INDEX_CONSTRAINT_LE => db_vrsn_range = true,
+                    _ => {}
+                }
+            }
             Some(CrsqlChangesColumn::SiteId) => idx_num |= 4,
             _ => {}
         }
     }
 
-    let mut desc = 0;
+    // `[table] =` and `pk =` do not filter the clock tables. They pick which clock tables,
+    // and which row of them, are read. Their values come after those of the clock table
+    // constraints, the table's first.
+    if use_eq_constraint(index_info, CrsqlChangesColumn::Tbl, arg_v_index, true) {
+        idx_num |= IDX_TBL;
+        arg_v_index += 1;
+    }
+    // A row's packed primary key is looked up through the pks table's index on the primary key
+    // columns. Those compare with the columns' affinity and collation rather than byte for byte
+    // so SQLite still checks `pk =` on what is returned.
+    if use_eq_constraint(index_info, CrsqlChangesColumn::Pk, arg_v_index, false) {
+        idx_num |= IDX_PK;
+        arg_v_index += 1;
+    }
+
     let order_bys = sqlite::args!((*index_info).nOrderBy, (*index_info).aOrderBy);
-    let mut order_by_consumed = true;
-    if order_bys.len() > 0 {
-        str.push_str(" ORDER BY ");
+    // Any ordering on the clock table columns is applied while reading them. An ordering on
+    // `val` is left to SQLite and the changes are read in whatever order is cheapest, rather
+    // than sorted once here and again by SQLite.
+    let order_by_consumed = order_bys.iter().all(|order_by| {
+        get_clock_table_col_name(&CrsqlChangesColumn::from_i32(order_by.iColumn)).is_some()
+    });
+    // No ordering, `db_version` and `db_version, seq`, both ascending or both descending, can all
+    // be served by merging the clock tables which are each read in (db_vrsn, seq) order.
+    let merge_ordered = !order_by_consumed
+        || order_bys.iter().enumerate().all(|(i, order_by)| {
+            let col = CrsqlChangesColumn::from_i32(order_by.iColumn);
+            order_by.desc == order_bys[0].desc
+                && matches!(
+                    (i, col),
+                    (0, Some(CrsqlChangesColumn::DbVrsn)) | (1, Some(CrsqlChangesColumn::Seq))
+                )
+        });
+    let desc = order_by_consumed && order_bys.first().map_or(false, |o| o.desc != 0);
+    if merge_ordered {
+        idx_num |= IDX_MERGE_ORDERED;
+        if desc {
+            idx_num |= IDX_MERGE_DESC;
+            str.push_str(" ORDER BY db_vrsn DESC, seq DESC");
+        } else {
+            // Also the order changes are retrieved in when the user didn't provide one.
+            str.push_str(" ORDER BY db_vrsn ASC, seq ASC");
+        }
     } else {
-        // The user didn't provide an ordering? Tack on a default one that will
-        // retrieve changes in-order
-        str.push_str(" ORDER BY db_vrsn, seq ASC");
-    }
-    first_constraint = true;
-    for order_by in order_bys {
-        desc = order_by.desc;
-        let col = CrsqlChangesColumn::from_i32(order_by.iColumn);
-        if let Some(col_name) = get_clock_table_col_name(&col) {
-            if first_constraint {
-                first_constraint = false;
-            } else {
+        str.push_str(" ORDER BY ");
+        for (i, order_by) in order_bys.iter().enumerate() {
+            if i > 0 {
                 str.push_str(", ");
             }
-            str.push_str(&col_name);
-        } else {
-            // TODO: test we're consuming
-            order_by_consumed = false;
+            if let Some(col_name) =
+                get_clock_table_col_name(&CrsqlChangesColumn::from_i32(order_by.iColumn))
+            {
+                str.push_str(&col_name);
+            }
+            str.push_str(if order_by.desc != 0 { " DESC" } else { " ASC" });
         }
     }
 
-    if order_bys.len() > 0 {
-        if desc != 0 {
-            str.push_str(" DESC");
-        } else {
-            str.push_str(" ASC");
-        }
+    if order_by_consumed && use_limit_constraint(index_info, arg_v_index) {
+        idx_num |= IDX_LIMIT;
+        str.push_str(" LIMIT ?");
     }
 
     // manual null-term since we'll pass to C
     str.push('\0');
 
-    // TODO: update your order by py test to explain query plans to ensure correct indices are selected
-    // both constraints are present. Also to check that order by is consumed.
-    if idx_num & 6 == 6 {
-        unsafe {
-            (*index_info).estimatedCost = 1.0;
-            (*index_info).estimatedRows = 1;
-        }
-    }
-    // only the version constraint is present
-    else if idx_num & 2 == 2 {
-        unsafe {
-            (*index_info).estimatedCost = 10.0;
-            (*index_info).estimatedRows = 10;
-        }
+    // The cost is the number of clock rows we expect to read.
+    let tab = vtab.cast::<crsql_Changes_vtab>();
+    let (num_tables, clock_rows) = unsafe {
+        estimate_clock_rows(
+            (*tab).db,
+            (*tab).pExtData,
+            &mut (*tab).base.zErrMsg as *mut _,
+        )?
+    };
+    let num_tables = num_tables.max(1);
+    let (tables_read, mut rows) = if idx_num & IDX_TBL != 0 {
+        (1, clock_rows / num_tables)
+    } else {
+        (num_tables, clock_rows)
+    };
+    if idx_num & IDX_PK != 0 {
+        // One key lookup per table and a clock row per column of the row.
+        rows = rows.min(tables_read * ROW_CLOCK_ROWS);
     }
-    // only the requestor constraint is present
-    else if idx_num & 4 == 4 {
-        unsafe {
-            (*index_info).estimatedCost = 2147483647.0;
-            (*index_info).estimatedRows = 2147483647;
-        }
+    // The db_version index narrows the read. Ranges are assumed to keep a quarter of the rows,
+    // as SQLite assumes of ranges it has no statistics for.
+    if db_vrsn_eq {
+        rows = rows.min(ROW_CLOCK_ROWS);
+    } else if db_vrsn_range {
+        rows /= 4;
     }
-    // no constraints are present
-    else {
-        unsafe {
-            (*index_info).estimatedCost = 2147483647.0;
-            (*index_info).estimatedRows = 2147483647;
-        }
+    let rows = rows.max(1);
+    unsafe {
+        (*index_info).estimatedCost = rows as f64;
+        (*index_info).estimatedRows = rows;
     }
 
     unsafe {
@@ -189,10 +391,137 @@ fn changes_best_index(
     Ok(ResultCode::OK)
 }
 
+/**
+ * Consumes the first usable `=` constraint on `col`, giving it `argv_index`. Returns whether
+ * there was one.
+ */
+fn use_eq_constraint(
+    index_info: *mut sqlite::index_info,
+    col: CrsqlChangesColumn,
+    argv_index: c_int,
+    omit: bool,
+) -> bool {
+    let constraints = sqlite::args!((*index_info).nConstraint, (*index_info).aConstraint);
+    let constraint_usage =
+        sqlite::args_mut!((*index_info).nConstraint, (*index_info).aConstraintUsage);
+    let col = col as c_int;
+    for (i, constraint) in constraints.iter().enumerate() {
+        if constraint.usable != 0
+            && constraint.iColumn == col
+            && constraint.op == sqlite::INDEX_CONSTRAINT_EQ as u8
+        {
+            constraint_usage[i].argvIndex = argv_index;
+            constraint_usage[i].omit = if omit { 1 } else { 0 };
+            return true;
+        }
+    }
+    false
+}
+
+/**
+ * Consumes the `LIMIT` constraint, giving it `argv_index`, if every other constraint was
+ * consumed and so each change read is returned. Returns whether it was.
+ *
+ * SQLite still applies the limit. It is only used to stop reading clock tables sooner. Queries
+ * with an `OFFSET` are left alone as the offset is applied by SQLite, after what is read here,
+ * and not every version of SQLite includes it in the `LIMIT` it passes.
+ */
+fn use_limit_constraint(index_info: *mut sqlite::index_info, argv_index: c_int) -> bool {
+    let constraints = sqlite::args!((*index_info).nConstraint, (*index_info).aConstraint);
+    let constraint_usage =
+        sqlite::args_mut!((*index_info).nConstraint, (*index_info).aConstraintUsage);
+    let mut limit = None;
+    for (i, constraint) in constraints.iter().enumerate() {
+        match constraint.op as u32 {
+            sqlite::INDEX_CONSTRAINT_LIMIT => limit = Some(i),
+            sqlite::INDEX_CONSTRAINT_OFFSET => return false,
+            _ => {
+                if constraint_usage[i].omit == 0 {
+                    return false;
+                }
+            }
+        }
+    }
+    match limit {
+        Some(i) => {
+            constraint_usage[i].argvIndex = argv_index;
+            constraint_usage[i].omit = 0;
+            true
+        }
+        None => false,
+    }
+}
+
+/**
+ * The number of crrs and about how many clock rows they hold between them.
+ *
+ * Row counts come from `sqlite_stat1` for clock tables that were analyzed. Others are assumed
+ * to hold as many rows as SQLite assumes of any table it has no statistics for. The counts are
+ * read on every call, with one lookup per table, rather than cached: `ANALYZE` rewrites
+ * `sqlite_stat1` without changing the schema version so nothing cheap says when they go stale.
+ */
+fn estimate_clock_rows(
+    db: *mut sqlite::sqlite3,
+    ext_data: *mut crsql_ExtData,
+    err: *mut *mut c_char,
+) -> Result<(i64, i64), ResultCode> {
+    let c_rc = crsql_ensure_table_infos_are_up_to_date(db, ext_data, err);
+    if c_rc != ResultCode::OK as c_int {
+        return Err(ResultCode::from_i32(c_rc).unwrap_or(ResultCode::ERROR));
+    }
+    let tbl_infos = unsafe {
+        mem::ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>))
+    };
+
+    if tbl_infos.is_empty() {
+        return Ok((0, 0));
+    }
+
+    let stat_stmt = prepare_stat_stmt(db)?;
+    let mut clock_rows = 0;
+    for tbl_info in tbl_infos.iter() {
+        clock_rows += match &stat_stmt {
+            Some(stmt) => read_clock_rows(stmt, &tbl_info.tbl_name)?,
+            None => DEFAULT_CLOCK_TABLE_ROWS,
+        };
+    }
+    Ok((tbl_infos.len() as i64, clock_rows))
+}
+
+// A statement reading a table's row count from `sqlite_stat1`, if there is a `sqlite_stat1`.
+fn prepare_stat_stmt(db: *mut sqlite::sqlite3) -> Result<Option<ManagedStmt>, ResultCode> {
+    let has_stats = db
+        .prepare_v2("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")?;
+    if has_stats.step()? != ResultCode::ROW {
+        return Ok(None);
+    }
+    Ok(Some(db.prepare_v2(
+        "SELECT max(CAST(stat AS INTEGER)) FROM sqlite_stat1 WHERE tbl = ?",
+    )?))
+}
+
+fn read_clock_rows(stmt: &ManagedStmt, tbl_name: &str) -> Result<i64, ResultCode> {
+    let clock_tbl_name = format!("{}__crsql_clock", tbl_name);
+    stmt.bind_text(1, &clock_tbl_name, sqlite::Destructor::STATIC)?;
+    let rows = if stmt.step()? == ResultCode::ROW && stmt.column_type(0)? != ColumnType::Null {
+        stmt.column_int64(0)
+    } else {
+        DEFAULT_CLOCK_TABLE_ROWS
+    };
+    stmt.reset()?;
+    Ok(rows)
+}
+
 fn constraint_is_usable(constraint: &sqlite::index_constraint) -> bool {
     if constraint.usable == 0 {
         return false;
     }
+    // `LIMIT` and `OFFSET` are not constraints on a column.
+    if constraint.op == sqlite::INDEX_CONSTRAINT_LIMIT as u8
+        || constraint.op == sqlite::INDEX_CONSTRAINT_OFFSET as u8
+    {
+        return false;
+    }
     if let Some(col) = CrsqlChangesColumn::from_i32(constraint.iColumn) {
         match col {
             CrsqlChangesColumn::Tbl | CrsqlChangesColumn::Pk | CrsqlChangesColumn::Cval => false,
@@ -244,7 +573,7 @@ fn get_operator_string(op: u8) -> Option<String> {
 #[no_mangle]
 pub unsafe extern "C" fn crsql_changes_filter(
     cursor: *mut sqlite::vtab_cursor,
-    _idx_num: c_int,
+    idx_num: c_int,
     idx_str: *const c_char,
     argc: c_int,
     argv: *mut *mut sqlite::value,
@@ -253,7 +582,7 @@ pub unsafe extern "C" fn crsql_changes_filter(
     let cursor = cursor.cast::<crsql_Changes_cursor>();
     let idx_str = unsafe { CStr::from_ptr(idx_str).to_str() };
     match idx_str {
-        Ok(idx_str) => match changes_filter(cursor, idx_str, args) {
+        Ok(idx_str) => match changes_filter(cursor, idx_num, idx_str, args) {
             Err(rc) | Ok(rc) => rc as c_int,
         },
         Err(_) => ResultCode::FORMAT as c_int,
@@ -262,6 +591,7 @@ pub unsafe extern "C" fn crsql_changes_filter(
 
 unsafe fn changes_filter(
     cursor: *mut crsql_Changes_cursor,
+    idx_num: c_int,
     idx_str: &str,
     args: &[*mut sqlite::value],
 ) -> Result<ResultCode, ResultCode> {
@@ -269,9 +599,11 @@ unsafe fn changes_filter(
     let db = (*tab).db;
     // This should never happen. pChangesStmt should be finalized
     // before filter is ever invoked.
-    if !(*cursor).pChangesStmt.is_null() {
-        (*cursor).pChangesStmt.finalize()?;
-        (*cursor).pChangesStmt = null_mut();
+    if !(*cursor).pChangesStmt.is_null() || !(*cursor).pReadState.is_null() {
+        let rc = changes_crsr_finalize(cursor);
+        if rc != 0 {
+            return Err(ResultCode::ERROR);
+        }
     }
 
     let c_rc = crsql_ensure_table_infos_are_up_to_date(
@@ -295,16 +627,121 @@ unsafe fn changes_filter(
         return Ok(ResultCode::OK);
     }
 
-    let sql = changes_union_query(&tbl_infos, idx_str)?;
+    let mut args = args;
+    let mut limit_arg = None;
+    if idx_num & IDX_LIMIT != 0 {
+        let (last, rest) = args.split_last().ok_or(ResultCode::MISUSE)?;
+        limit_arg = Some(*last);
+        args = rest;
+    }
+    let mut pk_arg = None;
+    if idx_num & IDX_PK != 0 {
+        let (last, rest) = args.split_last().ok_or(ResultCode::MISUSE)?;
+        pk_arg = Some(*last);
+        args = rest;
+    }
+    let mut tbl_arg = None;
+    if idx_num & IDX_TBL != 0 {
+        let (last, rest) = args.split_last().ok_or(ResultCode::MISUSE)?;
+        tbl_arg = Some(*last);
+        args = rest;
+    }
+    let tables = tables_to_read(db, &tbl_infos, tbl_arg, pk_arg)?;
+
+    // The state is owned by the cursor as soon as it is created
+    // so it is released by finalize if we fail partway through.
+    let state = Box::into_raw(Box::new(ChangesReadState::new(
+        idx_num & IDX_MERGE_DESC != 0,
+    )));
+    (*cursor).pReadState = state as *mut c_void;
+    let state = &mut *state;
+    if tables.is_empty() {
+        // Nothing to read. The cursor is at eof once advanced.
+    } else if idx_num & IDX_MERGE_ORDERED == IDX_MERGE_ORDERED {
+        // Read each clock table in order and merge them as the cursor advances.
+        // The first row is available after reading one row per table
+        // rather than after sorting every change.
+        for (tbl_info, key) in tables.iter() {
+            let sql = changes_query_for_table(tbl_info, *key, idx_str)?;
+            let stmt = db.prepare_v2(&sql)?;
+            bind_args(&stmt, args, limit_arg)?;
+            state.add_stream(stmt)?;
+        }
+    } else {
+        // A single stream is returned as is, in whatever order the union query produced.
+        let sql = changes_union_query(&tables, idx_str)?;
+
+        let stmt = db.prepare_v2(&sql)?;
+        bind_args(&stmt, args, limit_arg)?;
+        state.add_stream(stmt)?;
+    }
+    changes_next(cursor, (*cursor).pTab.cast::<sqlite::vtab>())
+}
 
-    let stmt = db.prepare_v2(&sql)?;
+/**
+ * Binds the values of the clock table constraints, in order, then the limit if there is one.
+ * When merging, each clock table is read up to the limit as any one of them could hold all of
+ * the first changes.
+ */
+fn bind_args(
+    stmt: &ManagedStmt,
+    args: &[*mut sqlite::value],
+    limit_arg: Option<*mut sqlite::value>,
+) -> Result<(), ResultCode> {
     for (i, arg) in args.iter().enumerate() {
         stmt.bind_value(i as i32 + 1, *arg)?;
     }
-    (*cursor).pChangesStmt = stmt.stmt;
-    // forget the stmt. it will be managed by the vtab
-    forget(stmt);
-    changes_next(cursor, (*cursor).pTab.cast::<sqlite::vtab>())
+    if let Some(limit) = limit_arg {
+        stmt.bind_value(args.len() as i32 + 1, limit)?;
+    }
+    Ok(())
+}
+
+/**
+ * The tables whose clock tables a query reads: the one named by `[table] =`, if given, or all
+ * of them. With `pk =`, each is paired with the key of the row having that primary key and
+ * tables without such a row are left out.
+ */
+fn tables_to_read<'a>(
+    db: *mut sqlite::sqlite3,
+    tbl_infos: &'a Vec<TableInfo>,
+    tbl_arg: Option<*mut sqlite::value>,
+    pk_arg: Option<*mut sqlite::value>,
+) -> Result<Vec<(&'a TableInfo, Option<i64>)>, ResultCode> {
+    let mut tables = Vec::new();
+    let tbl_infos = tbl_infos.iter().filter(|tbl_info| match tbl_arg {
+        // Compared as the TEXT column would compare them.
+        Some(tbl) => match tbl.value_type() {
+            ColumnType::Null | ColumnType::Blob => false,
+            _ => tbl.text() == tbl_info.tbl_name,
+        },
+        None => true,
+    });
+
+    let pk_arg = match pk_arg {
+        Some(pk) => pk,
+        None => {
+            tables.extend(tbl_infos.map(|tbl_info| (tbl_info, None)));
+            return Ok(tables);
+        }
+    };
+    if pk_arg.value_type() != ColumnType::Blob {
+        return Ok(tables);
+    }
+    let pks = match unpack_columns_ref(pk_arg.blob()) {
+        Ok(pks) => pks,
+        // Not a primary key any row could have.
+        Err(_) => return Ok(tables),
+    };
+    for tbl_info in tbl_infos {
+        if tbl_info.pks.len() != pks.len() {
+            continue;
+        }
+        if let Some(key) = tbl_info.get_key(db, &pks)? {
+            tables.push((tbl_info, Some(key)));
+        }
+    }
+    Ok(tables)
 }
 
 /**
@@ -329,22 +766,25 @@ unsafe fn changes_next(
     cursor: *mut crsql_Changes_cursor,
     vtab: *mut sqlite::vtab,
 ) -> Result<ResultCode, ResultCode> {
-    if (*cursor).pChangesStmt.is_null() {
-        let err = CString::new("pChangesStmt is null in changes_next")?;
+    if (*cursor).pReadState.is_null() {
+        let err = CString::new("pReadState is null in changes_next")?;
         (*vtab).zErrMsg = err.into_raw();
         return Err(ResultCode::ABORT);
     }
 
-    if !(*cursor).pRowStmt.is_null() {
-        let rc = reset_cached_stmt((*cursor).pRowStmt);
-        (*cursor).pRowStmt = null_mut();
-        if rc.is_err() {
-            return rc;
-        }
-    }
+    // The row statement is left positioned on its row so later changes to
+    // the same row can be served without another lookup.
+    (*cursor).pRowStmt = null_mut();
 
-    let rc = (*cursor).pChangesStmt.step()?;
-    if rc == ResultCode::DONE {
+    let state = &mut *((*cursor).pReadState as *mut ChangesReadState);
+    let has_row = match state.next()? {
+        Some(stmt) => {
+            (*cursor).pChangesStmt = stmt;
+            true
+        }
+        None => false,
+    };
+    if !has_row {
         let c_rc = changes_crsr_finalize(cursor);
         if c_rc == 0 {
             return Ok(ResultCode::OK);
@@ -371,11 +811,16 @@ unsafe fn changes_next(
         .column_int64(ClockUnionColumn::RowId as i32);
     (*cursor).dbVersion = db_version;
 
-    let tbl_infos = mem::ManuallyDrop::new(Box::from_raw(
-        (*(*(*cursor).pTab).pExtData).tableInfos as *mut Vec<TableInfo>,
-    ));
-    // TODO: will this work given `insert_tbl` is null termed?
-    let tbl_info_index = tbl_infos.iter().position(|x| x.tbl_name == tbl);
+    let ext_data = (*(*cursor).pTab).pExtData;
+    let tbl_infos =
+        mem::ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>));
+    // Changes arrive grouped by table more often than not so check the
+    // table of the last row before going to the index.
+    let last_tbl_info_index = (*cursor).tblInfoIdx as usize;
+    let tbl_info_index = match tbl_infos.get(last_tbl_info_index) {
+        Some(tbl_info) if tbl_info.tbl_name == tbl => Some(last_tbl_info_index),
+        _ => find_table_info_index(ext_data, tbl),
+    };
 
     if tbl_info_index.is_none() {
         let err = CString::new(format!("could not find schema for table {}", tbl))?;
@@ -405,25 +850,22 @@ unsafe fn changes_next(
         (*cursor).rowType = ChangeRowType::Update as c_int;
     }
 
-    let row_stmt_ref = tbl_info.get_row_patch_data_stmt((*(*cursor).pTab).db, cid)?;
-    let row_stmt = row_stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
-
-    let packed_pks = pks.blob();
-    let unpacked_pks = unpack_columns(packed_pks)?;
-    bind_package_to_stmt(row_stmt.stmt, &unpacked_pks, 0)?;
-
-    match row_stmt.step() {
-        Ok(ResultCode::DONE) => {
-            reset_cached_stmt(row_stmt.stmt)?;
-        }
-        Ok(_) => {}
-        Err(rc) => {
-            reset_cached_stmt(row_stmt.stmt)?;
-            return Err(rc);
+    let row_col = match tbl_info.find_non_pk_col_index(cid) {
+        Some(idx) => idx,
+        None => {
+            let err = CString::new(format!("could not find column {} on table {}", cid, tbl))?;
+            (*vtab).zErrMsg = err.into_raw();
+            return Err(ResultCode::ERROR);
         }
-    }
-
-    (*cursor).pRowStmt = row_stmt.stmt;
+    };
+    (*cursor).pRowStmt = state.load_row(
+        (*(*cursor).pTab).db,
+        tbl_info,
+        tbl_info_index,
+        changes_rowid,
+        pks.blob(),
+    )?;
+    state.row_col = row_col as c_int;
     Ok(ResultCode::OK)
 }
 
@@ -468,7 +910,8 @@ fn column_impl(
             if (*cursor).pRowStmt.is_null() {
                 ctx.result_null();
             } else {
-                ctx.result_value((*cursor).pRowStmt.column_value(0));
+                let state = &*((*cursor).pReadState as *mut ChangesReadState);
+                ctx.result_value((*cursor).pRowStmt.column_value(state.row_col));
             }
         },
         Some(CrsqlChangesColumn::Cid) => unsafe {
@@ -476,12 +919,9 @@ fn column_impl(
             match row_type {
                 Some(ChangeRowType::PkOnly) => ctx.result_text_static(crate::c::INSERT_SENTINEL),
                 Some(ChangeRowType::Delete) => ctx.result_text_static(crate::c::DELETE_SENTINEL),
+                // A missing row still reports the column that changed. Only its value is NULL.
                 Some(ChangeRowType::Update) => {
-                    if (*cursor).pRowStmt.is_null() {
-                        ctx.result_text_static(crate::c::DELETE_SENTINEL);
-                    } else {
-                        ctx.result_value(changes_stmt.column_value(ClockUnionColumn::Cid as i32));
-                    }
+                    ctx.result_value(changes_stmt.column_value(ClockUnionColumn::Cid as i32));
                 }
                 None => return Err(ResultCode::ABORT),
             }
@@ -572,3 +1012,20 @@ pub extern "C" fn crsql_changes_commit(vtab: *mut sqlite::vtab) -> c_int {
     }
     ResultCode::OK as c_int
 }
+
+// If xSavepoint is not defined xRollbackTo is not called.
+#[no_mangle]
+pub extern "C" fn crsql_changes_savepoint(_vtab: *mut sqlite::vtab, _savepoint: c_int) -> c_int {
+    ResultCode::OK as c_int
+}
+
+// Merges remember the last row they touched. Rolling back to a savepoint,
+// including the implicit one around each statement, may undo what they remember.
+#[no_mangle]
+pub extern "C" fn crsql_changes_rollback_to(vtab: *mut sqlite::vtab, _savepoint: c_int) -> c_int {
+    let tab = vtab.cast::<crsql_Changes_vtab>();
+    unsafe {
+        crsql_clear_merged_rows((*tab).pExtData);
+    }
+    ResultCode::OK as c_int
+}
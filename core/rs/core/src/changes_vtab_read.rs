@@ -8,7 +8,11 @@ use sqlite::ResultCode;
 
 use sqlite_nostd as sqlite;
 
-fn crsql_changes_query_for_table(table_info: &TableInfo) -> Result<String, ResultCode> {
+/// Changes for one crr, only those of the row with clock key `key` if one is given.
+fn crsql_changes_query_for_table(
+    table_info: &TableInfo,
+    key: Option<i64>,
+) -> Result<String, ResultCode> {
     if table_info.pks.len() == 0 {
         // no primary keys? We can't get changes for a table w/o primary keys...
         // this should be an impossible case.
@@ -38,22 +42,41 @@ fn crsql_changes_query_for_table(table_info: &TableInfo) -> Result<String, Resul
       JOIN \"{table_name_ident}__crsql_pks\" AS pk_tbl ON t1.key = pk_tbl.__crsql_key
       LEFT JOIN crsql_site_id AS site_tbl ON t1.site_id = site_tbl.ordinal
       LEFT JOIN \"{table_name_ident}__crsql_clock\" AS t2 ON
-      t1.key = t2.key AND t2.col_name = '{sentinel}'",
+      t1.key = t2.key AND t2.col_name = '{sentinel}'{key_filter}",
         table_name_val = crate::util::escape_ident_as_value(&table_info.tbl_name),
         pk_list = pk_list,
         table_name_ident = crate::util::escape_ident(&table_info.tbl_name),
-        sentinel = crate::c::INSERT_SENTINEL
+        sentinel = crate::c::INSERT_SENTINEL,
+        key_filter = match key {
+            Some(key) => format!(" WHERE t1.key = {}", key),
+            None => String::new(),
+        }
+    ))
+}
+
+/// Changes for a single crr. The merge cursor in `changes_vtab` prepares one of
+/// these per clock table and merges them by `(db_vrsn, seq)` rather than
+/// having SQLite sort the union of every clock table.
+pub fn changes_query_for_table(
+    table_info: &TableInfo,
+    key: Option<i64>,
+    idx_str: &str,
+) -> Result<String, ResultCode> {
+    Ok(format!(
+        "SELECT tbl, pks, cid, col_vrsn, db_vrsn, site_id, key, seq, cl FROM ({query}) {idx_str}\0",
+        query = crsql_changes_query_for_table(table_info, key)?,
+        idx_str = idx_str,
     ))
 }
 
 pub fn changes_union_query(
-    table_infos: &Vec<TableInfo>,
+    tables: &[(&TableInfo, Option<i64>)],
     idx_str: &str,
 ) -> Result<String, ResultCode> {
     let mut sub_queries = vec![];
 
-    for table_info in table_infos {
-        let query_part = crsql_changes_query_for_table(&table_info)?;
+    for (table_info, key) in tables {
+        let query_part = crsql_changes_query_for_table(table_info, *key)?;
         sub_queries.push(query_part);
     }
 
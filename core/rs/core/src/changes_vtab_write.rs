@@ -10,13 +10,57 @@ use sqlite_nostd::{sqlite3, ResultCode, Value};
 
 use crate::c::crsql_ExtData;
 use crate::c::{crsql_Changes_vtab, CrsqlChangesColumn};
-use crate::compare_values::crsql_compare_sqlite_values;
-use crate::pack_columns::bind_package_to_stmt;
-use crate::pack_columns::{unpack_columns, ColumnValue};
+use crate::compare_values::{crsql_compare_column_value, crsql_compare_sqlite_values};
+use crate::db_version::next_db_version;
+use crate::pack_columns::{bind_package_to_stmt, bind_slot};
+use crate::pack_columns::{unpack_columns_ref, ColumnValue, ColumnValueRef};
+use crate::stats;
 use crate::stmt_cache::reset_cached_stmt;
-use crate::tableinfo::{crsql_ensure_table_infos_are_up_to_date, TableInfo};
+use crate::tableinfo::{
+    crsql_ensure_table_infos_are_up_to_date, find_table_info_index, MergedRow, TableInfo,
+};
 use crate::util::slab_rowid;
 
+/**
+ * The value being merged for a column. Changes inserted through `crsql_changes`
+ * hand us SQLite values while changes applied in bulk from a changeset
+ * are unpacked from the changeset blob.
+ */
+pub enum MergeValue<'a> {
+    Sqlite(*mut sqlite::value),
+    Unpacked(&'a ColumnValue),
+}
+
+impl<'a> MergeValue<'a> {
+    fn compare(&self, local: *mut sqlite::value) -> c_int {
+        match self {
+            MergeValue::Sqlite(v) => crsql_compare_sqlite_values(*v, local),
+            MergeValue::Unpacked(v) => crsql_compare_column_value(v, local),
+        }
+    }
+
+    fn bind(&self, stmt: *mut sqlite::stmt, slot: i32) -> Result<ResultCode, ResultCode> {
+        match self {
+            MergeValue::Sqlite(v) => stmt.bind_value(slot, *v),
+            MergeValue::Unpacked(v) => bind_slot(slot as usize, &v.to_ref(), stmt),
+        }
+    }
+}
+
+/**
+ * A single change to merge, as described by a row of `crsql_changes`.
+ */
+pub struct Change<'a> {
+    pub tbl: &'a str,
+    pub cid: &'a str,
+    pub val: MergeValue<'a>,
+    pub col_vrsn: sqlite::int64,
+    pub db_vrsn: sqlite::int64,
+    pub site_id: &'a [u8],
+    pub cl: sqlite::int64,
+    pub seq: sqlite::int64,
+}
+
 /**
  * did_cid_win does not take into account the causal length.
  * The expectation is that all causal length concerns have already been handle
@@ -30,9 +74,9 @@ fn did_cid_win(
     ext_data: *mut crsql_ExtData,
     insert_tbl: &str,
     tbl_info: &TableInfo,
-    unpacked_pks: &Vec<ColumnValue>,
+    unpacked_pks: &[ColumnValueRef],
     key: sqlite::int64,
-    insert_val: *mut sqlite::value,
+    insert_val: &MergeValue,
     insert_site_id: &[u8],
     col_name: &str,
     col_version: sqlite::int64,
@@ -81,7 +125,7 @@ fn did_cid_win(
     let col_val_stmt_ref = tbl_info.get_col_value_stmt(db, col_name)?;
     let col_val_stmt = col_val_stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
 
-    let bind_result = bind_package_to_stmt(col_val_stmt.stmt, &unpacked_pks, 0);
+    let bind_result = bind_package_to_stmt(col_val_stmt.stmt, unpacked_pks, 0);
     if let Err(rc) = bind_result {
         reset_cached_stmt(col_val_stmt.stmt)?;
         return Err(rc);
@@ -91,7 +135,7 @@ fn did_cid_win(
     match step_result {
         Ok(ResultCode::ROW) => {
             let local_value = col_val_stmt.column_value(0)?;
-            let mut ret = crsql_compare_sqlite_values(insert_val, local_value);
+            let mut ret = insert_val.compare(local_value);
             reset_cached_stmt(col_val_stmt.stmt)?;
             if ret == 0 && unsafe { (*ext_data).mergeEqualValues == 1 } {
                 // values are the same (ret == 0) and the option to tie break on site_id is true
@@ -207,6 +251,9 @@ fn set_winner_clock(
         }
     };
 
+    let db_version =
+        next_db_version(db, ext_data, Some(insert_db_vrsn)).or_else(|_| Err(ResultCode::ERROR))?;
+
     let set_stmt_ref = tbl_info.get_set_winner_clock_stmt(db)?;
     let set_stmt = set_stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
 
@@ -218,7 +265,7 @@ fn set_winner_clock(
     let bind_result = set_stmt
         .bind_text(2, insert_col_name, sqlite::Destructor::STATIC)
         .and_then(|_| set_stmt.bind_int64(3, insert_col_vrsn))
-        .and_then(|_| set_stmt.bind_int64(4, insert_db_vrsn))
+        .and_then(|_| set_stmt.bind_int64(4, db_version))
         .and_then(|_| set_stmt.bind_int64(5, insert_seq))
         .and_then(|_| match ordinal {
             Some(ordinal) => set_stmt.bind_int64(6, ordinal),
@@ -247,7 +294,7 @@ fn merge_sentinel_only_insert(
     db: *mut sqlite3,
     ext_data: *mut crsql_ExtData,
     tbl_info: &TableInfo,
-    unpacked_pks: &Vec<ColumnValue>,
+    unpacked_pks: &[ColumnValueRef],
     key: sqlite::int64,
     remote_col_vrsn: sqlite::int64,
     remote_db_vsn: sqlite::int64,
@@ -288,7 +335,7 @@ fn merge_sentinel_only_insert(
     }
 
     if let Ok(_) = rc {
-        zero_clocks_on_resurrect(db, tbl_info, key, remote_db_vsn)?;
+        zero_clocks_on_resurrect(db, ext_data, tbl_info, key, remote_db_vsn)?;
         return set_winner_clock(
             db,
             ext_data,
@@ -307,15 +354,19 @@ fn merge_sentinel_only_insert(
 
 fn zero_clocks_on_resurrect(
     db: *mut sqlite3,
+    ext_data: *mut crsql_ExtData,
     tbl_info: &TableInfo,
     key: sqlite::int64,
     insert_db_vrsn: sqlite::int64,
 ) -> Result<ResultCode, ResultCode> {
+    let db_version =
+        next_db_version(db, ext_data, Some(insert_db_vrsn)).or_else(|_| Err(ResultCode::ERROR))?;
+
     let zero_stmt_ref = tbl_info.get_zero_clocks_on_resurrect_stmt(db)?;
     let zero_stmt = zero_stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
 
     let ret = zero_stmt
-        .bind_int64(1, insert_db_vrsn)
+        .bind_int64(1, db_version)
         .and_then(|_| zero_stmt.bind_int64(2, key))
         .and_then(|_| zero_stmt.step());
     reset_cached_stmt(zero_stmt.stmt)?;
@@ -326,7 +377,7 @@ unsafe fn merge_delete(
     db: *mut sqlite3,
     ext_data: *mut crsql_ExtData,
     tbl_info: &TableInfo,
-    unpacked_pks: &Vec<ColumnValue>,
+    unpacked_pks: &[ColumnValueRef],
     key: sqlite::int64,
     remote_col_vrsn: sqlite::int64,
     remote_db_vrsn: sqlite::int64,
@@ -488,8 +539,7 @@ unsafe fn merge_insert(
     let tbl_infos = mem::ManuallyDrop::new(Box::from_raw(
         (*(*tab).pExtData).tableInfos as *mut Vec<TableInfo>,
     ));
-    // TODO: will this work given `insert_tbl` is null termed?
-    let tbl_info_index = tbl_infos.iter().position(|x| x.tbl_name == insert_tbl);
+    let tbl_info_index = find_table_info_index((*tab).pExtData, insert_tbl);
 
     if tbl_info_index.is_none() {
         let err = CString::new(format!(
@@ -503,18 +553,132 @@ unsafe fn merge_insert(
     let tbl_info_index = tbl_info_index.unwrap();
 
     let tbl_info = &tbl_infos[tbl_info_index];
-    let unpacked_pks = unpack_columns(insert_pks.blob())?;
+    let insert_pks = insert_pks.blob();
+    let unpacked_pks = unpack_columns_ref(insert_pks)?;
+
+    let change = Change {
+        tbl: insert_tbl,
+        cid: insert_col,
+        val: MergeValue::Sqlite(insert_val),
+        col_vrsn: insert_col_vrsn,
+        db_vrsn: insert_db_vrsn,
+        site_id: insert_site_id,
+        cl: insert_cl,
+        seq: insert_seq,
+    };
+
+    if let Some(inner_rowid) = merge_change(
+        db,
+        (*tab).pExtData,
+        tbl_info,
+        insert_pks,
+        &unpacked_pks,
+        &change,
+        errmsg,
+    )? {
+        *rowid = slab_rowid(tbl_info_index as i32, inner_rowid);
+    }
+    Ok(ResultCode::OK)
+}
+
+/**
+ * Merges a single change into the row identified by `packed_pks`.
+ *
+ * The caller is responsible for resolving the table info and unpacking the primary key.
+ * The key and causal length of the row are remembered on the table info so a run of changes
+ * to the same row only looks them up once.
+ *
+ * Returns the rowid of the clock entry that was written or `None` if the change did not win.
+ */
+pub unsafe fn merge_change(
+    db: *mut sqlite3,
+    ext_data: *mut crsql_ExtData,
+    tbl_info: &TableInfo,
+    packed_pks: &[u8],
+    unpacked_pks: &[ColumnValueRef],
+    change: &Change,
+    errmsg: *mut *mut c_char,
+) -> Result<Option<sqlite::int64>, ResultCode> {
+    let start = stats::now();
+    let ret = merge_change_into_row(
+        db,
+        ext_data,
+        tbl_info,
+        packed_pks,
+        unpacked_pks,
+        change,
+        errmsg,
+    );
+    let stats = stats::get_stats(ext_data);
+    stats.merges.record(start);
+    match ret {
+        Ok(Some(_)) => stats.merges_won.incr(),
+        Ok(None) => stats.merges_lost.incr(),
+        Err(_) => {
+            // Whatever was written for the row is about to be rolled back.
+            tbl_info.clear_merged_row();
+        }
+    }
+    ret
+}
+
+/**
+ * Returns the key and local causal length of the row, reusing them if the row
+ * is the one last merged into the table.
+ */
+fn get_merged_row(
+    db: *mut sqlite3,
+    tbl_info: &TableInfo,
+    packed_pks: &[u8],
+    unpacked_pks: &[ColumnValueRef],
+) -> Result<(sqlite::int64, sqlite::int64), ResultCode> {
+    if let Some(row) = tbl_info.merged_row.try_borrow()?.as_ref() {
+        if row.pks == packed_pks {
+            return Ok((row.key, row.cl));
+        }
+    }
 
     // Get or create key as the first thing we do.
     // We'll need the key for all later operations.
-    let key = tbl_info.get_or_create_key(db, &unpacked_pks)?;
+    let key = tbl_info.get_or_create_key(db, unpacked_pks)?;
+    let cl = get_local_cl(db, tbl_info, key)?;
+    *tbl_info.merged_row.try_borrow_mut()? = Some(MergedRow {
+        pks: packed_pks.to_vec(),
+        key,
+        cl,
+    });
+    Ok((key, cl))
+}
 
-    let local_cl = get_local_cl(db, &tbl_info, key)?;
+fn set_merged_row_cl(tbl_info: &TableInfo, cl: sqlite::int64) -> Result<(), ResultCode> {
+    if let Some(row) = tbl_info.merged_row.try_borrow_mut()?.as_mut() {
+        row.cl = cl;
+    }
+    Ok(())
+}
+
+unsafe fn merge_change_into_row(
+    db: *mut sqlite3,
+    ext_data: *mut crsql_ExtData,
+    tbl_info: &TableInfo,
+    packed_pks: &[u8],
+    unpacked_pks: &[ColumnValueRef],
+    change: &Change,
+    errmsg: *mut *mut c_char,
+) -> Result<Option<sqlite::int64>, ResultCode> {
+    let insert_col = change.cid;
+    let insert_col_vrsn = change.col_vrsn;
+    let insert_db_vrsn = change.db_vrsn;
+    let insert_site_id = change.site_id;
+    let insert_cl = change.cl;
+    let insert_seq = change.seq;
+
+    let (key, local_cl) = get_merged_row(db, tbl_info, packed_pks, unpacked_pks)?;
 
     // We can ignore all updates from older causal lengths.
     // They won't win at anything.
     if insert_cl < local_cl {
-        return Ok(ResultCode::OK);
+        return Ok(None);
     }
 
     let is_delete = insert_cl % 2 == 0;
@@ -530,30 +694,24 @@ unsafe fn merge_insert(
         // We got a delete event but we've already processed a delete at that version.
         // Just bail.
         if insert_cl == local_cl {
-            return Ok(ResultCode::OK);
+            return Ok(None);
         }
         // else, it is a delete and the cl is > than ours. Drop the row.
-        let merge_result = merge_delete(
+        let inner_rowid = merge_delete(
             db,
-            (*tab).pExtData,
+            ext_data,
             &tbl_info,
-            &unpacked_pks,
+            unpacked_pks,
             key,
             insert_col_vrsn,
             insert_db_vrsn,
             insert_site_id,
             insert_seq,
-        );
-        match merge_result {
-            Err(rc) => {
-                return Err(rc);
-            }
-            Ok(inner_rowid) => {
-                (*(*tab).pExtData).rowsImpacted += 1;
-                *rowid = slab_rowid(tbl_info_index as i32, inner_rowid);
-                return Ok(ResultCode::OK);
-            }
-        }
+        )?;
+        // The delete sentinel now carries the causal length.
+        set_merged_row_cl(tbl_info, insert_col_vrsn)?;
+        (*ext_data).rowsImpacted += 1;
+        return Ok(Some(inner_rowid));
     }
 
     /*
@@ -568,33 +726,26 @@ unsafe fn merge_insert(
         // If it is a sentinel but the local_cl already matches, nothing to do
         // as the local sentinel already has the same data!
         if insert_cl == local_cl {
-            return Ok(ResultCode::OK);
+            return Ok(None);
         }
-        let merge_result = merge_sentinel_only_insert(
+        let inner_rowid = merge_sentinel_only_insert(
             db,
-            (*tab).pExtData,
+            ext_data,
             &tbl_info,
-            &unpacked_pks,
+            unpacked_pks,
             key,
             insert_col_vrsn,
             insert_db_vrsn,
             insert_site_id,
             insert_seq,
-        );
-        match merge_result {
-            Err(rc) => {
-                return Err(rc);
-            }
-            Ok(inner_rowid) => {
-                // a success & rowid of -1 means the merge was a no-op
-                if inner_rowid != -1 {
-                    (*(*tab).pExtData).rowsImpacted += 1;
-                    *rowid = slab_rowid(tbl_info_index as i32, inner_rowid);
-                    return Ok(ResultCode::OK);
-                } else {
-                    return Ok(ResultCode::OK);
-                }
-            }
+        )?;
+        // a success & rowid of -1 means the merge was a no-op
+        if inner_rowid != -1 {
+            set_merged_row_cl(tbl_info, insert_col_vrsn)?;
+            (*ext_data).rowsImpacted += 1;
+            return Ok(Some(inner_rowid));
+        } else {
+            return Ok(None);
         }
     }
 
@@ -609,16 +760,21 @@ unsafe fn merge_insert(
         // and the version to set to is the cl not col_vrsn of current insert
         merge_sentinel_only_insert(
             db,
-            (*tab).pExtData,
+            ext_data,
             &tbl_info,
-            &unpacked_pks,
+            unpacked_pks,
             key,
             insert_cl,
             insert_db_vrsn,
             insert_site_id,
             insert_seq,
         )?;
-        (*(*tab).pExtData).rowsImpacted += 1;
+        (*ext_data).rowsImpacted += 1;
+    }
+    if insert_cl > local_cl {
+        // Either resurrected above or, for a row we did not have, created by the clock
+        // written below. Both leave the row at the incoming causal length.
+        set_merged_row_cl(tbl_info, insert_cl)?;
     }
 
     // we can short-circuit via needs_resurrect
@@ -628,12 +784,12 @@ unsafe fn merge_insert(
         || !row_exists_locally
         || did_cid_win(
             db,
-            (*tab).pExtData,
-            insert_tbl,
+            ext_data,
+            change.tbl,
             &tbl_info,
-            &unpacked_pks,
+            unpacked_pks,
             key,
-            insert_val,
+            &change.val,
             insert_site_id,
             insert_col,
             insert_col_vrsn,
@@ -643,33 +799,41 @@ unsafe fn merge_insert(
     if !does_cid_win {
         // doesCidWin == 0? compared against our clocks, nothing wins. OK and
         // Done.
-        return Ok(ResultCode::OK);
+        return Ok(None);
     }
 
     // TODO: this is all almost identical between all three merge cases!
     let merge_stmt_ref = tbl_info.get_merge_insert_stmt(db, insert_col)?;
     let merge_stmt = merge_stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
 
-    let bind_result = bind_package_to_stmt(merge_stmt.stmt, &unpacked_pks, 0)
-        .and_then(|_| merge_stmt.bind_value(unpacked_pks.len() as i32 + 1, insert_val))
-        .and_then(|_| merge_stmt.bind_value(unpacked_pks.len() as i32 + 2, insert_val));
+    let bind_result = bind_package_to_stmt(merge_stmt.stmt, unpacked_pks, 0)
+        .and_then(|_| {
+            change
+                .val
+                .bind(merge_stmt.stmt, unpacked_pks.len() as i32 + 1)
+        })
+        .and_then(|_| {
+            change
+                .val
+                .bind(merge_stmt.stmt, unpacked_pks.len() as i32 + 2)
+        });
     if let Err(rc) = bind_result {
         reset_cached_stmt(merge_stmt.stmt)?;
         return Err(rc);
     }
 
-    let rc = (*(*tab).pExtData)
+    let rc = (*ext_data)
         .pSetSyncBitStmt
         .step()
-        .and_then(|_| (*(*tab).pExtData).pSetSyncBitStmt.reset())
+        .and_then(|_| (*ext_data).pSetSyncBitStmt.reset())
         .and_then(|_| merge_stmt.step());
 
     reset_cached_stmt(merge_stmt.stmt)?;
 
-    let sync_rc = (*(*tab).pExtData)
+    let sync_rc = (*ext_data)
         .pClearSyncBitStmt
         .step()
-        .and_then(|_| (*(*tab).pExtData).pClearSyncBitStmt.reset());
+        .and_then(|_| (*ext_data).pClearSyncBitStmt.reset());
 
     if let Err(rc) = rc {
         return Err(rc);
@@ -678,9 +842,9 @@ unsafe fn merge_insert(
         return Err(sync_rc);
     }
 
-    let merge_result = set_winner_clock(
+    let inner_rowid = set_winner_clock(
         db,
-        (*tab).pExtData,
+        ext_data,
         &tbl_info,
         key,
         insert_col,
@@ -688,15 +852,7 @@ unsafe fn merge_insert(
         insert_db_vrsn,
         insert_site_id,
         insert_seq,
-    );
-    match merge_result {
-        Err(rc) => {
-            return Err(rc);
-        }
-        Ok(inner_rowid) => {
-            (*(*tab).pExtData).rowsImpacted += 1;
-            *rowid = slab_rowid(tbl_info_index as i32, inner_rowid);
-            return Ok(ResultCode::OK);
-        }
-    }
+    )?;
+    (*ext_data).rowsImpacted += 1;
+    Ok(Some(inner_rowid))
 }
@@ -0,0 +1,548 @@
+use alloc::borrow::Cow;
+use alloc::boxed::Box;
+use alloc::collections::BTreeMap;
+use alloc::ffi::CString;
+use alloc::format;
+use alloc::string::String;
+use alloc::vec::Vec;
+use bytes::{Buf, BufMut};
+use core::ffi::c_char;
+use core::mem;
+use core::ptr::null_mut;
+use sqlite::{ColumnType, Connection, Context, ManagedStmt, ResultCode, Value};
+use sqlite_nostd as sqlite;
+
+use crate::c::crsql_ExtData;
+use crate::changes_vtab_write::{merge_change, Change, MergeValue};
+use crate::pack_columns::{
+    pack_bytes, pack_column_value, unpack_column_value, unpack_column_value_ref,
+    unpack_columns_ref, unpack_columns_ref_from, ColumnValue, ColumnValueRef,
+};
+use crate::tableinfo::{
+    crsql_clear_merged_rows, crsql_ensure_table_infos_are_up_to_date, find_table_info_index,
+    TableInfo,
+};
+
+const NUM_CHANGE_COLUMNS: usize = 9;
+
+/**
+ * First byte of a changeset produced by `crsql_changeset_encode`.
+ * A changeset made of concatenated `crsql_pack_columns` records instead starts with
+ * the column count of its first record, which is always 9.
+ */
+const CHANGESET_MAGIC: u8 = 0xC5;
+const CHANGESET_VERSION: u8 = 1;
+
+/**
+ * A change as read out of a changeset blob. Mirrors the columns of `crsql_changes`.
+ * An empty `site_id` stands for a NULL site id.
+ *
+ * Decoded changes borrow their table, pk, cid and site id from the changeset rather than
+ * copying them out for every change. Changes read to be encoded own them.
+ */
+pub struct PackedChange<'a> {
+    pub tbl: Cow<'a, str>,
+    pub pks: Cow<'a, [u8]>,
+    pub cid: Cow<'a, str>,
+    pub val: ColumnValue,
+    pub col_vrsn: i64,
+    pub db_vrsn: i64,
+    pub site_id: Cow<'a, [u8]>,
+    pub cl: i64,
+    pub seq: i64,
+}
+
+/**
+ * Applies a batch of changes in a single call.
+ *
+ * `SELECT crsql_merge_changes(changeset)`
+ *
+ * Where `changeset` is either the output of `crsql_changeset_encode` or the concatenation of one
+ * `crsql_pack_columns("table", pk, cid, val, col_version, db_version, site_id, cl, seq)`
+ * record per change, in the column order of `crsql_changes`.
+ *
+ * Changes are grouped by table and primary key so table lookups, primary key unpacking
+ * and key lookups are paid once per row rather than once per change.
+ * Changes to the same row are applied in the order they appear in the changeset.
+ *
+ * Returns the number of rows impacted by the merge.
+ */
+pub unsafe extern "C" fn crsql_merge_changes(
+    ctx: *mut sqlite::context,
+    argc: i32,
+    argv: *mut *mut sqlite::value,
+) {
+    if argc != 1 {
+        ctx.result_error("crsql_merge_changes expects a single changeset argument");
+        return;
+    }
+    let args = sqlite::args!(argc, argv);
+    let changeset = args[0];
+    if changeset.value_type() == ColumnType::Null {
+        ctx.result_int64(0);
+        return;
+    }
+    if changeset.value_type() != ColumnType::Blob {
+        ctx.result_error("crsql_merge_changes expects a blob");
+        return;
+    }
+
+    let changes = match parse_changeset(changeset.blob()) {
+        Ok(changes) => changes,
+        Err(msg) => {
+            ctx.result_error(&msg);
+            ctx.result_error_code(ResultCode::MISUSE);
+            return;
+        }
+    };
+
+    let ext_data = ctx.user_data() as *mut crsql_ExtData;
+    let db = ctx.db_handle();
+    if let Err(_) = db.exec_safe("SAVEPOINT merge_changes") {
+        ctx.result_error("failed to start merge_changes savepoint");
+        return;
+    }
+
+    let mut err_msg: *mut c_char = null_mut();
+    let ret = merge_changes(db, ext_data, &changes, &mut err_msg as *mut _);
+    // The caller may roll back to a savepoint that we won't hear about
+    // so don't carry remembered rows past this call.
+    crsql_clear_merged_rows(ext_data);
+    match ret {
+        Ok(impacted) => {
+            if let Err(_) = db.exec_safe("RELEASE merge_changes") {
+                ctx.result_error("failed to release merge_changes savepoint");
+                return;
+            }
+            ctx.result_int64(impacted);
+        }
+        Err(rc) => {
+            if err_msg.is_null() {
+                ctx.result_error("failed to merge changes");
+            } else {
+                let msg = CString::from_raw(err_msg);
+                ctx.result_error(msg.to_str().unwrap_or("failed to merge changes"));
+            }
+            ctx.result_error_code(rc);
+            // Only undo the merge. The caller's transaction is theirs to keep or roll back.
+            let _ = db.exec_safe("ROLLBACK TO merge_changes; RELEASE merge_changes");
+        }
+    }
+}
+
+/**
+ * Parses either changeset format accepted by `crsql_merge_changes`.
+ */
+pub fn parse_changeset<'a>(data: &'a [u8]) -> Result<Vec<PackedChange<'a>>, String> {
+    if data.first() == Some(&CHANGESET_MAGIC) {
+        return decode_changeset(data);
+    }
+
+    let mut ret = Vec::new();
+    let mut buf = data;
+    while !buf.is_empty() {
+        let i = ret.len();
+        let cols = unpack_columns_ref_from(&mut buf)
+            .map_err(|_| format!("malformed changeset at change {}", i))?;
+        ret.push(to_change(cols).map_err(|e| format!("{} at change {}", e, i))?);
+    }
+    Ok(ret)
+}
+
+fn to_change<'a>(cols: Vec<ColumnValueRef<'a>>) -> Result<PackedChange<'a>, &'static str> {
+    if cols.len() != NUM_CHANGE_COLUMNS {
+        return Err("wrong number of columns for a change");
+    }
+    let mut cols = cols.into_iter();
+    let mut next = || cols.next().ok_or("wrong number of columns for a change");
+
+    let tbl = match next()? {
+        ColumnValueRef::Text(t) if t.len() <= crate::consts::MAX_TBL_NAME_LEN as usize => t,
+        ColumnValueRef::Text(_) => return Err("table name exceeded max length"),
+        _ => return Err("table name must be text"),
+    };
+    let pks = match next()? {
+        ColumnValueRef::Blob(b) => b,
+        _ => return Err("pk must be a blob"),
+    };
+    let cid = match next()? {
+        ColumnValueRef::Text(t) if t.len() <= crate::consts::MAX_TBL_NAME_LEN as usize => t,
+        ColumnValueRef::Text(_) => return Err("column name exceeded max length"),
+        _ => return Err("cid must be text"),
+    };
+    let val = next()?.to_column_value();
+    let col_vrsn = expect_int(next()?, "col_version must be an integer")?;
+    let db_vrsn = expect_int(next()?, "db_version must be an integer")?;
+    let site_id: &[u8] = match next()? {
+        ColumnValueRef::Blob(b) if b.len() <= crate::consts::SITE_ID_LEN as usize => b,
+        ColumnValueRef::Blob(_) => return Err("site id exceeded max length"),
+        ColumnValueRef::Null => &[],
+        _ => return Err("site_id must be a blob"),
+    };
+    let cl = expect_int(next()?, "cl must be an integer")?;
+    let seq = expect_int(next()?, "seq must be an integer")?;
+
+    Ok(PackedChange {
+        tbl: Cow::Borrowed(tbl),
+        pks: Cow::Borrowed(pks),
+        cid: Cow::Borrowed(cid),
+        val,
+        col_vrsn,
+        db_vrsn,
+        site_id: Cow::Borrowed(site_id),
+        cl,
+        seq,
+    })
+}
+
+fn expect_int(val: ColumnValueRef, err: &'static str) -> Result<i64, &'static str> {
+    match val {
+        ColumnValueRef::Integer(i) => Ok(i),
+        _ => Err(err),
+    }
+}
+
+unsafe fn merge_changes(
+    db: *mut sqlite::sqlite3,
+    ext_data: *mut crsql_ExtData,
+    changes: &Vec<PackedChange>,
+    errmsg: *mut *mut c_char,
+) -> Result<i64, ResultCode> {
+    let rc = crsql_ensure_table_infos_are_up_to_date(db, ext_data, errmsg);
+    if rc != ResultCode::OK as i32 {
+        let err = CString::new("Failed to update CRR table information")?;
+        *errmsg = err.into_raw();
+        return Err(ResultCode::ERROR);
+    }
+
+    let tbl_infos =
+        mem::ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>));
+
+    // Stable so changes to the same row keep their relative order.
+    let mut order: Vec<usize> = (0..changes.len()).collect();
+    order.sort_by(|l, r| {
+        let l = &changes[*l];
+        let r = &changes[*r];
+        l.tbl.cmp(&r.tbl).then_with(|| l.pks.cmp(&r.pks))
+    });
+
+    let impacted_before = (*ext_data).rowsImpacted;
+    let mut current_tbl: Option<(&str, usize)> = None;
+    let mut current_row: Option<(&[u8], Vec<ColumnValueRef>)> = None;
+    for i in order {
+        let packed = &changes[i];
+
+        let tbl_info_index = match current_tbl {
+            Some((tbl, idx)) if tbl == packed.tbl => idx,
+            _ => {
+                let idx = match find_table_info_index(ext_data, &packed.tbl) {
+                    Some(idx) => idx,
+                    None => {
+                        let err = CString::new(format!(
+                            "crsql - could not find the schema information for table {}",
+                            packed.tbl
+                        ))?;
+                        *errmsg = err.into_raw();
+                        return Err(ResultCode::ERROR);
+                    }
+                };
+                current_tbl = Some((&*packed.tbl, idx));
+                current_row = None;
+                idx
+            }
+        };
+        let tbl_info = &tbl_infos[tbl_info_index];
+
+        let same_row = match &current_row {
+            Some((pks, _)) => *pks == &*packed.pks,
+            None => false,
+        };
+        if !same_row {
+            current_row = Some((&*packed.pks, unpack_columns_ref(&packed.pks)?));
+        }
+        let (packed_pks, unpacked_pks) = current_row.as_ref().ok_or(ResultCode::ERROR)?;
+
+        let change = Change {
+            tbl: &packed.tbl,
+            cid: &packed.cid,
+            val: MergeValue::Unpacked(&packed.val),
+            col_vrsn: packed.col_vrsn,
+            db_vrsn: packed.db_vrsn,
+            site_id: &packed.site_id,
+            cl: packed.cl,
+            seq: packed.seq,
+        };
+        merge_change(
+            db,
+            ext_data,
+            tbl_info,
+            packed_pks,
+            unpacked_pks,
+            &change,
+            errmsg,
+        )?;
+    }
+
+    Ok(((*ext_data).rowsImpacted - impacted_before) as i64)
+}
+
+/**
+ * Encodes every change with a db_version greater than `since` into a compact changeset.
+ *
+ * `SELECT crsql_changeset_encode(since)`
+ *
+ * Format (all integers use the `crsql_pack_columns` integer encoding):
+ *
+ * ```
+ * magic:u8 version:u8
+ * num_tables, ...table_name:text
+ * num_cids, ...cid:text
+ * num_sites, ...site_id:blob
+ * num_rows, ...[table_idx, pk:blob, num_changes, ...[cid_idx, val, col_version, db_version, site_idx, cl, seq]]
+ * ```
+ *
+ * Table names, column names and site ids are written once and referred to by index.
+ * `site_idx` is 0 for a NULL site id and `index + 1` otherwise.
+ * Changes are grouped by table and pk so each pk is written once per row.
+ */
+pub unsafe extern "C" fn crsql_changeset_encode(
+    ctx: *mut sqlite::context,
+    argc: i32,
+    argv: *mut *mut sqlite::value,
+) {
+    if argc != 1 {
+        ctx.result_error("crsql_changeset_encode expects the db_version to encode changes after");
+        return;
+    }
+    let args = sqlite::args!(argc, argv);
+    let since = args[0].int64();
+
+    let db = ctx.db_handle();
+    match read_changes(db, since) {
+        Ok(mut changes) => {
+            ctx.result_blob_owned(encode_changeset(&mut changes));
+        }
+        Err(rc) => {
+            ctx.result_error("failed to read changes to encode");
+            ctx.result_error_code(rc);
+        }
+    }
+}
+
+fn read_changes(
+    db: *mut sqlite::sqlite3,
+    since: i64,
+) -> Result<Vec<PackedChange<'static>>, ResultCode> {
+    let stmt: ManagedStmt = db.prepare_v2(
+        "SELECT [table], pk, cid, val, col_version, db_version, site_id, cl, seq FROM crsql_changes WHERE db_version > ?",
+    )?;
+    stmt.bind_int64(1, since)?;
+
+    let mut ret = Vec::new();
+    while stmt.step()? == ResultCode::ROW {
+        ret.push(PackedChange {
+            tbl: Cow::Owned(String::from(stmt.column_text(0)?)),
+            pks: Cow::Owned(stmt.column_blob(1)?.to_vec()),
+            cid: Cow::Owned(String::from(stmt.column_text(2)?)),
+            val: ColumnValue::from_value(stmt.column_value(3)?),
+            col_vrsn: stmt.column_int64(4),
+            db_vrsn: stmt.column_int64(5),
+            site_id: Cow::Owned(stmt.column_value(6)?.blob().to_vec()),
+            cl: stmt.column_int64(7),
+            seq: stmt.column_int64(8),
+        });
+    }
+    Ok(ret)
+}
+
+fn put_int(buf: &mut Vec<u8>, val: i64) {
+    pack_column_value(buf, &ColumnValue::Integer(val));
+}
+
+fn get_int(buf: &mut &[u8]) -> Result<i64, String> {
+    match unpack_column_value(buf) {
+        Ok(ColumnValue::Integer(i)) => Ok(i),
+        _ => Err(String::from("malformed changeset: expected an integer")),
+    }
+}
+
+fn get_index(buf: &mut &[u8], len: usize) -> Result<usize, String> {
+    let i = get_int(buf)?;
+    if i < 0 || i as usize >= len {
+        return Err(String::from(
+            "malformed changeset: dictionary index out of range",
+        ));
+    }
+    Ok(i as usize)
+}
+
+/**
+ * Assigns each distinct entry an index in order of first appearance.
+ */
+fn dictionary_index<'a>(
+    entries: &mut Vec<&'a [u8]>,
+    lookup: &mut BTreeMap<&'a [u8], usize>,
+    entry: &'a [u8],
+) -> usize {
+    *lookup.entry(entry).or_insert_with(|| {
+        entries.push(entry);
+        entries.len() - 1
+    })
+}
+
+fn encode_changeset(changes: &mut Vec<PackedChange>) -> Vec<u8> {
+    // Stable so changes to the same row keep their relative order.
+    changes.sort_by(|l, r| l.tbl.cmp(&r.tbl).then_with(|| l.pks.cmp(&r.pks)));
+
+    let mut tables = Vec::new();
+    let mut table_lookup = BTreeMap::new();
+    let mut cids = Vec::new();
+    let mut cid_lookup = BTreeMap::new();
+    let mut sites = Vec::new();
+    let mut site_lookup = BTreeMap::new();
+    let mut num_rows = 0;
+    for (i, change) in changes.iter().enumerate() {
+        dictionary_index(&mut tables, &mut table_lookup, change.tbl.as_bytes());
+        dictionary_index(&mut cids, &mut cid_lookup, change.cid.as_bytes());
+        if !change.site_id.is_empty() {
+            dictionary_index(&mut sites, &mut site_lookup, &change.site_id);
+        }
+        if i == 0 || !is_same_row(&changes[i - 1], change) {
+            num_rows += 1;
+        }
+    }
+
+    let mut buf = Vec::new();
+    buf.put_u8(CHANGESET_MAGIC);
+    buf.put_u8(CHANGESET_VERSION);
+    put_int(&mut buf, tables.len() as i64);
+    for tbl in &tables {
+        pack_bytes(&mut buf, ColumnType::Text, tbl);
+    }
+    put_int(&mut buf, cids.len() as i64);
+    for cid in &cids {
+        pack_bytes(&mut buf, ColumnType::Text, cid);
+    }
+    put_int(&mut buf, sites.len() as i64);
+    for site in &sites {
+        pack_bytes(&mut buf, ColumnType::Blob, site);
+    }
+
+    put_int(&mut buf, num_rows);
+    let mut start = 0;
+    while start < changes.len() {
+        let first = &changes[start];
+        let mut end = start + 1;
+        while end < changes.len() && is_same_row(first, &changes[end]) {
+            end += 1;
+        }
+
+        put_int(&mut buf, table_lookup[first.tbl.as_bytes()] as i64);
+        pack_bytes(&mut buf, ColumnType::Blob, &first.pks);
+        put_int(&mut buf, (end - start) as i64);
+        for change in &changes[start..end] {
+            put_int(&mut buf, cid_lookup[change.cid.as_bytes()] as i64);
+            pack_column_value(&mut buf, &change.val);
+            put_int(&mut buf, change.col_vrsn);
+            put_int(&mut buf, change.db_vrsn);
+            if change.site_id.is_empty() {
+                put_int(&mut buf, 0);
+            } else {
+                put_int(&mut buf, site_lookup[&*change.site_id] as i64 + 1);
+            }
+            put_int(&mut buf, change.cl);
+            put_int(&mut buf, change.seq);
+        }
+        start = end;
+    }
+
+    buf
+}
+
+fn is_same_row(l: &PackedChange, r: &PackedChange) -> bool {
+    l.tbl == r.tbl && l.pks == r.pks
+}
+
+fn decode_changeset<'a>(data: &'a [u8]) -> Result<Vec<PackedChange<'a>>, String> {
+    let mut buf = data;
+    if buf.remaining() < 2 || buf.get_u8() != CHANGESET_MAGIC {
+        return Err(String::from("not a changeset"));
+    }
+    let version = buf.get_u8();
+    if version != CHANGESET_VERSION {
+        return Err(format!("unsupported changeset version {}", version));
+    }
+
+    let tables = get_dictionary(&mut buf)?;
+    let cids = get_dictionary(&mut buf)?;
+    let sites = get_dictionary(&mut buf)?;
+    let tables = tables
+        .into_iter()
+        .map(|t| {
+            core::str::from_utf8(t)
+                .map_err(|_| String::from("malformed changeset: table name is not utf8"))
+        })
+        .collect::<Result<Vec<_>, _>>()?;
+    let cids = cids
+        .into_iter()
+        .map(|c| {
+            core::str::from_utf8(c)
+                .map_err(|_| String::from("malformed changeset: cid is not utf8"))
+        })
+        .collect::<Result<Vec<_>, _>>()?;
+
+    let mut ret = Vec::new();
+    let num_rows = get_int(&mut buf)?;
+    for _ in 0..num_rows {
+        let tbl = tables[get_index(&mut buf, tables.len())?];
+        let pks = match unpack_column_value_ref(&mut buf) {
+            Ok(ColumnValueRef::Blob(b)) => b,
+            _ => return Err(String::from("malformed changeset: expected a pk")),
+        };
+        let num_changes = get_int(&mut buf)?;
+        for _ in 0..num_changes {
+            let cid = cids[get_index(&mut buf, cids.len())?];
+            let val = unpack_column_value(&mut buf)
+                .map_err(|_| String::from("malformed changeset: expected a value"))?;
+            let col_vrsn = get_int(&mut buf)?;
+            let db_vrsn = get_int(&mut buf)?;
+            let site_idx = get_index(&mut buf, sites.len() + 1)?;
+            let site_id: &[u8] = if site_idx == 0 {
+                &[]
+            } else {
+                sites[site_idx - 1]
+            };
+            let cl = get_int(&mut buf)?;
+            let seq = get_int(&mut buf)?;
+            ret.push(PackedChange {
+                tbl: Cow::Borrowed(tbl),
+                pks: Cow::Borrowed(pks),
+                cid: Cow::Borrowed(cid),
+                val,
+                col_vrsn,
+                db_vrsn,
+                site_id: Cow::Borrowed(site_id),
+                cl,
+                seq,
+            });
+        }
+    }
+
+    if buf.has_remaining() {
+        return Err(String::from("malformed changeset: trailing bytes"));
+    }
+    Ok(ret)
+}
+
+fn get_dictionary<'a>(buf: &mut &'a [u8]) -> Result<Vec<&'a [u8]>, String> {
+    let len = get_int(buf)?;
+    let mut ret = Vec::new();
+    for _ in 0..len {
+        match unpack_column_value_ref(buf) {
+            Ok(ColumnValueRef::Text(t)) => ret.push(t.as_bytes()),
+            Ok(ColumnValueRef::Blob(b)) => ret.push(b),
+            _ => return Err(String::from("malformed changeset: bad dictionary entry")),
+        }
+    }
+    Ok(ret)
+}
@@ -0,0 +1,273 @@
+extern crate alloc;
+
+use core::ffi::{c_char, c_int, c_void};
+use core::slice;
+
+use alloc::boxed::Box;
+use alloc::ffi::CString;
+use alloc::vec::Vec;
+use sqlite::{Connection, Context, Value};
+use sqlite_nostd as sqlite;
+use sqlite_nostd::ResultCode;
+
+use crate::changeset::{parse_changeset, PackedChange};
+use crate::pack_columns::ColumnValue;
+
+enum Columns {
+    Tbl = 0,
+    Pk = 1,
+    Cid = 2,
+    Cval = 3,
+    ColVrsn = 4,
+    DbVrsn = 5,
+    SiteId = 6,
+    Cl = 7,
+    Seq = 8,
+    Changeset = 9,
+}
+
+extern "C" fn connect(
+    db: *mut sqlite::sqlite3,
+    _aux: *mut c_void,
+    _argc: c_int,
+    _argv: *const *const c_char,
+    vtab: *mut *mut sqlite::vtab,
+    _err: *mut *mut c_char,
+) -> c_int {
+    if let Err(rc) = sqlite::declare_vtab(
+        db,
+        "CREATE TABLE x([table] TEXT NOT NULL, [pk] BLOB NOT NULL, [cid] TEXT NOT NULL, [val] ANY, [col_version] INTEGER NOT NULL, [db_version] INTEGER NOT NULL, [site_id] BLOB, [cl] INTEGER NOT NULL, [seq] INTEGER NOT NULL, changeset BLOB hidden);",
+    ) {
+        return rc as c_int;
+    }
+
+    unsafe {
+        *vtab = Box::into_raw(Box::new(sqlite::vtab {
+            nRef: 0,
+            pModule: core::ptr::null(),
+            zErrMsg: core::ptr::null_mut(),
+            #[cfg(feature = "libsql")]
+            pLibsqlModule: core::ptr::null_mut(),
+        }));
+        let _ = sqlite::vtab_config(db, sqlite::INNOCUOUS);
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn disconnect(vtab: *mut sqlite::vtab) -> c_int {
+    unsafe {
+        drop(Box::from_raw(vtab));
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn best_index(_vtab: *mut sqlite::vtab, index_info: *mut sqlite::index_info) -> c_int {
+    let constraints = unsafe {
+        slice::from_raw_parts_mut(
+            (*index_info).aConstraint,
+            (*index_info).nConstraint as usize,
+        )
+    };
+    let constraint_usage = unsafe {
+        slice::from_raw_parts_mut(
+            (*index_info).aConstraintUsage,
+            (*index_info).nConstraint as usize,
+        )
+    };
+
+    // Only the changeset can be pushed down. Constraints on the other columns are
+    // left to SQLite to check against each decoded change.
+    let mut found = false;
+    for (i, constraint) in constraints.iter().enumerate() {
+        if constraint.usable == 0
+            || constraint.iColumn != Columns::Changeset as i32
+            || constraint.op != sqlite::INDEX_CONSTRAINT_EQ as u8
+        {
+            continue;
+        }
+        constraint_usage[i].argvIndex = 1;
+        constraint_usage[i].omit = 1;
+        found = true;
+        break;
+    }
+
+    if !found {
+        // Without a changeset there is nothing to decode.
+        return ResultCode::CONSTRAINT as c_int;
+    }
+
+    ResultCode::OK as c_int
+}
+
+#[repr(C)]
+struct Cursor {
+    base: sqlite::vtab_cursor,
+    crsr: usize,
+    // Borrows from `changeset`. Declared first so that it is dropped first.
+    changes: Vec<PackedChange<'static>>,
+    changeset: Vec<u8>,
+}
+
+extern "C" fn open(_vtab: *mut sqlite::vtab, cursor: *mut *mut sqlite::vtab_cursor) -> c_int {
+    unsafe {
+        let boxed = Box::new(Cursor {
+            base: sqlite::vtab_cursor {
+                pVtab: core::ptr::null_mut(),
+            },
+            crsr: 0,
+            changes: Vec::new(),
+            changeset: Vec::new(),
+        });
+        let raw_cursor = Box::into_raw(boxed);
+        *cursor = raw_cursor.cast::<sqlite::vtab_cursor>();
+    }
+
+    ResultCode::OK as c_int
+}
+
+extern "C" fn close(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        drop(Box::from_raw(crsr));
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn filter(
+    cursor: *mut sqlite::vtab_cursor,
+    _idx_num: c_int,
+    _idx_str: *const c_char,
+    argc: c_int,
+    argv: *mut *mut sqlite::value,
+) -> c_int {
+    let args = sqlite::args!(argc, argv);
+    if args.len() < 1 {
+        unsafe {
+            (*(*cursor).pVtab).zErrMsg = CString::new("Zero args passed to filter")
+                .map_or(core::ptr::null_mut(), |f| f.into_raw());
+        }
+        return ResultCode::MISUSE as c_int;
+    }
+
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        (*crsr).crsr = 0;
+        (*crsr).changes = Vec::new();
+        // The argument only lives until filter returns so the cursor keeps a copy for the
+        // decoded changes to point into. The copy's heap buffer stays put, and alive, until
+        // the next filter or close, by which point `changes` has been cleared.
+        (*crsr).changeset = args[0].blob().to_vec();
+        let changeset: &'static [u8] =
+            core::slice::from_raw_parts((*crsr).changeset.as_ptr(), (*crsr).changeset.len());
+        match parse_changeset(changeset) {
+            Ok(changes) => {
+                (*crsr).changes = changes;
+            }
+            Err(msg) => {
+                (*(*cursor).pVtab).zErrMsg =
+                    CString::new(msg).map_or(core::ptr::null_mut(), |f| f.into_raw());
+                return ResultCode::ERROR as c_int;
+            }
+        }
+    }
+
+    ResultCode::OK as c_int
+}
+
+extern "C" fn next(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        (*crsr).crsr += 1;
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn eof(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        if (*crsr).crsr >= (*crsr).changes.len() {
+            1
+        } else {
+            0
+        }
+    }
+}
+
+extern "C" fn column(
+    cursor: *mut sqlite::vtab_cursor,
+    ctx: *mut sqlite::context,
+    col_num: c_int,
+) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    let change = unsafe { &(*crsr).changes[(*crsr).crsr] };
+    match col_num {
+        i if i == Columns::Tbl as c_int => ctx.result_text_static(&change.tbl),
+        i if i == Columns::Pk as c_int => ctx.result_blob_static(&change.pks),
+        i if i == Columns::Cid as c_int => ctx.result_text_static(&change.cid),
+        i if i == Columns::Cval as c_int => match &change.val {
+            ColumnValue::Blob(b) => ctx.result_blob_static(b),
+            ColumnValue::Float(f) => ctx.result_double(*f),
+            ColumnValue::Integer(i) => ctx.result_int64(*i),
+            ColumnValue::Null => ctx.result_null(),
+            ColumnValue::Text(t) => ctx.result_text_static(t),
+        },
+        i if i == Columns::ColVrsn as c_int => ctx.result_int64(change.col_vrsn),
+        i if i == Columns::DbVrsn as c_int => ctx.result_int64(change.db_vrsn),
+        i if i == Columns::SiteId as c_int => {
+            if change.site_id.is_empty() {
+                ctx.result_null()
+            } else {
+                ctx.result_blob_static(&change.site_id)
+            }
+        }
+        i if i == Columns::Cl as c_int => ctx.result_int64(change.cl),
+        i if i == Columns::Seq as c_int => ctx.result_int64(change.seq),
+        _ => ctx.result_null(),
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn rowid(cursor: *mut sqlite::vtab_cursor, row_id: *mut sqlite::int64) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe { *row_id = (*crsr).crsr as i64 }
+    ResultCode::OK as c_int
+}
+
+static MODULE: sqlite_nostd::module = sqlite_nostd::module {
+    iVersion: 0,
+    xCreate: None,
+    xConnect: Some(connect),
+    xBestIndex: Some(best_index),
+    xDisconnect: Some(disconnect),
+    xDestroy: None,
+    xOpen: Some(open),
+    xClose: Some(close),
+    xFilter: Some(filter),
+    xNext: Some(next),
+    xEof: Some(eof),
+    xColumn: Some(column),
+    xRowid: Some(rowid),
+    xUpdate: None,
+    xBegin: None,
+    xSync: None,
+    xCommit: None,
+    xRollback: None,
+    xFindFunction: None,
+    xRename: None,
+    xSavepoint: None,
+    xRelease: None,
+    xRollbackTo: None,
+    xShadowName: None,
+    xIntegrity: None,
+};
+
+/**
+ * Decodes a changeset made by `crsql_changeset_encode` back into `crsql_changes` rows.
+ *
+ * INSERT INTO crsql_changes SELECT * FROM crsql_changeset_decode(?);
+ */
+pub fn create_module(db: *mut sqlite::sqlite3) -> Result<ResultCode, ResultCode> {
+    db.create_module_v2("crsql_changeset_decode", &MODULE, None, None)?;
+
+    Ok(ResultCode::OK)
+}
@@ -5,6 +5,8 @@ use sqlite::value;
 use sqlite::Value;
 use sqlite_nostd as sqlite;
 
+use crate::pack_columns::ColumnValue;
+
 // TODO: add an integration test that ensures NULL == NULL!
 pub fn crsql_compare_sqlite_values(l: *mut sqlite::value, r: *mut sqlite::value) -> c_int {
     let l_type = l.value_type();
@@ -44,6 +46,43 @@ pub fn crsql_compare_sqlite_values(l: *mut sqlite::value, r: *mut sqlite::value)
     }
 }
 
+/**
+ * Same ordering as `crsql_compare_sqlite_values` but for a value that was unpacked
+ * from a changeset rather than handed to us by SQLite.
+ */
+pub fn crsql_compare_column_value(l: &ColumnValue, r: *mut sqlite::value) -> c_int {
+    let l_type = l.column_type();
+    let r_type = r.value_type();
+
+    if l_type != r_type {
+        return (r_type as i32) - (l_type as i32);
+    }
+
+    match l {
+        ColumnValue::Blob(b) => b.as_slice().cmp(r.blob()) as c_int,
+        ColumnValue::Float(l_double) => {
+            let r_double = r.double();
+            if *l_double < r_double {
+                return -1;
+            } else if *l_double > r_double {
+                return 1;
+            }
+            return 0;
+        }
+        ColumnValue::Integer(l_int) => {
+            let r_int = r.int64();
+            if *l_int < r_int {
+                return -1;
+            } else if *l_int > r_int {
+                return 1;
+            }
+            return 0;
+        }
+        ColumnValue::Null => 0,
+        ColumnValue::Text(t) => t.as_str().cmp(r.text()) as c_int,
+    }
+}
+
 pub fn any_value_changed(left: &[*mut value], right: &[*mut value]) -> Result<bool, String> {
     if left.len() != right.len() {
         return Err(format!(
@@ -5,8 +5,11 @@ use sqlite_nostd as sqlite;
 use sqlite_nostd::{ResultCode, Value};
 
 use crate::c::crsql_ExtData;
+use crate::stmt_cache::evict_stmts_over_budget;
 
 pub const MERGE_EQUAL_VALUES: &str = "merge-equal-values";
+pub const STMT_CACHE_SIZE: &str = "stmt-cache-size";
+pub const COALESCE_LOCAL_WRITES: &str = "coalesce-local-writes";
 
 pub extern "C" fn crsql_config_set(
     ctx: *mut sqlite::context,
@@ -24,6 +27,29 @@ pub extern "C" fn crsql_config_set(
             unsafe { (*ext_data).mergeEqualValues = value.int() };
             value
         }
+        STMT_CACHE_SIZE => {
+            let value = args[1];
+            if value.value_type() != sqlite::ColumnType::Integer || value.int() < 0 {
+                ctx.result_error("stmt-cache-size must be an integer >= 0");
+                ctx.result_error_code(ResultCode::MISUSE);
+                return;
+            }
+            let ext_data = ctx.user_data() as *mut crsql_ExtData;
+            unsafe { (*ext_data).stmtCacheSize = value.int() };
+            evict_stmts_over_budget(ext_data);
+            value
+        }
+        COALESCE_LOCAL_WRITES => {
+            let value = args[1];
+            if value.value_type() != sqlite::ColumnType::Integer {
+                ctx.result_error("coalesce-local-writes must be an integer");
+                ctx.result_error_code(ResultCode::MISUSE);
+                return;
+            }
+            let ext_data = ctx.user_data() as *mut crsql_ExtData;
+            unsafe { (*ext_data).coalesceLocalWrites = value.int() };
+            value
+        }
         _ => {
             ctx.result_error("Unknown setting name");
             ctx.result_error_code(ResultCode::ERROR);
@@ -76,6 +102,14 @@ pub extern "C" fn crsql_config_get(
             let ext_data = ctx.user_data() as *mut crsql_ExtData;
             ctx.result_int(unsafe { (*ext_data).mergeEqualValues });
         }
+        STMT_CACHE_SIZE => {
+            let ext_data = ctx.user_data() as *mut crsql_ExtData;
+            ctx.result_int(unsafe { (*ext_data).stmtCacheSize });
+        }
+        COALESCE_LOCAL_WRITES => {
+            let ext_data = ctx.user_data() as *mut crsql_ExtData;
+            ctx.result_int(unsafe { (*ext_data).coalesceLocalWrites });
+        }
         _ => {
             ctx.result_error("Unknown setting name");
             ctx.result_error_code(ResultCode::ERROR);
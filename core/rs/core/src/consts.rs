@@ -1,5 +1,6 @@
 pub const TBL_SITE_ID: &'static str = "crsql_site_id";
 pub const TBL_SCHEMA: &'static str = "crsql_master";
+pub const TBL_DB_VERSION: &'static str = "crsql_db_version";
 // pub const CRSQLITE_VERSION_0_15_0: i32 = 15_00_00;
 // pub const CRSQLITE_VERSION_0_13_0: i32 = 13_00_00;
 // MM_mm_pp_xx
@@ -3,7 +3,7 @@ use sqlite_nostd as sqlite;
 use sqlite_nostd::ResultCode;
 
 use crate::bootstrap::create_clock_table;
-use crate::tableinfo::{is_table_compatible, pull_table_info};
+use crate::tableinfo::{is_table_compatible, pull_table_info, TableInfo};
 use crate::triggers::create_triggers;
 use crate::{backfill_table, is_crr, remove_crr_triggers_if_exist};
 
@@ -19,11 +19,39 @@ pub fn create_crr(
     no_tx: bool,
     err: *mut *mut c_char,
 ) -> Result<ResultCode, ResultCode> {
+    let table_info = match create_crr_without_backfill(db, table, err)? {
+        Some(table_info) => table_info,
+        None => return Ok(ResultCode::OK),
+    };
+
+    backfill_table(
+        db,
+        table,
+        &table_info.pks,
+        &table_info.non_pks,
+        is_commit_alter,
+        no_tx,
+    )?;
+
+    Ok(ResultCode::OK)
+}
+
+/**
+ * Creates the clock table and triggers of a crr but leaves the rows already in the table
+ * for the caller to backfill.
+ *
+ * Returns `None` if the table is already a crr.
+ */
+pub fn create_crr_without_backfill(
+    db: *mut sqlite::sqlite3,
+    table: &str,
+    err: *mut *mut c_char,
+) -> Result<Option<TableInfo>, ResultCode> {
     if !is_table_compatible(db, table, err)? {
         return Err(ResultCode::ERROR);
     }
     if is_crr(db, table)? {
-        return Ok(ResultCode::OK);
+        return Ok(None);
     }
 
     // We do not / can not pull this from the cached set of table infos
@@ -36,14 +64,5 @@ pub fn create_crr(
     remove_crr_triggers_if_exist(db, table)?;
     create_triggers(db, &table_info, err)?;
 
-    backfill_table(
-        db,
-        table,
-        &table_info.pks,
-        &table_info.non_pks,
-        is_commit_alter,
-        no_tx,
-    )?;
-
-    Ok(ResultCode::OK)
+    Ok(Some(table_info))
 }
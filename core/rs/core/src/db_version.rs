@@ -11,10 +11,9 @@ use sqlite_nostd as sqlite;
 
 use crate::c::crsql_ExtData;
 use crate::c::crsql_fetchPragmaDataVersion;
-use crate::c::crsql_fetchPragmaSchemaVersion;
-use crate::c::DB_VERSION_SCHEMA_VERSION;
 use crate::consts::MIN_POSSIBLE_DB_VERSION;
 use crate::ext_data::recreate_db_version_stmt;
+use crate::stats;
 
 #[no_mangle]
 pub extern "C" fn crsql_fill_db_version_if_needed(
@@ -38,27 +37,66 @@ pub extern "C" fn crsql_next_db_version(
     merging_version: sqlite::int64,
     errmsg: *mut *mut c_char,
 ) -> sqlite::int64 {
-    match next_db_version(db, ext_data, Some(merging_version)) {
-        Ok(version) => version,
-        Err(msg) => {
-            errmsg.set(&msg);
-            -1
-        }
+    // May be called outside of a write transaction so always check for writes
+    // from other connections.
+    if let Err(msg) = fill_db_version_if_needed(db, ext_data) {
+        errmsg.set(&msg);
+        return -1;
     }
+    // Not persisted here: that would turn every read of it into a write. Callers that
+    // store the version, like the backfill, persist it once they are done.
+    bump_pending_db_version(ext_data, Some(merging_version))
 }
 
 /**
- * Given this needs to do a pragma check, invoke it as little as possible.
- * TODO: We could optimize to only do a pragma check once per transaction.
- * Need to save some bit that states we checked the pragma already and reset on tx commit or rollback.
+ * The next db version for a write made by this connection.
+ *
+ * Only for use while a write is in progress. Once we hold the write lock no other
+ * connection can commit so `PRAGMA data_version` only needs to be checked
+ * on the first call of each transaction.
  */
 pub fn next_db_version(
     db: *mut sqlite3,
     ext_data: *mut crsql_ExtData,
     merging_version: Option<i64>,
 ) -> Result<i64, String> {
-    fill_db_version_if_needed(db, ext_data)?;
+    if unsafe { (*ext_data).dataVersionCheckedThisTx } == 0 {
+        fill_db_version_if_needed(db, ext_data)?;
+        unsafe {
+            (*ext_data).dataVersionCheckedThisTx = 1;
+        }
+    }
+
+    let ret = bump_pending_db_version(ext_data, merging_version);
+    persist_db_version(ext_data, ret)?;
+    Ok(ret)
+}
+
+/**
+ * Raises the version stored in `crsql_db_version` so other connections, and later
+ * opens of the db, can read it back without scanning the clock tables.
+ *
+ * The commit hook can not write to the db so this happens as part of each write.
+ * Doing it once per transaction is not enough: a `ROLLBACK TO` can undo the update
+ * without us being told. The statement does not write anything if the row already
+ * holds the version.
+ */
+fn persist_db_version(ext_data: *mut crsql_ExtData, db_version: i64) -> Result<(), String> {
+    let stmt = unsafe { (*ext_data).pSetDbVersionStmt };
+    if let Err(rc) = stmt.bind_int64(1, db_version) {
+        let _ = stmt.reset();
+        return Err(format!("failed to bind db version: {}", rc));
+    }
+    let rc = stmt.step();
+    stmt.reset()
+        .or_else(|rc| Err(format!("failed to reset set db version stmt: {}", rc)))?;
+    match rc {
+        Ok(ResultCode::DONE) => Ok(()),
+        Ok(rc) | Err(rc) => Err(format!("failed to persist db version: {}", rc)),
+    }
+}
 
+fn bump_pending_db_version(ext_data: *mut crsql_ExtData, merging_version: Option<i64>) -> i64 {
     let mut ret = unsafe { (*ext_data).dbVersion + 1 };
     if ret < unsafe { (*ext_data).pendingDbVersion } {
         ret = unsafe { (*ext_data).pendingDbVersion };
@@ -71,7 +109,7 @@ pub fn next_db_version(
     unsafe {
         (*ext_data).pendingDbVersion = ret;
     }
-    Ok(ret)
+    ret
 }
 
 pub fn fill_db_version_if_needed(
@@ -86,7 +124,10 @@ pub fn fill_db_version_if_needed(
         if (*ext_data).dbVersion != -1 && rc == 0 {
             return Ok(ResultCode::OK);
         }
-        fetch_db_version_from_storage(db, ext_data)
+        let start = stats::now();
+        let ret = fetch_db_version_from_storage(db, ext_data);
+        stats::get_stats(ext_data).db_version_fetches.record(start);
+        ret
     }
 }
 
@@ -95,32 +136,16 @@ pub fn fetch_db_version_from_storage(
     ext_data: *mut crsql_ExtData,
 ) -> Result<ResultCode, String> {
     unsafe {
-        let schema_changed = if (*ext_data).pDbVersionStmt == ptr::null_mut() {
-            1 as c_int
-        } else {
-            crsql_fetchPragmaSchemaVersion(db, ext_data, DB_VERSION_SCHEMA_VERSION)
-        };
-
-        if schema_changed < 0 {
-            return Err("failed to fetch the pragma schema version".to_string());
-        }
-
-        if schema_changed > 0 {
-            match recreate_db_version_stmt(db, ext_data) {
-                Ok(ResultCode::DONE) => {
-                    // this means there are no clock tables / this is a clean db
-                    (*ext_data).dbVersion = 0;
-                    return Ok(ResultCode::OK);
-                }
-                Ok(_) => {}
-                Err(rc) => return Err(format!("failed to recreate db version stmt: {}", rc)),
+        if (*ext_data).pDbVersionStmt == ptr::null_mut() {
+            if let Err(rc) = recreate_db_version_stmt(db, ext_data) {
+                return Err(format!("failed to recreate db version stmt: {}", rc));
             }
         }
 
         let db_version_stmt = (*ext_data).pDbVersionStmt;
         let rc = db_version_stmt.step();
         match rc {
-            // no rows? We're a fresh db with the min starting version
+            // no row? We're a fresh db with the min starting version
             Ok(ResultCode::DONE) => {
                 db_version_stmt.reset().or_else(|rc| {
                     Err(format!(
@@ -17,6 +17,8 @@ mod c;
 mod changes_vtab;
 mod changes_vtab_read;
 mod changes_vtab_write;
+mod changeset;
+mod changeset_decode_vtab;
 mod compare_values;
 mod config;
 mod consts;
@@ -34,6 +36,8 @@ pub mod pack_columns;
 #[cfg(not(feature = "test"))]
 mod pack_columns;
 mod sha;
+mod stats;
+mod stats_vtab;
 mod stmt_cache;
 #[cfg(feature = "test")]
 pub mod tableinfo;
@@ -50,7 +54,6 @@ use core::ffi::c_char;
 use core::mem;
 use core::ptr::null_mut;
 extern crate alloc;
-use alter::crsql_compact_post_alter;
 use automigrate::*;
 use backfill::*;
 use c::{crsql_freeExtData, crsql_newExtData};
@@ -166,6 +169,27 @@ pub extern "C" fn sqlite3_crsqlcore_init(
         return null_mut();
     }
 
+    let rc = changeset_decode_vtab::create_module(db).unwrap_or(ResultCode::ERROR);
+    if rc != ResultCode::OK {
+        return null_mut();
+    }
+
+    let rc = db
+        .create_function_v2(
+            "crsql_changeset_encode",
+            1,
+            sqlite::UTF8,
+            None,
+            Some(changeset::crsql_changeset_encode),
+            None,
+            None,
+            None,
+        )
+        .unwrap_or(ResultCode::ERROR);
+    if rc != ResultCode::OK {
+        return null_mut();
+    }
+
     let rc = crate::bootstrap::crsql_init_peer_tracking_table(db);
     if rc != ResultCode::OK as c_int {
         return null_mut();
@@ -354,12 +378,29 @@ pub extern "C" fn sqlite3_crsqlcore_init(
         return null_mut();
     }
 
+    let rc = db
+        .create_function_v2(
+            "crsql_backfill_step",
+            2,
+            sqlite::UTF8 | sqlite::DIRECTONLY,
+            Some(ext_data as *mut c_void),
+            Some(backfill::crsql_backfill_step),
+            None,
+            None,
+            None,
+        )
+        .unwrap_or(ResultCode::ERROR);
+    if rc != ResultCode::OK {
+        unsafe { crsql_freeExtData(ext_data) };
+        return null_mut();
+    }
+
     let rc = db
         .create_function_v2(
             "crsql_begin_alter",
             -1,
             sqlite::UTF8 | sqlite::DIRECTONLY,
-            None,
+            Some(ext_data as *mut c_void),
             Some(x_crsql_begin_alter),
             None,
             None,
@@ -473,6 +514,23 @@ pub extern "C" fn sqlite3_crsqlcore_init(
         return null_mut();
     }
 
+    let rc = db
+        .create_function_v2(
+            "crsql_merge_changes",
+            1,
+            sqlite::UTF8 | sqlite::DIRECTONLY,
+            Some(ext_data as *mut c_void),
+            Some(changeset::crsql_merge_changes),
+            None,
+            None,
+            None,
+        )
+        .unwrap_or(ResultCode::ERROR);
+    if rc != ResultCode::OK {
+        unsafe { crsql_freeExtData(ext_data) };
+        return null_mut();
+    }
+
     let rc = db
         .create_function_v2(
             "crsql_config_set",
@@ -507,6 +565,12 @@ pub extern "C" fn sqlite3_crsqlcore_init(
         return null_mut();
     }
 
+    let rc = stats_vtab::create_module(db, ext_data).unwrap_or(ResultCode::ERROR);
+    if rc != ResultCode::OK {
+        unsafe { crsql_freeExtData(ext_data) };
+        return null_mut();
+    }
+
     return ext_data as *mut c_void;
 }
 
@@ -621,13 +685,14 @@ unsafe extern "C" fn x_crsql_begin_alter(
         ("main", args[0].text())
     };
 
+    let ext_data = ctx.user_data() as *mut c::crsql_ExtData;
     let db = ctx.db_handle();
     let rc = db.exec_safe("SAVEPOINT alter_crr");
     if rc.is_err() {
         ctx.result_error("failed to start alter_crr savepoint");
         return;
     }
-    let rc = remove_crr_triggers_if_exist(db, table_name);
+    let rc = alter::begin_alter(db, ext_data, table_name);
     if rc.is_err() {
         sqlite::result_error_code(ctx, rc.unwrap_err() as c_int);
         let _ = db.exec_safe("ROLLBACK");
@@ -636,6 +701,15 @@ unsafe extern "C" fn x_crsql_begin_alter(
     ctx.result_text_static("OK");
 }
 
+/**
+ * Finishes an alter started by `crsql_begin_alter`.
+ *
+ * `select crsql_commit_alter([schema,] table[, staged])`
+ *
+ * With `staged` set, a primary key change leaves the backfill of the clock tables to
+ * `crsql_backfill_step`. Until a row is backfilled it is not reported by `crsql_changes` and
+ * merges into it always win. See `alter::commit_alter`.
+ */
 unsafe extern "C" fn x_crsql_commit_alter(
     ctx: *mut sqlite::context,
     argc: i32,
@@ -650,34 +724,27 @@ unsafe extern "C" fn x_crsql_commit_alter(
     }
 
     let args = sqlite::args!(argc, argv);
-    let (schema_name, table_name) = if argc == 2 {
-        (args[0].text(), args[1].text())
+    let (schema_name, table_name, staged) = if argc == 3 {
+        (args[0].text(), args[1].text(), args[2].int() != 0)
+    } else if argc == 2 {
+        (args[0].text(), args[1].text(), false)
     } else {
-        ("main", args[0].text())
+        ("main", args[0].text(), false)
     };
 
     let ext_data = ctx.user_data() as *mut c::crsql_ExtData;
     let mut err_msg = null_mut();
     let db = ctx.db_handle();
-    let rc = crsql_compact_post_alter(
+    let rc = alter::commit_alter(
         db,
-        table_name.as_ptr() as *const c_char,
         ext_data,
+        schema_name,
+        table_name,
+        staged,
         &mut err_msg as *mut _,
-    );
+    )
+    .unwrap_or_else(|err| err) as c_int;
 
-    let rc = if rc == ResultCode::OK as c_int {
-        crsql_create_crr(
-            db,
-            schema_name.as_ptr() as *const c_char,
-            table_name.as_ptr() as *const c_char,
-            1,
-            0,
-            &mut err_msg as *mut _,
-        )
-    } else {
-        rc
-    };
     let rc = if rc == ResultCode::OK as c_int {
         db.exec_safe("RELEASE alter_crr")
             .unwrap_or(ResultCode::ERROR) as c_int
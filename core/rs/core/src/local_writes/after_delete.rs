@@ -6,7 +6,7 @@ use sqlite::Context;
 use sqlite::ResultCode;
 use sqlite_nostd as sqlite;
 
-use crate::{c::crsql_ExtData, tableinfo::TableInfo};
+use crate::{c::crsql_ExtData, stats, tableinfo::TableInfo};
 
 use super::bump_seq;
 use super::trigger_fn_preamble;
@@ -20,7 +20,10 @@ pub unsafe extern "C" fn x_crsql_after_delete(
     argv: *mut *mut sqlite::value,
 ) {
     let result = trigger_fn_preamble(ctx, argc, argv, |table_info, values, ext_data| {
-        after_delete(ctx.db_handle(), ext_data, table_info, &values[1..])
+        let start = stats::now();
+        let ret = after_delete(ctx.db_handle(), ext_data, table_info, &values[1..]);
+        table_info.stats.delete_triggers.record(start);
+        ret
     });
 
     match result {
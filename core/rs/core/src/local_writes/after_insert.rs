@@ -6,7 +6,7 @@ use sqlite::Context;
 use sqlite::ResultCode;
 use sqlite_nostd as sqlite;
 
-use crate::{c::crsql_ExtData, tableinfo::TableInfo};
+use crate::{c::crsql_ExtData, stats, tableinfo::TableInfo};
 
 use super::bump_seq;
 use super::trigger_fn_preamble;
@@ -20,7 +20,10 @@ pub unsafe extern "C" fn x_crsql_after_insert(
     argv: *mut *mut sqlite::value,
 ) {
     let result = trigger_fn_preamble(ctx, argc, argv, |table_info, values, ext_data| {
-        after_insert(ctx.db_handle(), ext_data, table_info, &values[1..])
+        let start = stats::now();
+        let ret = after_insert(ctx.db_handle(), ext_data, table_info, &values[1..]);
+        table_info.stats.insert_triggers.record(start);
+        ret
     });
 
     match result {
@@ -56,7 +59,7 @@ fn after_insert(
     // now for each non-pk column, create or update the column record
     for col in tbl_info.non_pks.iter() {
         let seq = bump_seq(ext_data);
-        super::mark_locally_updated(db, tbl_info, key_new, col, db_version, seq)?;
+        super::mark_locally_updated(db, ext_data, tbl_info, key_new, col, db_version, seq)?;
     }
     Ok(ResultCode::OK)
 }
@@ -6,7 +6,8 @@ use sqlite::{sqlite3, value, Context, ResultCode};
 use sqlite_nostd as sqlite;
 
 use crate::compare_values::crsql_compare_sqlite_values;
-use crate::{c::crsql_ExtData, tableinfo::TableInfo};
+use crate::triggers::CHANGED_COLUMNS_PER_MASK;
+use crate::{c::crsql_ExtData, stats, tableinfo::TableInfo};
 
 use super::trigger_fn_preamble;
 
@@ -16,18 +17,35 @@ pub unsafe extern "C" fn x_crsql_after_update(
     argv: *mut *mut sqlite::value,
 ) {
     let result = trigger_fn_preamble(ctx, argc, argv, |table_info, values, ext_data| {
-        let (pks_new, pks_old, non_pks_new, non_pks_old) =
-            partition_values(values, 1, table_info.pks.len(), table_info.non_pks.len())?;
+        let num_pks = table_info.pks.len();
+        let num_non_pks = table_info.non_pks.len();
+        let (pks_new, pks_old, changed) =
+            if values.len() == 1 + num_pks * 2 + changed_masks_len(num_non_pks) {
+                let (pks_new, rest) = values[1..].split_at(num_pks);
+                let (pks_old, masks) = rest.split_at(num_pks);
+                (pks_new, pks_old, ChangedColumns::Masks(masks))
+            } else {
+                // Triggers created before the update trigger passed masks.
+                let (pks_new, pks_old, non_pks_new, non_pks_old) =
+                    partition_values(values, 1, num_pks, num_non_pks)?;
+                (
+                    pks_new,
+                    pks_old,
+                    ChangedColumns::Values(non_pks_new, non_pks_old),
+                )
+            };
 
-        after_update(
+        let start = stats::now();
+        let ret = after_update(
             ctx.db_handle(),
             ext_data,
             table_info,
             pks_new,
             pks_old,
-            non_pks_new,
-            non_pks_old,
-        )
+            changed,
+        );
+        table_info.stats.update_triggers.record(start);
+        ret
     });
 
     match result {
@@ -40,6 +58,34 @@ pub unsafe extern "C" fn x_crsql_after_update(
     }
 }
 
+/**
+ * Which non primary key columns an update changed, as passed by the update trigger.
+ */
+enum ChangedColumns<'a> {
+    // A bit per column, `CHANGED_COLUMNS_PER_MASK` columns to an integer.
+    Masks(&'a [*mut value]),
+    // The new and old value of every column.
+    Values(&'a [*mut value], &'a [*mut value]),
+}
+
+impl<'a> ChangedColumns<'a> {
+    fn is_changed(&self, col: usize) -> bool {
+        match self {
+            ChangedColumns::Masks(masks) => {
+                let mask = masks[col / CHANGED_COLUMNS_PER_MASK].int64() as u64;
+                (mask >> (col % CHANGED_COLUMNS_PER_MASK)) & 1 == 1
+            }
+            ChangedColumns::Values(new, old) => {
+                crsql_compare_sqlite_values(new[col], old[col]) != 0
+            }
+        }
+    }
+}
+
+fn changed_masks_len(num_non_pks: usize) -> usize {
+    (num_non_pks + CHANGED_COLUMNS_PER_MASK - 1) / CHANGED_COLUMNS_PER_MASK
+}
+
 fn partition_values<T>(
     values: &[T],
     offset: usize,
@@ -68,8 +114,7 @@ fn after_update(
     tbl_info: &TableInfo,
     pks_new: &[*mut value],
     pks_old: &[*mut value],
-    non_pks_new: &[*mut value],
-    non_pks_old: &[*mut value],
+    changed: ChangedColumns,
 ) -> Result<ResultCode, String> {
     let next_db_version = crate::db_version::next_db_version(db, ext_data, None)?;
     let new_key = tbl_info
@@ -99,17 +144,14 @@ fn after_update(
 
     // now for each non_pk_col we need to do an insert
     // where new value is not old value
-    for ((new, old), col_info) in non_pks_new
-        .iter()
-        .zip(non_pks_old.iter())
-        .zip(tbl_info.non_pks.iter())
-    {
-        if crsql_compare_sqlite_values(*new, *old) != 0 {
+    for (i, col_info) in tbl_info.non_pks.iter().enumerate() {
+        if changed.is_changed(i) {
             let next_seq = super::bump_seq(ext_data);
             // we had a difference in new and old values
             // we need to track crdt metadata
             super::mark_locally_updated(
                 db,
+                ext_data,
                 tbl_info,
                 new_key,
                 col_info,
@@ -174,6 +216,15 @@ fn after_update__move_non_sentinels(
 mod tests {
     use super::*;
 
+    #[test]
+    fn test_changed_masks_len() {
+        assert_eq!(changed_masks_len(0), 0);
+        assert_eq!(changed_masks_len(1), 1);
+        assert_eq!(changed_masks_len(64), 1);
+        assert_eq!(changed_masks_len(65), 2);
+        assert_eq!(changed_masks_len(160), 3);
+    }
+
     #[test]
     fn test_partition_values() {
         let values1 = vec!["tbl", "pk.new", "pk.old", "c.new", "c.old"];
@@ -13,7 +13,9 @@ use sqlite::{Context, ManagedStmt, Value};
 use sqlite_nostd as sqlite;
 use sqlite_nostd::ResultCode;
 
-use crate::tableinfo::{crsql_ensure_table_infos_are_up_to_date, ColumnInfo, TableInfo};
+use crate::tableinfo::{
+    crsql_ensure_table_infos_are_up_to_date, find_table_info_index, ColumnInfo, TableInfo,
+};
 
 pub mod after_delete;
 pub mod after_insert;
@@ -48,12 +50,14 @@ where
     let table_infos =
         unsafe { ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>)) };
     let table_name = values[0].text();
-    let table_info = match table_infos.iter().find(|t| &(t.tbl_name) == table_name) {
-        Some(t) => t,
+    let table_info = match find_table_info_index(ext_data, table_name) {
+        Some(idx) => &table_infos[idx],
         None => {
             return Err(format!("table {} not found", table_name));
         }
     };
+    // A local write may change the causal length of the last merged row.
+    table_info.clear_merged_row();
 
     f(table_info, &values, ext_data)
 }
@@ -107,9 +111,19 @@ fn bump_seq(ext_data: *mut crsql_ExtData) -> c_int {
     }
 }
 
+/**
+ * With `coalesce-local-writes` set, a column this transaction already marked keeps its clock
+ * rather than having it bumped again, so repeated writes to a row cost a lookup rather than a
+ * write to the clock table. The column's version then goes up once per transaction rather than
+ * once per write.
+ *
+ * Rolling back to a savepoint also rolls back the clock to its previous db_version so the next
+ * write marks the column again.
+ */
 #[allow(non_snake_case)]
 fn mark_locally_updated(
     db: *mut sqlite3,
+    ext_data: *mut crsql_ExtData,
     tbl_info: &TableInfo,
     new_key: sqlite::int64,
     col_info: &ColumnInfo,
@@ -132,6 +146,9 @@ fn mark_locally_updated(
         .and_then(|_| mark_locally_updated_stmt.bind_int(4, seq))
         .and_then(|_| mark_locally_updated_stmt.bind_int64(5, db_version))
         .and_then(|_| mark_locally_updated_stmt.bind_int(6, seq))
+        .and_then(|_| {
+            mark_locally_updated_stmt.bind_int(7, unsafe { (*ext_data).coalesceLocalWrites })
+        })
         .or_else(|_| Err("failed binding to mark_locally_updated_stmt"))?;
     step_trigger_stmt(mark_locally_updated_stmt)
 }
@@ -121,70 +121,219 @@ pub enum ColumnValue {
     Text(String),
 }
 
+impl ColumnValue {
+    pub fn from_value(value: *mut sqlite::value) -> ColumnValue {
+        match value.value_type() {
+            ColumnType::Blob => ColumnValue::Blob(value.blob().to_vec()),
+            ColumnType::Float => ColumnValue::Float(value.double()),
+            ColumnType::Integer => ColumnValue::Integer(value.int64()),
+            ColumnType::Null => ColumnValue::Null,
+            ColumnType::Text => ColumnValue::Text(String::from(value.text())),
+        }
+    }
+
+    pub fn column_type(&self) -> ColumnType {
+        match self {
+            ColumnValue::Blob(_) => ColumnType::Blob,
+            ColumnValue::Float(_) => ColumnType::Float,
+            ColumnValue::Integer(_) => ColumnType::Integer,
+            ColumnValue::Null => ColumnType::Null,
+            ColumnValue::Text(_) => ColumnType::Text,
+        }
+    }
+
+    pub fn to_ref(&self) -> ColumnValueRef {
+        match self {
+            ColumnValue::Blob(b) => ColumnValueRef::Blob(b),
+            ColumnValue::Float(f) => ColumnValueRef::Float(*f),
+            ColumnValue::Integer(i) => ColumnValueRef::Integer(*i),
+            ColumnValue::Null => ColumnValueRef::Null,
+            ColumnValue::Text(t) => ColumnValueRef::Text(t),
+        }
+    }
+}
+
+/**
+ * A `ColumnValue` whose text and blob bytes are borrowed, typically from the
+ * packed blob it was unpacked from.
+ */
+#[derive(Clone, Copy)]
+pub enum ColumnValueRef<'a> {
+    Blob(&'a [u8]),
+    Float(f64),
+    Integer(i64),
+    Null,
+    Text(&'a str),
+}
+
+impl<'a> ColumnValueRef<'a> {
+    pub fn to_column_value(&self) -> ColumnValue {
+        match self {
+            ColumnValueRef::Blob(b) => ColumnValue::Blob(b.to_vec()),
+            ColumnValueRef::Float(f) => ColumnValue::Float(*f),
+            ColumnValueRef::Integer(i) => ColumnValue::Integer(*i),
+            ColumnValueRef::Null => ColumnValue::Null,
+            ColumnValueRef::Text(t) => ColumnValue::Text(String::from(*t)),
+        }
+    }
+}
+
 // TODO: make a table valued function that can be used to extract a row per packed column?
 pub fn unpack_columns(data: &[u8]) -> Result<Vec<ColumnValue>, ResultCode> {
-    let mut ret = vec![];
     let mut buf = data;
+    unpack_columns_from(&mut buf)
+}
+
+/**
+ * Like `unpack_columns` but text and blob values point into `data` rather than being copied.
+ * This is what the merge path uses to bind primary keys.
+ */
+pub fn unpack_columns_ref(data: &[u8]) -> Result<Vec<ColumnValueRef>, ResultCode> {
+    let mut buf = data;
+    unpack_columns_ref_from(&mut buf)
+}
+
+/**
+ * Like `unpack_columns_from` but text and blob values point into `buf` rather than being copied.
+ */
+pub fn unpack_columns_ref_from<'a>(
+    buf: &mut &'a [u8],
+) -> Result<Vec<ColumnValueRef<'a>>, ResultCode> {
+    let mut ret = vec![];
+    if !buf.has_remaining() {
+        return Err(ResultCode::ABORT);
+    }
     let num_columns = buf.get_u8();
 
     for _i in 0..num_columns {
-        if !buf.has_remaining() {
-            return Err(ResultCode::ABORT);
-        }
-        let column_type_and_maybe_intlen = buf.get_u8();
-        let column_type = ColumnType::from_u8(column_type_and_maybe_intlen & 0x07);
-        let intlen = (column_type_and_maybe_intlen >> 3 & 0xFF) as usize;
-
-        match column_type {
-            Some(ColumnType::Blob) => {
-                if buf.remaining() < intlen {
-                    return Err(ResultCode::ABORT);
-                }
-                let len = buf.get_int(intlen) as usize;
-                if buf.remaining() < len {
-                    return Err(ResultCode::ABORT);
-                }
-                let bytes = buf.copy_to_bytes(len);
-                ret.push(ColumnValue::Blob(bytes.to_vec()));
-            }
-            Some(ColumnType::Float) => {
-                if buf.remaining() < 8 {
-                    return Err(ResultCode::ABORT);
-                }
-                ret.push(ColumnValue::Float(buf.get_f64()));
-            }
-            Some(ColumnType::Integer) => {
-                if buf.remaining() < intlen {
-                    return Err(ResultCode::ABORT);
-                }
-                ret.push(ColumnValue::Integer(buf.get_int(intlen)));
-            }
-            Some(ColumnType::Null) => {
-                ret.push(ColumnValue::Null);
+        ret.push(unpack_column_value_ref(buf)?);
+    }
+
+    Ok(ret)
+}
+
+/**
+ * Unpacks a single packed record from the front of `buf`, advancing `buf` past it.
+ * Used to walk a buffer of several packed records laid end to end.
+ */
+pub fn unpack_columns_from(buf: &mut &[u8]) -> Result<Vec<ColumnValue>, ResultCode> {
+    let mut ret = vec![];
+    if !buf.has_remaining() {
+        return Err(ResultCode::ABORT);
+    }
+    let num_columns = buf.get_u8();
+
+    for _i in 0..num_columns {
+        ret.push(unpack_column_value(buf)?);
+    }
+
+    Ok(ret)
+}
+
+/**
+ * Unpacks a single value, as written by `pack_column_value`, from the front of `buf`.
+ */
+pub fn unpack_column_value(buf: &mut &[u8]) -> Result<ColumnValue, ResultCode> {
+    unpack_column_value_ref(buf).map(|val| val.to_column_value())
+}
+
+/**
+ * Unpacks a single value from the front of `buf` without copying its bytes.
+ */
+pub fn unpack_column_value_ref<'a>(buf: &mut &'a [u8]) -> Result<ColumnValueRef<'a>, ResultCode> {
+    if !buf.has_remaining() {
+        return Err(ResultCode::ABORT);
+    }
+    let column_type_and_maybe_intlen = buf.get_u8();
+    let column_type = ColumnType::from_u8(column_type_and_maybe_intlen & 0x07);
+    let intlen = (column_type_and_maybe_intlen >> 3 & 0xFF) as usize;
+    if intlen > 8 {
+        return Err(ResultCode::ABORT);
+    }
+
+    match column_type {
+        Some(ColumnType::Blob) => Ok(ColumnValueRef::Blob(take_bytes(buf, intlen)?)),
+        Some(ColumnType::Float) => {
+            if buf.remaining() < 8 {
+                return Err(ResultCode::ABORT);
             }
-            Some(ColumnType::Text) => {
-                if buf.remaining() < intlen {
-                    return Err(ResultCode::ABORT);
-                }
-                let len = buf.get_int(intlen) as usize;
-                if buf.remaining() < len {
-                    return Err(ResultCode::ABORT);
-                }
-                let bytes = buf.copy_to_bytes(len);
-                ret.push(ColumnValue::Text(unsafe {
-                    String::from_utf8_unchecked(bytes.to_vec())
-                }))
+            Ok(ColumnValueRef::Float(buf.get_f64()))
+        }
+        Some(ColumnType::Integer) => {
+            if buf.remaining() < intlen {
+                return Err(ResultCode::ABORT);
             }
-            None => return Err(ResultCode::MISUSE),
+            Ok(ColumnValueRef::Integer(buf.get_int(intlen)))
+        }
+        Some(ColumnType::Null) => Ok(ColumnValueRef::Null),
+        Some(ColumnType::Text) => {
+            let bytes = take_bytes(buf, intlen)?;
+            Ok(ColumnValueRef::Text(unsafe {
+                core::str::from_utf8_unchecked(bytes)
+            }))
         }
+        None => Err(ResultCode::MISUSE),
     }
+}
 
-    Ok(ret)
+/**
+ * Reads a length prefix of `intlen` bytes then splits that many bytes off the front of `buf`.
+ */
+fn take_bytes<'a>(buf: &mut &'a [u8], intlen: usize) -> Result<&'a [u8], ResultCode> {
+    if buf.remaining() < intlen {
+        return Err(ResultCode::ABORT);
+    }
+    let len = buf.get_int(intlen) as usize;
+    if buf.remaining() < len {
+        return Err(ResultCode::ABORT);
+    }
+    let (bytes, rest) = buf.split_at(len);
+    *buf = rest;
+    Ok(bytes)
+}
+
+/**
+ * Packs a single value using the same encoding `crsql_pack_columns` uses for each column.
+ */
+pub fn pack_column_value(buf: &mut Vec<u8>, val: &ColumnValue) {
+    match val {
+        ColumnValue::Blob(b) => pack_bytes(buf, ColumnType::Blob, b),
+        ColumnValue::Float(f) => {
+            buf.put_u8(ColumnType::Float as u8);
+            buf.put_f64(*f);
+        }
+        ColumnValue::Integer(i) => {
+            let num_bytes_for_int = num_bytes_needed_i64(*i);
+            buf.put_u8(num_bytes_for_int << 3 | (ColumnType::Integer as u8));
+            buf.put_int(*i, num_bytes_for_int as usize);
+        }
+        ColumnValue::Null => {
+            buf.put_u8(ColumnType::Null as u8);
+        }
+        ColumnValue::Text(t) => pack_bytes(buf, ColumnType::Text, t.as_bytes()),
+    }
+}
+
+/**
+ * Packs text or blob bytes without first copying them into a `ColumnValue`.
+ */
+pub fn pack_bytes(buf: &mut Vec<u8>, column_type: ColumnType, bytes: &[u8]) {
+    let len = bytes.len() as i32;
+    let num_bytes_for_len = num_bytes_needed_i32(len);
+    buf.put_u8(num_bytes_for_len << 3 | (column_type as u8));
+    buf.put_int(len as i64, num_bytes_for_len as usize);
+    buf.put_slice(bytes);
 }
 
+/**
+ * Binds unpacked values to consecutive slots starting after `offset`.
+ *
+ * Text and blobs are bound with `SQLITE_STATIC` so the bytes they borrow must outlive
+ * the statement's use of them. Callers reset their statements before returning.
+ */
 pub fn bind_package_to_stmt(
     stmt: *mut sqlite::stmt,
-    values: &Vec<ColumnValue>,
+    values: &[ColumnValueRef],
     offset: usize,
 ) -> Result<ResultCode, ResultCode> {
     for (i, val) in values.iter().enumerate() {
@@ -193,16 +342,16 @@ pub fn bind_package_to_stmt(
     Ok(ResultCode::OK)
 }
 
-fn bind_slot(
+pub fn bind_slot(
     slot_num: usize,
-    val: &ColumnValue,
+    val: &ColumnValueRef,
     stmt: *mut sqlite::stmt,
 ) -> Result<ResultCode, ResultCode> {
     match val {
-        ColumnValue::Blob(b) => stmt.bind_blob(slot_num as i32, b, sqlite::Destructor::STATIC),
-        ColumnValue::Float(f) => stmt.bind_double(slot_num as i32, *f),
-        ColumnValue::Integer(i) => stmt.bind_int64(slot_num as i32, *i),
-        ColumnValue::Null => stmt.bind_null(slot_num as i32),
-        ColumnValue::Text(t) => stmt.bind_text(slot_num as i32, t, sqlite::Destructor::STATIC),
+        ColumnValueRef::Blob(b) => stmt.bind_blob(slot_num as i32, b, sqlite::Destructor::STATIC),
+        ColumnValueRef::Float(f) => stmt.bind_double(slot_num as i32, *f),
+        ColumnValueRef::Integer(i) => stmt.bind_int64(slot_num as i32, *i),
+        ColumnValueRef::Null => stmt.bind_null(slot_num as i32),
+        ColumnValueRef::Text(t) => stmt.bind_text(slot_num as i32, t, sqlite::Destructor::STATIC),
     }
 }
@@ -0,0 +1,97 @@
+extern crate alloc;
+
+use alloc::boxed::Box;
+use core::cell::Cell;
+use core::ffi::c_void;
+
+use crate::c::crsql_ExtData;
+
+extern "C" {
+    pub fn crsql_now_ns() -> i64;
+}
+
+/**
+ * How many times something happened and, for things that are timed, the total
+ * nanoseconds spent doing it.
+ */
+#[derive(Default)]
+pub struct Counter {
+    count: Cell<i64>,
+    ns: Cell<i64>,
+}
+
+impl Counter {
+    pub fn incr(&self) {
+        self.count.set(self.count.get() + 1);
+    }
+
+    /**
+     * Counts one occurrence that began at `start`, as returned by `now()`.
+     */
+    pub fn record(&self, start: i64) {
+        self.incr();
+        self.ns.set(self.ns.get() + (now() - start));
+    }
+
+    /**
+     * Counts `n` occurrences that, together, began at `start`.
+     */
+    pub fn add(&self, n: i64, start: i64) {
+        self.count.set(self.count.get() + n);
+        self.ns.set(self.ns.get() + (now() - start));
+    }
+
+    pub fn count(&self) -> i64 {
+        self.count.get()
+    }
+
+    pub fn ns(&self) -> i64 {
+        self.ns.get()
+    }
+}
+
+pub fn now() -> i64 {
+    unsafe { crsql_now_ns() }
+}
+
+// Counters for the connection as a whole.
+#[derive(Default)]
+pub struct Stats {
+    pub merges: Counter,
+    pub merges_won: Counter,
+    pub merges_lost: Counter,
+    pub db_version_fetches: Counter,
+    pub table_info_rebuilds: Counter,
+    // Rows backfilled by crsql_backfill_step.
+    pub backfilled_rows: Counter,
+}
+
+// Counters for a single table. These live on the table's `TableInfo`.
+#[derive(Default)]
+pub struct TableStats {
+    pub stmts_prepared: Counter,
+    pub stmts_reused: Counter,
+    pub stmts_evicted: Counter,
+    // How many statements the table currently holds prepared.
+    pub stmts_cached: Cell<i64>,
+    pub insert_triggers: Counter,
+    pub update_triggers: Counter,
+    pub delete_triggers: Counter,
+}
+
+pub fn get_stats<'a>(ext_data: *mut crsql_ExtData) -> &'a Stats {
+    unsafe { &*((*ext_data).stats as *const Stats) }
+}
+
+#[no_mangle]
+pub extern "C" fn crsql_init_stats(ext_data: *mut crsql_ExtData) {
+    let stats: Box<Stats> = Box::new(Default::default());
+    unsafe { (*ext_data).stats = Box::into_raw(stats) as *mut c_void }
+}
+
+#[no_mangle]
+pub extern "C" fn crsql_drop_stats(ext_data: *mut crsql_ExtData) {
+    unsafe {
+        drop(Box::from_raw((*ext_data).stats as *mut Stats));
+    }
+}
@@ -0,0 +1,266 @@
+extern crate alloc;
+
+use core::ffi::{c_char, c_int, c_void};
+use core::mem::ManuallyDrop;
+
+use alloc::boxed::Box;
+use alloc::string::String;
+use alloc::vec::Vec;
+use sqlite::{Connection, Context};
+use sqlite_nostd as sqlite;
+use sqlite_nostd::ResultCode;
+
+use crate::c::crsql_ExtData;
+use crate::stats::{get_stats, Counter};
+use crate::tableinfo::TableInfo;
+
+enum Columns {
+    Name = 0,
+    Tbl = 1,
+    Count = 2,
+    Ns = 3,
+}
+
+#[repr(C)]
+struct StatsTab {
+    base: sqlite::vtab,
+    ext_data: *mut crsql_ExtData,
+}
+
+extern "C" fn connect(
+    db: *mut sqlite::sqlite3,
+    aux: *mut c_void,
+    _argc: c_int,
+    _argv: *const *const c_char,
+    vtab: *mut *mut sqlite::vtab,
+    _err: *mut *mut c_char,
+) -> c_int {
+    if let Err(rc) = sqlite::declare_vtab(
+        db,
+        "CREATE TABLE x([name] TEXT NOT NULL, [tbl] TEXT, [count] INTEGER NOT NULL, [ns] INTEGER NOT NULL);",
+    ) {
+        return rc as c_int;
+    }
+
+    let tab = Box::new(StatsTab {
+        base: sqlite::vtab {
+            nRef: 0,
+            pModule: core::ptr::null(),
+            zErrMsg: core::ptr::null_mut(),
+            #[cfg(feature = "libsql")]
+            pLibsqlModule: core::ptr::null_mut(),
+        },
+        ext_data: aux as *mut crsql_ExtData,
+    });
+    unsafe {
+        *vtab = Box::into_raw(tab).cast::<sqlite::vtab>();
+        let _ = sqlite::vtab_config(db, sqlite::INNOCUOUS);
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn disconnect(vtab: *mut sqlite::vtab) -> c_int {
+    unsafe {
+        drop(Box::from_raw(vtab.cast::<StatsTab>()));
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn best_index(_vtab: *mut sqlite::vtab, _index_info: *mut sqlite::index_info) -> c_int {
+    ResultCode::OK as c_int
+}
+
+struct Row {
+    name: &'static str,
+    tbl: Option<String>,
+    count: i64,
+    ns: i64,
+}
+
+#[repr(C)]
+struct Cursor {
+    base: sqlite::vtab_cursor,
+    ext_data: *mut crsql_ExtData,
+    crsr: usize,
+    rows: Vec<Row>,
+}
+
+extern "C" fn open(vtab: *mut sqlite::vtab, cursor: *mut *mut sqlite::vtab_cursor) -> c_int {
+    unsafe {
+        let boxed = Box::new(Cursor {
+            base: sqlite::vtab_cursor {
+                pVtab: core::ptr::null_mut(),
+            },
+            ext_data: (*vtab.cast::<StatsTab>()).ext_data,
+            crsr: 0,
+            rows: Vec::new(),
+        });
+        let raw_cursor = Box::into_raw(boxed);
+        *cursor = raw_cursor.cast::<sqlite::vtab_cursor>();
+    }
+
+    ResultCode::OK as c_int
+}
+
+extern "C" fn close(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        drop(Box::from_raw(crsr));
+    }
+    ResultCode::OK as c_int
+}
+
+fn push(rows: &mut Vec<Row>, name: &'static str, tbl: Option<&String>, counter: &Counter) {
+    rows.push(Row {
+        name,
+        tbl: tbl.cloned(),
+        count: counter.count(),
+        ns: counter.ns(),
+    });
+}
+
+fn collect_rows(ext_data: *mut crsql_ExtData) -> Vec<Row> {
+    let mut rows = Vec::new();
+    let stats = get_stats(ext_data);
+    push(&mut rows, "merges", None, &stats.merges);
+    push(&mut rows, "merges_won", None, &stats.merges_won);
+    push(&mut rows, "merges_lost", None, &stats.merges_lost);
+    push(
+        &mut rows,
+        "db_version_fetches",
+        None,
+        &stats.db_version_fetches,
+    );
+    push(
+        &mut rows,
+        "table_info_rebuilds",
+        None,
+        &stats.table_info_rebuilds,
+    );
+    push(&mut rows, "backfilled_rows", None, &stats.backfilled_rows);
+
+    let table_infos =
+        unsafe { ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>)) };
+    for tbl_info in table_infos.iter() {
+        let tbl = Some(&tbl_info.tbl_name);
+        let stats = &tbl_info.stats;
+        push(&mut rows, "stmts_prepared", tbl, &stats.stmts_prepared);
+        push(&mut rows, "stmts_reused", tbl, &stats.stmts_reused);
+        push(&mut rows, "stmts_evicted", tbl, &stats.stmts_evicted);
+        rows.push(Row {
+            name: "stmts_cached",
+            tbl: tbl.cloned(),
+            count: stats.stmts_cached.get(),
+            ns: 0,
+        });
+        push(&mut rows, "insert_triggers", tbl, &stats.insert_triggers);
+        push(&mut rows, "update_triggers", tbl, &stats.update_triggers);
+        push(&mut rows, "delete_triggers", tbl, &stats.delete_triggers);
+    }
+    rows
+}
+
+extern "C" fn filter(
+    cursor: *mut sqlite::vtab_cursor,
+    _idx_num: c_int,
+    _idx_str: *const c_char,
+    _argc: c_int,
+    _argv: *mut *mut sqlite::value,
+) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        (*crsr).crsr = 0;
+        (*crsr).rows = collect_rows((*crsr).ext_data);
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn next(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        (*crsr).crsr += 1;
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn eof(cursor: *mut sqlite::vtab_cursor) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe {
+        if (*crsr).crsr >= (*crsr).rows.len() {
+            1
+        } else {
+            0
+        }
+    }
+}
+
+extern "C" fn column(
+    cursor: *mut sqlite::vtab_cursor,
+    ctx: *mut sqlite::context,
+    col_num: c_int,
+) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    let row = unsafe { &(*crsr).rows[(*crsr).crsr] };
+    match col_num {
+        i if i == Columns::Name as c_int => ctx.result_text_static(row.name),
+        i if i == Columns::Tbl as c_int => match &row.tbl {
+            Some(tbl) => ctx.result_text_static(tbl),
+            None => ctx.result_null(),
+        },
+        i if i == Columns::Count as c_int => ctx.result_int64(row.count),
+        i if i == Columns::Ns as c_int => ctx.result_int64(row.ns),
+        _ => ctx.result_null(),
+    }
+    ResultCode::OK as c_int
+}
+
+extern "C" fn rowid(cursor: *mut sqlite::vtab_cursor, row_id: *mut sqlite::int64) -> c_int {
+    let crsr = cursor.cast::<Cursor>();
+    unsafe { *row_id = (*crsr).crsr as i64 }
+    ResultCode::OK as c_int
+}
+
+static MODULE: sqlite_nostd::module = sqlite_nostd::module {
+    iVersion: 0,
+    xCreate: None,
+    xConnect: Some(connect),
+    xBestIndex: Some(best_index),
+    xDisconnect: Some(disconnect),
+    xDestroy: None,
+    xOpen: Some(open),
+    xClose: Some(close),
+    xFilter: Some(filter),
+    xNext: Some(next),
+    xEof: Some(eof),
+    xColumn: Some(column),
+    xRowid: Some(rowid),
+    xUpdate: None,
+    xBegin: None,
+    xSync: None,
+    xCommit: None,
+    xRollback: None,
+    xFindFunction: None,
+    xRename: None,
+    xSavepoint: None,
+    xRelease: None,
+    xRollbackTo: None,
+    xShadowName: None,
+    xIntegrity: None,
+};
+
+/**
+ * Counters kept by this connection, for tuning without a profiler.
+ *
+ * SELECT * FROM crsql_stats;
+ *
+ * `count` is how many times something happened and `ns` the total nanoseconds it
+ * took, where it is timed. Per table counters have `tbl` set.
+ */
+pub fn create_module(
+    db: *mut sqlite::sqlite3,
+    ext_data: *mut crsql_ExtData,
+) -> Result<ResultCode, ResultCode> {
+    db.create_module_v2("crsql_stats", &MODULE, Some(ext_data as *mut c_void), None)?;
+
+    Ok(ResultCode::OK)
+}
@@ -1,15 +1,116 @@
 extern crate alloc;
+use alloc::string::String;
 use alloc::vec::Vec;
+use core::cell::{Cell, Ref, RefCell};
 use core::mem::ManuallyDrop;
 
 use alloc::boxed::Box;
-use sqlite::Stmt;
+use sqlite::{sqlite3, Connection, ManagedStmt, Stmt};
 use sqlite_nostd as sqlite;
 use sqlite_nostd::ResultCode;
 
 use crate::c::crsql_ExtData;
+use crate::stats;
 use crate::tableinfo::TableInfo;
 
+/**
+ * A statement prepared on first use and kept on its table info until it is
+ * evicted or the table info is dropped.
+ */
+#[derive(Default)]
+pub struct CachedStmt {
+    stmt: RefCell<Option<ManagedStmt>>,
+    last_used: Cell<sqlite::int64>,
+}
+
+impl CachedStmt {
+    pub fn get_or_prepare<F>(
+        &self,
+        db: *mut sqlite3,
+        tbl_info: &TableInfo,
+        sql: F,
+    ) -> Result<Ref<Option<ManagedStmt>>, ResultCode>
+    where
+        F: FnOnce() -> Result<String, ResultCode>,
+    {
+        let stats = &tbl_info.stats;
+        if self.stmt.try_borrow()?.is_none() {
+            let sql = sql()?;
+            let start = stats::now();
+            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
+            stats.stmts_prepared.record(start);
+            stats.stmts_cached.set(stats.stmts_cached.get() + 1);
+            *self.stmt.try_borrow_mut()? = Some(ret);
+        } else {
+            stats.stmts_reused.incr();
+        }
+        if !tbl_info.use_clock.is_null() {
+            unsafe {
+                self.last_used.set(*tbl_info.use_clock);
+                *tbl_info.use_clock += 1;
+            }
+        }
+        Ok(self.stmt.try_borrow()?)
+    }
+
+    pub fn is_prepared(&self) -> bool {
+        self.stmt.try_borrow().map_or(false, |stmt| stmt.is_some())
+    }
+
+    // Finalizes the statement, if there is one. It is prepared again on next use.
+    pub fn clear(&self) -> Result<ResultCode, ResultCode> {
+        self.stmt.try_borrow_mut()?.take();
+        Ok(ResultCode::OK)
+    }
+}
+
+/**
+ * Finalizes the least recently used statements until no more than the
+ * `stmt-cache-size` budget remain across all table infos.
+ *
+ * Called when a transaction first touches the table infos, since no cached
+ * statement can be in use then, and when the budget is changed.
+ */
+pub fn evict_stmts_over_budget(ext_data: *mut crsql_ExtData) {
+    let budget = unsafe { (*ext_data).stmtCacheSize } as i64;
+    if budget <= 0 {
+        return;
+    }
+
+    let tbl_infos =
+        unsafe { ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>)) };
+    let cached: i64 = tbl_infos
+        .iter()
+        .map(|tbl_info| tbl_info.stats.stmts_cached.get())
+        .sum();
+    if cached <= budget {
+        return;
+    }
+
+    let mut prepared = Vec::new();
+    for tbl_info in tbl_infos.iter() {
+        for stmt in tbl_info.cached_stmts() {
+            if stmt.is_prepared() {
+                prepared.push((stmt.last_used.get(), tbl_info, stmt));
+            }
+        }
+    }
+    prepared.sort_unstable_by_key(|(last_used, _, _)| *last_used);
+
+    let mut over = cached - budget;
+    for (_, tbl_info, stmt) in prepared {
+        if over <= 0 {
+            break;
+        }
+        if stmt.clear().is_ok() {
+            let stats = &tbl_info.stats;
+            stats.stmts_cached.set(stats.stmts_cached.get() - 1);
+            stats.stmts_evicted.incr();
+            over -= 1;
+        }
+    }
+}
+
 // Finalize prepared statements attached to table infos.
 // Do not drop the table infos.
 // We do this explicitly since `drop` cannot return an error and we want to
@@ -3,10 +3,13 @@ use crate::c::crsql_ExtData;
 use crate::c::crsql_fetchPragmaSchemaVersion;
 use crate::c::TABLE_INFO_SCHEMA_VERSION;
 use crate::pack_columns::bind_package_to_stmt;
-use crate::pack_columns::ColumnValue;
-use crate::stmt_cache::reset_cached_stmt;
+use crate::pack_columns::ColumnValueRef;
+use crate::stats;
+use crate::stats::TableStats;
+use crate::stmt_cache::{evict_stmts_over_budget, reset_cached_stmt, CachedStmt};
 use crate::util::Countable;
 use alloc::boxed::Box;
+use alloc::collections::BTreeMap;
 use alloc::format;
 use alloc::string::String;
 use alloc::vec;
@@ -16,7 +19,7 @@ use core::cell::RefCell;
 use core::ffi::c_char;
 use core::ffi::c_int;
 use core::ffi::c_void;
-use core::mem::forget;
+use core::mem::{self, forget};
 use num_traits::ToPrimitive;
 use sqlite::sqlite3;
 use sqlite::value;
@@ -37,32 +40,55 @@ pub struct TableInfo {
     // select?
     // insert or ignore returning followed by select?
     // or selecet first?
-    select_key_stmt: RefCell<Option<ManagedStmt>>,
-    insert_key_stmt: RefCell<Option<ManagedStmt>>,
-    insert_or_ignore_returning_key_stmt: RefCell<Option<ManagedStmt>>,
+    select_key_stmt: CachedStmt,
+    insert_key_stmt: CachedStmt,
+    insert_or_ignore_returning_key_stmt: CachedStmt,
 
     // For merges --
-    set_winner_clock_stmt: RefCell<Option<ManagedStmt>>,
-    local_cl_stmt: RefCell<Option<ManagedStmt>>,
-    col_version_stmt: RefCell<Option<ManagedStmt>>,
-    col_site_id_stmt: RefCell<Option<ManagedStmt>>,
-    merge_pk_only_insert_stmt: RefCell<Option<ManagedStmt>>,
-    merge_delete_stmt: RefCell<Option<ManagedStmt>>,
-    merge_delete_drop_clocks_stmt: RefCell<Option<ManagedStmt>>,
+    set_winner_clock_stmt: CachedStmt,
+    local_cl_stmt: CachedStmt,
+    col_version_stmt: CachedStmt,
+    col_site_id_stmt: CachedStmt,
+    merge_pk_only_insert_stmt: CachedStmt,
+    merge_delete_stmt: CachedStmt,
+    merge_delete_drop_clocks_stmt: CachedStmt,
     // We zero clocks, rather than going to 1, because
     // the current values should be totally ignored at all sites.
     // This is because the current values would not exist had the current node
     // processed the intervening delete.
     // This also means that col_version is not always >= 1. A resurrected column,
     // which missed a delete event, will have a 0 version.
-    zero_clocks_on_resurrect_stmt: RefCell<Option<ManagedStmt>>,
+    zero_clocks_on_resurrect_stmt: CachedStmt,
 
     // For local writes --
-    mark_locally_deleted_stmt: RefCell<Option<ManagedStmt>>,
-    move_non_sentinels_stmt: RefCell<Option<ManagedStmt>>,
-    mark_locally_created_stmt: RefCell<Option<ManagedStmt>>,
-    mark_locally_updated_stmt: RefCell<Option<ManagedStmt>>,
-    maybe_mark_locally_reinserted_stmt: RefCell<Option<ManagedStmt>>,
+    mark_locally_deleted_stmt: CachedStmt,
+    move_non_sentinels_stmt: CachedStmt,
+    mark_locally_created_stmt: CachedStmt,
+    mark_locally_updated_stmt: CachedStmt,
+    maybe_mark_locally_reinserted_stmt: CachedStmt,
+
+    // The last row merged into this table.
+    // Merges of consecutive changes to the same row skip looking up the key and causal length.
+    // Cleared at the end of every transaction, on local writes to the table
+    // and whenever a merge fails or is rolled back.
+    pub merged_row: RefCell<Option<MergedRow>>,
+
+    // Counters reported by crsql_stats. Start over when the table's info is rebuilt.
+    pub stats: TableStats,
+
+    // The connection's `stmtUseClock`, which orders statement uses for eviction.
+    // Null for infos pulled outside of the connection's cached set.
+    pub use_clock: *mut sqlite::int64,
+
+    // The `CREATE TABLE` statement this info was pulled from, if known.
+    // Schema changes that leave it untouched keep the info and its prepared statements.
+    sql: Option<String>,
+}
+
+pub struct MergedRow {
+    pub pks: Vec<u8>,
+    pub key: i64,
+    pub cl: i64,
 }
 
 impl TableInfo {
@@ -78,7 +104,7 @@ impl TableInfo {
     pub fn get_or_create_key(
         &self,
         db: *mut sqlite3,
-        pks: &Vec<ColumnValue>,
+        pks: &[ColumnValueRef],
     ) -> Result<sqlite::int64, ResultCode> {
         let stmt_ref = self.get_select_key_stmt(db)?;
         let stmt = stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
@@ -103,6 +129,27 @@ impl TableInfo {
         }
     }
 
+    /**
+     * The key of the row with these primary key values, `None` if the table has never had a
+     * row with them.
+     */
+    pub fn get_key(
+        &self,
+        db: *mut sqlite3,
+        pks: &[ColumnValueRef],
+    ) -> Result<Option<sqlite::int64>, ResultCode> {
+        let stmt_ref = self.get_select_key_stmt(db)?;
+        let stmt = stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
+        bind_package_to_stmt(stmt.stmt, pks, 0)?;
+        let ret = match stmt.step() {
+            Ok(ResultCode::ROW) => Ok(Some(stmt.column_int64(0))),
+            Ok(ResultCode::DONE) => Ok(None),
+            Ok(rc) | Err(rc) => Err(rc),
+        };
+        reset_cached_stmt(stmt.stmt)?;
+        ret
+    }
+
     pub fn get_or_create_key_via_raw_values(
         &self,
         db: *mut sqlite3,
@@ -181,7 +228,7 @@ impl TableInfo {
     fn create_key(
         &self,
         db: *mut sqlite3,
-        pks: &Vec<ColumnValue>,
+        pks: &[ColumnValueRef],
     ) -> Result<sqlite::int64, ResultCode> {
         let stmt_ref = self.get_insert_key_stmt(db)?;
         let stmt = stmt_ref.as_ref().ok_or(ResultCode::ERROR)?;
@@ -229,61 +276,51 @@ impl TableInfo {
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.select_key_stmt.try_borrow()?.is_none() {
+        self.select_key_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "SELECT __crsql_key FROM \"{table_name}__crsql_pks\" WHERE {pk_where_list}",
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 pk_where_list = crate::util::where_list(&self.pks, None)?,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.select_key_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.select_key_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_insert_key_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.insert_key_stmt.try_borrow()?.is_none() {
+        self.insert_key_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT INTO \"{table_name}__crsql_pks\" ({pk_list}) VALUES ({pk_bindings}) RETURNING __crsql_key",
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 pk_list = crate::util::as_identifier_list(&self.pks, None)?,
                 pk_bindings = crate::util::binding_list(self.pks.len()),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.insert_key_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.insert_key_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_insert_or_ignore_returning_key_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self
-            .insert_or_ignore_returning_key_stmt
-            .try_borrow()?
-            .is_none()
-        {
+        self.insert_or_ignore_returning_key_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT OR IGNORE INTO \"{table_name}__crsql_pks\" ({pk_list}) VALUES ({pk_bindings}) RETURNING __crsql_key",
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 pk_list = crate::util::as_identifier_list(&self.pks, None)?,
                 pk_bindings = crate::util::binding_list(self.pks.len()),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.insert_or_ignore_returning_key_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.insert_or_ignore_returning_key_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_set_winner_clock_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.set_winner_clock_stmt.try_borrow()?.is_none() {
+        self.set_winner_clock_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT OR REPLACE INTO \"{table_name}__crsql_clock\"
               (key, col_name, col_version, db_version, seq, site_id)
@@ -291,23 +328,27 @@ impl TableInfo {
                 ?,
                 ?,
                 ?,
-                crsql_next_db_version(?),
+                ?,
                 ?,
                 ?
               ) RETURNING key",
                 table_name = crate::util::escape_ident(&self.tbl_name),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.set_winner_clock_stmt.try_borrow_mut()? = Some(ret);
+            Ok(sql)
+        })
+    }
+
+    pub fn clear_merged_row(&self) {
+        if let Ok(mut merged_row) = self.merged_row.try_borrow_mut() {
+            *merged_row = None;
         }
-        Ok(self.set_winner_clock_stmt.try_borrow()?)
     }
 
     pub fn get_local_cl_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.local_cl_stmt.try_borrow()?.is_none() {
+        self.local_cl_stmt.get_or_prepare(db, self, || {
             // prepare it
             let sql = format!(
               "SELECT COALESCE(
@@ -317,112 +358,98 @@ impl TableInfo {
               table_name = crate::util::escape_ident(&self.tbl_name),
               delete_sentinel = crate::c::DELETE_SENTINEL,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.local_cl_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.local_cl_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_col_version_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.col_version_stmt.try_borrow()?.is_none() {
+        self.col_version_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "SELECT col_version FROM \"{table_name}__crsql_clock\" WHERE key = ? AND col_name = ?",
               table_name = crate::util::escape_ident(&self.tbl_name),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.col_version_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.col_version_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_col_site_id_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.col_site_id_stmt.try_borrow()?.is_none() {
+        self.col_site_id_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "SELECT site_id FROM crsql_site_id WHERE ordinal = (SELECT site_id FROM \"{table_name}__crsql_clock\" WHERE key = ? AND col_name = ?)",
               table_name = crate::util::escape_ident(&self.tbl_name),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.col_site_id_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.col_site_id_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_merge_pk_only_insert_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.merge_pk_only_insert_stmt.try_borrow()?.is_none() {
+        self.merge_pk_only_insert_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT OR IGNORE INTO \"{table_name}\" ({pk_idents}) VALUES ({pk_bindings})",
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 pk_idents = crate::util::as_identifier_list(&self.pks, None)?,
                 pk_bindings = crate::util::binding_list(self.pks.len()),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.merge_pk_only_insert_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.merge_pk_only_insert_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_merge_delete_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.merge_delete_stmt.try_borrow()?.is_none() {
+        self.merge_delete_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "DELETE FROM \"{table_name}\" WHERE {pk_where_list}",
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 pk_where_list = crate::util::where_list(&self.pks, None)?,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.merge_delete_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.merge_delete_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_merge_delete_drop_clocks_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.merge_delete_drop_clocks_stmt.try_borrow()?.is_none() {
+        self.merge_delete_drop_clocks_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "DELETE FROM \"{table_name}__crsql_clock\" WHERE key = ? AND col_name IS NOT '{sentinel}'",
               table_name = crate::util::escape_ident(&self.tbl_name),
               sentinel = crate::c::DELETE_SENTINEL
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.merge_delete_drop_clocks_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.merge_delete_drop_clocks_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_zero_clocks_on_resurrect_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.zero_clocks_on_resurrect_stmt.try_borrow()?.is_none() {
+        self.zero_clocks_on_resurrect_stmt.get_or_prepare(db, self, || {
             let sql = format!(
-              "UPDATE \"{table_name}__crsql_clock\" SET col_version = 0, db_version = crsql_next_db_version(?) WHERE key = ? AND col_name IS NOT '{sentinel}'",
+              "UPDATE \"{table_name}__crsql_clock\" SET col_version = 0, db_version = ? WHERE key = ? AND col_name IS NOT '{sentinel}'",
               table_name = crate::util::escape_ident(&self.tbl_name),
               sentinel = crate::c::INSERT_SENTINEL
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.zero_clocks_on_resurrect_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.zero_clocks_on_resurrect_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_mark_locally_deleted_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.mark_locally_deleted_stmt.try_borrow()?.is_none() {
+        self.mark_locally_deleted_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT INTO \"{table_name}__crsql_clock\" (
             key,
@@ -446,33 +473,29 @@ impl TableInfo {
                 table_name = crate::util::escape_ident(&self.tbl_name),
                 sentinel = crate::c::DELETE_SENTINEL,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.mark_locally_deleted_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.mark_locally_deleted_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_move_non_sentinels_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.move_non_sentinels_stmt.try_borrow()?.is_none() {
+        self.move_non_sentinels_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "UPDATE OR REPLACE \"{table_name}__crsql_clock\" SET key = ? WHERE key = ? AND col_name != '{sentinel}'",
               table_name = crate::util::escape_ident(&self.tbl_name),
               sentinel = crate::c::DELETE_SENTINEL,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.move_non_sentinels_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.move_non_sentinels_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_mark_locally_created_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.mark_locally_created_stmt.try_borrow()?.is_none() {
+        self.mark_locally_created_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "INSERT INTO \"{table_name}__crsql_clock\" (
                 key,
@@ -496,17 +519,15 @@ impl TableInfo {
               table_name = crate::util::escape_ident(&self.tbl_name),
               sentinel = crate::c::INSERT_SENTINEL,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.mark_locally_created_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.mark_locally_created_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_mark_locally_updated_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.mark_locally_updated_stmt.try_borrow()?.is_none() {
+        self.mark_locally_updated_stmt.get_or_prepare(db, self, || {
             let sql = format!(
                 "INSERT INTO \"{table_name}__crsql_clock\" (
               key,
@@ -526,24 +547,19 @@ impl TableInfo {
               col_version = col_version + 1,
               db_version = ?,
               seq = ?,
-              site_id = 0;",
+              site_id = 0
+            WHERE ? = 0 OR db_version != excluded.db_version OR site_id != 0;",
                 table_name = crate::util::escape_ident(&self.tbl_name),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.mark_locally_updated_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.mark_locally_updated_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_maybe_mark_locally_reinserted_stmt(
         &self,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self
-            .maybe_mark_locally_reinserted_stmt
-            .try_borrow()?
-            .is_none()
-        {
+        self.maybe_mark_locally_reinserted_stmt.get_or_prepare(db, self, || {
             let sql = format!(
               "UPDATE \"{table_name}__crsql_clock\" SET
                 col_version = CASE col_version % 2 WHEN 0 THEN col_version + 1 ELSE col_version + 2 END,
@@ -553,10 +569,8 @@ impl TableInfo {
               WHERE key = ? AND col_name = ?",
               table_name = crate::util::escape_ident(&self.tbl_name),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.maybe_mark_locally_reinserted_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.maybe_mark_locally_reinserted_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn get_col_value_stmt(
@@ -577,52 +591,58 @@ impl TableInfo {
         col_info.get_merge_insert_stmt(self, db)
     }
 
-    pub fn get_row_patch_data_stmt(
-        &self,
-        db: *mut sqlite3,
-        col_name: &str,
-    ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        let col_info = self.find_non_pk_col(col_name)?;
-        col_info.get_row_patch_data_stmt(self, db)
+    pub fn find_non_pk_col_index(&self, col_name: &str) -> Option<usize> {
+        self.non_pks.iter().position(|col| col.name == col_name)
     }
 
-    pub fn clear_stmts(&self) -> Result<ResultCode, ResultCode> {
-        // finalize all stmts
-        let mut stmt = self.set_winner_clock_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.local_cl_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.col_version_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.merge_pk_only_insert_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.merge_delete_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.merge_delete_drop_clocks_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.zero_clocks_on_resurrect_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.mark_locally_deleted_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.move_non_sentinels_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.mark_locally_created_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.mark_locally_updated_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.maybe_mark_locally_reinserted_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.insert_key_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.insert_or_ignore_returning_key_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.select_key_stmt.try_borrow_mut()?;
-        stmt.take();
+    // Selects every non-pk column of a row so all of a row's changes can be
+    // served from a single lookup. Columns are in `non_pks` order.
+    // Not cached on the table info. The changes cursor owns these for the
+    // duration of a query.
+    pub fn prepare_row_patch_data_stmt(&self, db: *mut sqlite3) -> Result<ManagedStmt, ResultCode> {
+        let sql = format!(
+            "SELECT {col_list} FROM \"{table_name}\" WHERE {where_list}\0",
+            col_list = crate::util::as_identifier_list(&self.non_pks, None)?,
+            table_name = crate::util::escape_ident(&self.tbl_name),
+            where_list = crate::util::where_list(&self.pks, None)?
+        );
+        db.prepare_v2(&sql)
+    }
 
+    // Every statement slot of the table, including those of its columns.
+    pub fn cached_stmts(&self) -> Vec<&CachedStmt> {
+        let mut ret = vec![
+            &self.select_key_stmt,
+            &self.insert_key_stmt,
+            &self.insert_or_ignore_returning_key_stmt,
+            &self.set_winner_clock_stmt,
+            &self.local_cl_stmt,
+            &self.col_version_stmt,
+            &self.col_site_id_stmt,
+            &self.merge_pk_only_insert_stmt,
+            &self.merge_delete_stmt,
+            &self.merge_delete_drop_clocks_stmt,
+            &self.zero_clocks_on_resurrect_stmt,
+            &self.mark_locally_deleted_stmt,
+            &self.move_non_sentinels_stmt,
+            &self.mark_locally_created_stmt,
+            &self.mark_locally_updated_stmt,
+            &self.maybe_mark_locally_reinserted_stmt,
+        ];
         // primary key columns shouldn't have statements? right?
         for col in &self.non_pks {
-            col.clear_stmts()?;
+            ret.push(&col.curr_value_stmt);
+            ret.push(&col.merge_insert_stmt);
+        }
+        ret
+    }
+
+    pub fn clear_stmts(&self) -> Result<ResultCode, ResultCode> {
+        // finalize all stmts
+        for stmt in self.cached_stmts() {
+            stmt.clear()?;
         }
+        self.stats.stmts_cached.set(0);
 
         Ok(ResultCode::OK)
     }
@@ -648,9 +668,8 @@ pub struct ColumnInfo {
     // If we track that "we've seen this restored node since the backup point with the old site_id"
     // then site_id comparisons could change merge results after restore for nodes that
     // have different "seen since" records for the old site_id.
-    curr_value_stmt: RefCell<Option<ManagedStmt>>,
-    merge_insert_stmt: RefCell<Option<ManagedStmt>>,
-    row_patch_data_stmt: RefCell<Option<ManagedStmt>>,
+    curr_value_stmt: CachedStmt,
+    merge_insert_stmt: CachedStmt,
 }
 
 impl ColumnInfo {
@@ -659,17 +678,15 @@ impl ColumnInfo {
         tbl_info: &TableInfo,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.curr_value_stmt.try_borrow()?.is_none() {
+        self.curr_value_stmt.get_or_prepare(db, tbl_info, || {
             let sql = format!(
                 "SELECT \"{col_name}\" FROM \"{table_name}\" WHERE {pk_where_list}",
                 col_name = crate::util::escape_ident(&self.name),
                 table_name = crate::util::escape_ident(&tbl_info.tbl_name),
                 pk_where_list = crate::util::where_list(&tbl_info.pks, None)?,
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.curr_value_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.curr_value_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     fn get_merge_insert_stmt(
@@ -677,7 +694,7 @@ impl ColumnInfo {
         tbl_info: &TableInfo,
         db: *mut sqlite3,
     ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.merge_insert_stmt.try_borrow()?.is_none() {
+        self.merge_insert_stmt.get_or_prepare(db, tbl_info, || {
             let sql = format!(
                 "INSERT INTO \"{table_name}\" ({pk_list}, \"{col_name}\")
                 VALUES ({pk_bind_list}, ?)
@@ -688,37 +705,13 @@ impl ColumnInfo {
                 col_name = crate::util::escape_ident(&self.name),
                 pk_bind_list = crate::util::binding_list(tbl_info.pks.len()),
             );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.merge_insert_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.merge_insert_stmt.try_borrow()?)
-    }
-
-    fn get_row_patch_data_stmt(
-        &self,
-        tbl_info: &TableInfo,
-        db: *mut sqlite3,
-    ) -> Result<Ref<Option<ManagedStmt>>, ResultCode> {
-        if self.row_patch_data_stmt.try_borrow()?.is_none() {
-            let sql = format!(
-                "SELECT \"{col_name}\" FROM \"{table_name}\" WHERE {where_list}\0",
-                col_name = crate::util::escape_ident(&self.name),
-                table_name = crate::util::escape_ident(&tbl_info.tbl_name),
-                where_list = crate::util::where_list(&tbl_info.pks, None)?
-            );
-            let ret = db.prepare_v3(&sql, sqlite::PREPARE_PERSISTENT)?;
-            *self.row_patch_data_stmt.try_borrow_mut()? = Some(ret);
-        }
-        Ok(self.row_patch_data_stmt.try_borrow()?)
+            Ok(sql)
+        })
     }
 
     pub fn clear_stmts(&self) -> Result<ResultCode, ResultCode> {
-        let mut stmt = self.curr_value_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.merge_insert_stmt.try_borrow_mut()?;
-        stmt.take();
-        let mut stmt = self.row_patch_data_stmt.try_borrow_mut()?;
-        stmt.take();
+        self.curr_value_stmt.clear()?;
+        self.merge_insert_stmt.clear()?;
 
         Ok(ResultCode::OK)
     }
@@ -734,13 +727,55 @@ impl Drop for ColumnInfo {
 #[no_mangle]
 pub extern "C" fn crsql_init_table_info_vec(ext_data: *mut crsql_ExtData) {
     let vec: Vec<TableInfo> = vec![];
-    unsafe { (*ext_data).tableInfos = Box::into_raw(Box::new(vec)) as *mut c_void }
+    let by_name: BTreeMap<String, usize> = BTreeMap::new();
+    unsafe {
+        (*ext_data).tableInfos = Box::into_raw(Box::new(vec)) as *mut c_void;
+        (*ext_data).tableInfosByName = Box::into_raw(Box::new(by_name)) as *mut c_void;
+    }
 }
 
 #[no_mangle]
 pub extern "C" fn crsql_drop_table_info_vec(ext_data: *mut crsql_ExtData) {
     unsafe {
         drop(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>));
+        drop(Box::from_raw(
+            (*ext_data).tableInfosByName as *mut BTreeMap<String, usize>,
+        ));
+    }
+}
+
+/// Forgets the last merged row of every table. Called when a transaction ends
+/// or is rolled back to a savepoint since the cached keys and causal lengths may no longer hold.
+#[no_mangle]
+pub extern "C" fn crsql_clear_merged_rows(ext_data: *mut crsql_ExtData) {
+    let tbl_infos = unsafe {
+        mem::ManuallyDrop::new(Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>))
+    };
+    for tbl_info in tbl_infos.iter() {
+        tbl_info.clear_merged_row();
+    }
+}
+
+/// Finds the position of a table in `tableInfos` without scanning every table info.
+/// Only valid once `crsql_ensure_table_infos_are_up_to_date` has been called.
+pub fn find_table_info_index(ext_data: *mut crsql_ExtData, tbl_name: &str) -> Option<usize> {
+    let by_name = unsafe {
+        mem::ManuallyDrop::new(Box::from_raw(
+            (*ext_data).tableInfosByName as *mut BTreeMap<String, usize>,
+        ))
+    };
+    by_name.get(tbl_name).copied()
+}
+
+fn index_table_infos(ext_data: *mut crsql_ExtData, table_infos: &Vec<TableInfo>) {
+    let mut by_name = unsafe {
+        mem::ManuallyDrop::new(Box::from_raw(
+            (*ext_data).tableInfosByName as *mut BTreeMap<String, usize>,
+        ))
+    };
+    by_name.clear();
+    for (i, table_info) in table_infos.iter().enumerate() {
+        by_name.insert(table_info.tbl_name.clone(), i);
     }
 }
 
@@ -762,12 +797,15 @@ pub extern "C" fn crsql_ensure_table_infos_are_up_to_date(
         return ResultCode::ERROR as c_int;
     }
 
+    // First use of the table infos in this transaction so none of their statements are in use.
+    evict_stmts_over_budget(ext_data);
+
     let mut table_infos = unsafe { Box::from_raw((*ext_data).tableInfos as *mut Vec<TableInfo>) };
 
     if schema_changed > 0 || table_infos.len() == 0 {
-        match pull_all_table_infos(db, ext_data, err) {
-            Ok(new_table_infos) => {
-                *table_infos = new_table_infos;
+        match refresh_table_infos(db, ext_data, &mut table_infos, err) {
+            Ok(_) => {
+                index_table_infos(ext_data, &table_infos);
                 forget(table_infos);
                 unsafe {
                     (*ext_data).updatedTableInfosThisTx = 1;
@@ -788,17 +826,37 @@ pub extern "C" fn crsql_ensure_table_infos_are_up_to_date(
     return ResultCode::OK as c_int;
 }
 
-fn pull_all_table_infos(
+/**
+ * Brings `table_infos` in line with the crrs in the schema.
+ *
+ * Only tables whose `CREATE TABLE` statement changed, or that were not known before,
+ * are pulled again. The rest keep their info, prepared statements and counters so an
+ * unrelated schema change (a new index, a new local table, a crr being added) does not
+ * cost every crr its statement cache.
+ *
+ * `table_infos` is left untouched if anything fails.
+ */
+fn refresh_table_infos(
     db: *mut sqlite::sqlite3,
     ext_data: *mut crsql_ExtData,
+    table_infos: &mut Vec<TableInfo>,
     err: *mut *mut c_char,
-) -> Result<Vec<TableInfo>, ResultCode> {
-    let mut clock_table_names = vec![];
+) -> Result<ResultCode, ResultCode> {
+    let mut crrs: Vec<(String, Option<String>)> = vec![];
     let stmt = unsafe { (*ext_data).pSelectClockTablesStmt };
     loop {
         match stmt.step() {
             Ok(ResultCode::ROW) => {
-                clock_table_names.push(stmt.column_text(0).to_string());
+                let clock_table_name = stmt.column_text(0);
+                let sql = match stmt.column_type(1) {
+                    sqlite::ColumnType::Null => None,
+                    _ => Some(stmt.column_text(1).to_string()),
+                };
+                crrs.push((
+                    clock_table_name[0..(clock_table_name.len() - "__crsql_clock".len())]
+                        .to_string(),
+                    sql,
+                ));
             }
             Ok(ResultCode::DONE) => {
                 stmt.reset()?;
@@ -811,16 +869,41 @@ fn pull_all_table_infos(
         }
     }
 
-    let mut ret = vec![];
-    for name in clock_table_names {
-        ret.push(pull_table_info(
-            db,
-            &name[0..(name.len() - "__crsql_clock".len())],
-            err,
-        )?)
+    // Pull everything that changed before touching `table_infos` so a failure leaves them as they were.
+    let mut pulled: Vec<Option<TableInfo>> = vec![];
+    for (name, sql) in &crrs {
+        let unchanged = sql.is_some()
+            && find_table_info_index(ext_data, name)
+                .map_or(false, |idx| table_infos[idx].sql == *sql);
+        if unchanged {
+            pulled.push(None);
+            continue;
+        }
+        let start = stats::now();
+        let mut table_info = pull_table_info(db, name, err)?;
+        stats::get_stats(ext_data).table_info_rebuilds.record(start);
+        table_info.sql = sql.clone();
+        table_info.use_clock = unsafe { core::ptr::addr_of_mut!((*ext_data).stmtUseClock) };
+        pulled.push(Some(table_info));
+    }
+
+    let mut previous: BTreeMap<String, TableInfo> = mem::take(table_infos)
+        .into_iter()
+        .map(|table_info| (table_info.tbl_name.clone(), table_info))
+        .collect();
+    for ((name, _), table_info) in crrs.into_iter().zip(pulled) {
+        match table_info.or_else(|| previous.remove(&name)) {
+            Some(table_info) => {
+                // The rows it points to may be gone, e.g. if the table was dropped and re-created.
+                table_info.clear_merged_row();
+                table_infos.push(table_info);
+            }
+            None => return Err(ResultCode::ERROR),
+        }
     }
+    // Whatever is left over is no longer a crr and is dropped here along with its statements.
 
-    Ok(ret)
+    Ok(ResultCode::OK)
 }
 
 /**
@@ -859,9 +942,8 @@ pub fn pull_table_info(
                     name: stmt.column_text(1)?.to_string(),
                     cid: stmt.column_int(0),
                     pk: stmt.column_int(2),
-                    curr_value_stmt: RefCell::new(None),
-                    merge_insert_stmt: RefCell::new(None),
-                    row_patch_data_stmt: RefCell::new(None),
+                    curr_value_stmt: Default::default(),
+                    merge_insert_stmt: Default::default(),
                 });
             }
 
@@ -884,25 +966,30 @@ pub fn pull_table_info(
         tbl_name: table.to_string(),
         pks,
         non_pks,
-        set_winner_clock_stmt: RefCell::new(None),
-        local_cl_stmt: RefCell::new(None),
-        col_version_stmt: RefCell::new(None),
-        col_site_id_stmt: RefCell::new(None),
-
-        select_key_stmt: RefCell::new(None),
-        insert_key_stmt: RefCell::new(None),
-        insert_or_ignore_returning_key_stmt: RefCell::new(None),
-
-        merge_pk_only_insert_stmt: RefCell::new(None),
-        merge_delete_stmt: RefCell::new(None),
-        merge_delete_drop_clocks_stmt: RefCell::new(None),
-        zero_clocks_on_resurrect_stmt: RefCell::new(None),
-
-        mark_locally_deleted_stmt: RefCell::new(None),
-        move_non_sentinels_stmt: RefCell::new(None),
-        mark_locally_created_stmt: RefCell::new(None),
-        mark_locally_updated_stmt: RefCell::new(None),
-        maybe_mark_locally_reinserted_stmt: RefCell::new(None),
+        set_winner_clock_stmt: Default::default(),
+        local_cl_stmt: Default::default(),
+        col_version_stmt: Default::default(),
+        col_site_id_stmt: Default::default(),
+
+        select_key_stmt: Default::default(),
+        insert_key_stmt: Default::default(),
+        insert_or_ignore_returning_key_stmt: Default::default(),
+
+        merge_pk_only_insert_stmt: Default::default(),
+        merge_delete_stmt: Default::default(),
+        merge_delete_drop_clocks_stmt: Default::default(),
+        zero_clocks_on_resurrect_stmt: Default::default(),
+
+        mark_locally_deleted_stmt: Default::default(),
+        move_non_sentinels_stmt: Default::default(),
+        mark_locally_created_stmt: Default::default(),
+        mark_locally_updated_stmt: Default::default(),
+        maybe_mark_locally_reinserted_stmt: Default::default(),
+
+        merged_row: RefCell::new(None),
+        stats: Default::default(),
+        use_clock: core::ptr::null_mut(),
+        sql: None,
     });
 }
 
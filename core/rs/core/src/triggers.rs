@@ -1,5 +1,7 @@
 extern crate alloc;
 use alloc::format;
+use alloc::string::String;
+use alloc::vec::Vec;
 use sqlite::Connection;
 
 use core::ffi::c_char;
@@ -7,8 +9,16 @@ use core::ffi::c_char;
 use sqlite::{sqlite3, ResultCode};
 use sqlite_nostd as sqlite;
 
-use crate::tableinfo::TableInfo;
+use crate::tableinfo::{ColumnInfo, TableInfo};
 
+/**
+ * Local writes are captured by triggers rather than `sqlite3_preupdate_hook`.
+ *
+ * The preupdate hook is only compiled in with `SQLITE_ENABLE_PREUPDATE_HOOK` and is not part of
+ * the api routines a loadable extension gets, so the extension could not rely on it. It also
+ * runs while SQLite is in the middle of the change and may not write to the database, so the
+ * clock rows would still have to be written by something like a trigger afterwards.
+ */
 pub fn create_triggers(
     db: *mut sqlite3,
     table_info: &TableInfo,
@@ -57,13 +67,12 @@ fn create_update_trigger(
         )
     } else {
         format!(
-        "VALUES (crsql_after_update('{table_name}', {pk_new_list}, {pk_old_list}, {non_pk_new_list}, {non_pk_old_list}))",
-        table_name = crate::util::escape_ident_as_value(table_name),
-        pk_new_list = pk_new_list,
-        pk_old_list = pk_old_list,
-        non_pk_new_list = crate::util::as_identifier_list(non_pk_columns, Some("NEW."))?,
-        non_pk_old_list = crate::util::as_identifier_list(non_pk_columns, Some("OLD."))?
-      )
+            "VALUES (crsql_after_update('{table_name}', {pk_new_list}, {pk_old_list}, {changed_masks}))",
+            table_name = crate::util::escape_ident_as_value(table_name),
+            pk_new_list = pk_new_list,
+            pk_old_list = pk_old_list,
+            changed_masks = changed_column_masks(non_pk_columns),
+        )
     };
     db.exec_safe(&format!(
         "CREATE TRIGGER IF NOT EXISTS \"{table_name}__crsql_utrig\"
@@ -75,6 +84,38 @@ fn create_update_trigger(
     ))
 }
 
+// How many non primary key columns each integer passed to `crsql_after_update` covers.
+pub const CHANGED_COLUMNS_PER_MASK: usize = 64;
+
+/**
+ * Rather than the new and old value of every column, the update trigger passes an integer per
+ * 64 non primary key columns with a bit set for each column the update changed. This keeps the
+ * cost of an update to a wide table down to the columns it changed.
+ *
+ * A column changed if its value or its type did, compared byte for byte whatever the column's
+ * collation, as `crsql_compare_sqlite_values` would compare them.
+ */
+fn changed_column_masks(non_pk_columns: &[ColumnInfo]) -> String {
+    non_pk_columns
+        .chunks(CHANGED_COLUMNS_PER_MASK)
+        .map(|chunk| {
+            chunk
+                .iter()
+                .enumerate()
+                .map(|(bit, col)| {
+                    format!(
+                        "((NEW.\"{col}\" IS NOT OLD.\"{col}\" COLLATE BINARY OR typeof(NEW.\"{col}\") != typeof(OLD.\"{col}\")) << {bit})",
+                        col = crate::util::escape_ident(&col.name),
+                        bit = bit,
+                    )
+                })
+                .collect::<Vec<_>>()
+                .join(" | ")
+        })
+        .collect::<Vec<_>>()
+        .join(", ")
+}
+
 fn create_delete_trigger(
     db: *mut sqlite3,
     table_info: &TableInfo,
@@ -576,6 +576,56 @@ fn add_col_to_index() -> Result<(), ResultCode> {
     Ok(())
 }
 
+fn index_definitions_match() -> Result<(), ResultCode> {
+    let db = crate::opendb()?;
+    db.db.exec_safe(
+        "
+        CREATE TABLE foo (a primary key, b, c);
+        CREATE INDEX foo_boo ON foo (b, c);
+        CREATE INDEX foo_c ON foo (c);
+    ",
+    )?;
+    let schema = "
+        CREATE TABLE IF NOT EXISTS foo(a primary key, b, c);
+        CREATE INDEX IF NOT EXISTS foo_boo ON foo (c, b);
+        CREATE UNIQUE INDEX IF NOT EXISTS foo_c ON foo (c);
+    ";
+    invoke_automigrate(&db.db, schema)?;
+
+    let stmt = db
+        .db
+        .prepare_v2("SELECT group_concat(name) FROM pragma_index_info('foo_boo')")?;
+    stmt.step()?;
+    assert_eq!(stmt.column_text(0)?, "c,b");
+    let stmt = db
+        .db
+        .prepare_v2("SELECT \"unique\" FROM pragma_index_list('foo') WHERE name = 'foo_c'")?;
+    stmt.step()?;
+    assert_eq!(stmt.column_int(0), 1);
+    Ok(())
+}
+
+fn applied_schema_is_skipped() -> Result<(), ResultCode> {
+    let db = crate::opendb()?;
+    let schema = "CREATE TABLE IF NOT EXISTS foo (a primary key not null, b);";
+    invoke_automigrate(&db.db, schema)?;
+    let stmt = db
+        .db
+        .prepare_v2("SELECT count(*) FROM crsql_master WHERE key = 'automigrate_schema'")?;
+    stmt.step()?;
+    assert_eq!(stmt.column_int(0), 1);
+    drop(stmt);
+
+    invoke_automigrate(&db.db, schema)?;
+    assert!(expect_columns(&db.db, "foo", vec!["a", "b"])?);
+
+    // changing the local schema means the same schema has to be applied again
+    db.db.exec_safe("ALTER TABLE foo ADD COLUMN c")?;
+    invoke_automigrate(&db.db, schema)?;
+    assert!(expect_columns(&db.db, "foo", vec!["a", "b"])?);
+    Ok(())
+}
+
 fn rename_col() -> Result<(), ResultCode> {
     let db = crate::opendb()?;
     db.db.exec_safe("CREATE TABLE foo (a primary key, b);")?;
@@ -663,6 +713,8 @@ pub fn run_suite() -> Result<(), ResultCode> {
     change_index_to_unique()?;
     remove_col_from_index()?;
     add_col_to_index()?;
+    index_definitions_match()?;
+    applied_schema_is_skipped()?;
     idempotent();
     change_index_col_order();
     add_many_cols();
@@ -1,5 +1,7 @@
 use crsql_bundle::test_exports::pack_columns::unpack_columns;
+use crsql_bundle::test_exports::pack_columns::unpack_columns_ref;
 use crsql_bundle::test_exports::pack_columns::ColumnValue;
+use crsql_bundle::test_exports::pack_columns::ColumnValueRef;
 use sqlite::{Connection, ResultCode};
 use sqlite_nostd as sqlite;
 
@@ -138,7 +140,45 @@ fn test_unpack_columns() -> Result<(), ResultCode> {
     Ok(())
 }
 
+fn test_unpack_columns_ref() -> Result<(), ResultCode> {
+    let db = crate::opendb()?;
+    let select_stmt = db
+        .db
+        .prepare_v2("SELECT crsql_pack_columns(12, 'str', x'010203', NULL, 1.5)")?;
+    select_stmt.step()?;
+    let result = select_stmt.column_blob(0)?;
+    let unpacked = unpack_columns_ref(result)?;
+    assert!(unpacked.len() == 5);
+
+    if let ColumnValueRef::Integer(i) = unpacked[0] {
+        assert!(i == 12);
+    } else {
+        assert!("unexpected type" == "");
+    }
+    // text and blobs point into the packed blob rather than being copied
+    if let ColumnValueRef::Text(s) = unpacked[1] {
+        assert!(s == "str");
+        assert!(result.as_ptr_range().contains(&s.as_ptr()));
+    } else {
+        assert!("unexpected type" == "");
+    }
+    if let ColumnValueRef::Blob(b) = unpacked[2] {
+        assert!(b == [1, 2, 3]);
+        assert!(result.as_ptr_range().contains(&b.as_ptr()));
+    } else {
+        assert!("unexpected type" == "");
+    }
+    assert!(matches!(unpacked[3], ColumnValueRef::Null));
+    assert!(matches!(unpacked[4], ColumnValueRef::Float(f) if f == 1.5));
+
+    // a truncated package is rejected rather than read past its end
+    assert!(unpack_columns_ref(&result[..result.len() - 1]).is_err());
+
+    Ok(())
+}
+
 pub fn run_suite() -> Result<(), ResultCode> {
     test_pack_columns()?;
-    test_unpack_columns()
+    test_unpack_columns()?;
+    test_unpack_columns_ref()
 }
@@ -83,22 +83,7 @@ static int changesOpen(sqlite3_vtab *p, sqlite3_vtab_cursor **ppCursor) {
   return SQLITE_OK;
 }
 
-static int changesCrsrFinalize(crsql_Changes_cursor *crsr) {
-  // Assign pointers to null after freeing
-  // since we can get into this twice for the same cursor object.
-  int rc = SQLITE_OK;
-  rc += sqlite3_finalize(crsr->pChangesStmt);
-  crsr->pChangesStmt = 0;
-  if (crsr->pRowStmt != 0) {
-    rc += sqlite3_clear_bindings(crsr->pRowStmt);
-    rc += sqlite3_reset(crsr->pRowStmt);
-  }
-  crsr->pRowStmt = 0;
-
-  crsr->dbVersion = MIN_POSSIBLE_DB_VERSION;
-
-  return rc;
-}
+int crsql_changes_crsr_finalize(crsql_Changes_cursor *crsr);
 
 /**
  * Called to reclaim all of the resources allocated in `changesOpen`
@@ -107,7 +92,8 @@ static int changesCrsrFinalize(crsql_Changes_cursor *crsr) {
  * We, of course, do not de-allocated the `pTab` reference
  * given `pTab` must persist for the life of the connection.
  *
- * `pChangesStmt` and `pRowStmt` must be finalized.
+ * `pChangesStmt` and `pRowStmt` must be finalized, as must any
+ * statements held by `pReadState`.
  *
  * `colVrsns` does not need to be freed as it comes from
  * `pChangesStmt` thus finalizing `pChangesStmt` will
@@ -115,7 +101,7 @@ static int changesCrsrFinalize(crsql_Changes_cursor *crsr) {
  */
 static int changesClose(sqlite3_vtab_cursor *cur) {
   crsql_Changes_cursor *pCur = (crsql_Changes_cursor *)cur;
-  changesCrsrFinalize(pCur);
+  crsql_changes_crsr_finalize(pCur);
   sqlite3_free(pCur);
   return SQLITE_OK;
 }
@@ -144,6 +130,8 @@ int crsql_changes_update(sqlite3_vtab *pVTab, int argc, sqlite3_value **argv,
 // If xBegin is not defined xCommit is not called.
 int crsql_changes_begin(sqlite3_vtab *pVTab);
 int crsql_changes_commit(sqlite3_vtab *pVTab);
+int crsql_changes_savepoint(sqlite3_vtab *pVTab, int iSavepoint);
+int crsql_changes_rollback_to(sqlite3_vtab *pVTab, int iSavepoint);
 int crsql_changes_rowid(sqlite3_vtab_cursor *cur, sqlite_int64 *pRowid);
 int crsql_changes_column(
     sqlite3_vtab_cursor *cur, /* The cursor */
@@ -153,7 +141,7 @@ int crsql_changes_column(
 int crsql_changes_eof(sqlite3_vtab_cursor *cur);
 
 sqlite3_module crsql_changesModule = {
-    /* iVersion    */ 0,
+    /* iVersion    */ 2,
     /* xCreate     */ 0,
     /* xConnect    */ changesConnect,
     /* xBestIndex  */ crsql_changes_best_index,
@@ -173,9 +161,9 @@ sqlite3_module crsql_changesModule = {
     /* xRollback   */ 0,
     /* xFindMethod */ 0,
     /* xRename     */ 0,
-    /* xSavepoint  */ 0,
+    /* xSavepoint  */ crsql_changes_savepoint,
     /* xRelease    */ 0,
-    /* xRollbackTo */ 0,
+    /* xRollbackTo */ crsql_changes_rollback_to,
     /* xShadowName */ 0
 #ifdef LIBSQL
     ,
@@ -85,7 +85,7 @@ struct crsql_Changes_vtab {
  * from the physical row.
  *
  * Everything allocated here must be constructed in
- * changesOpen and released in changesCrsrFinalize
+ * changesOpen and released in crsql_changes_crsr_finalize
  */
 #define ROW_TYPE_UPDATE 0
 #define ROW_TYPE_DELETE 1
@@ -105,6 +105,10 @@ struct crsql_Changes_cursor {
 
   sqlite3_int64 changesRowid;
   int tblInfoIdx;
+
+  // Rust owned state for the query in flight. Owns the statements that
+  // `pChangesStmt` and `pRowStmt` point into.
+  void *pReadState;
 };
 
 #endif
\ No newline at end of file
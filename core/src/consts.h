@@ -12,13 +12,20 @@
 #define USER_SPACE 1
 #define ROWID_SLAB_SIZE 10000000000000
 
-#define CLOCK_TABLES_SELECT                                                  \
-  "SELECT tbl_name FROM sqlite_master WHERE type='table' AND tbl_name LIKE " \
+#define CLOCK_TABLES_SELECT                                                 \
+  "SELECT c.tbl_name, t.sql FROM sqlite_master AS c LEFT JOIN sqlite_master " \
+  "AS t ON t.type = 'table' AND t.name = substr(c.tbl_name, 1, "              \
+  "length(c.tbl_name) - 13) WHERE c.type = 'table' AND c.tbl_name LIKE "      \
   "'%__crsql_clock'"
 
 #define SET_SYNC_BIT "SELECT crsql_internal_sync_bit(1)"
 #define CLEAR_SYNC_BIT "SELECT crsql_internal_sync_bit(0)"
 
+#define SET_DB_VERSION                                                      \
+  "INSERT INTO crsql_db_version (id, db_version) VALUES (0, ?) ON "        \
+  "CONFLICT (id) DO UPDATE SET db_version = excluded.db_version WHERE "    \
+  "excluded.db_version > db_version"
+
 #define TBL_SITE_ID "site_id"
 #define TBL_DB_VERSION "db_version"
 #define TBL_SCHEMA "crsql_master"
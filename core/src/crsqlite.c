@@ -32,13 +32,24 @@ static void freeConnectionExtData(void *pUserData) {
   crsql_freeExtData(pExtData);
 }
 
+void crsql_clear_merged_rows(crsql_ExtData *pExtData);
+void crsql_clear_alter_snapshots(crsql_ExtData *pExtData);
+
 static int commitHook(void *pUserData) {
   crsql_ExtData *pExtData = (crsql_ExtData *)pUserData;
 
-  pExtData->dbVersion = pExtData->pendingDbVersion;
+  // Keep the version we already know if this transaction did not write
+  // anything that bumped it.
+  if (pExtData->pendingDbVersion != -1) {
+    pExtData->dbVersion = pExtData->pendingDbVersion;
+  }
   pExtData->pendingDbVersion = -1;
   pExtData->seq = 0;
   pExtData->updatedTableInfosThisTx = 0;
+  pExtData->dataVersionCheckedThisTx = 0;
+  pExtData->rowsImpacted = 0;
+  crsql_clear_merged_rows(pExtData);
+  crsql_clear_alter_snapshots(pExtData);
   return SQLITE_OK;
 }
 
@@ -48,6 +59,9 @@ static void rollbackHook(void *pUserData) {
   pExtData->pendingDbVersion = -1;
   pExtData->seq = 0;
   pExtData->updatedTableInfosThisTx = 0;
+  pExtData->dataVersionCheckedThisTx = 0;
+  crsql_clear_merged_rows(pExtData);
+  crsql_clear_alter_snapshots(pExtData);
 }
 
 #ifdef LIBSQL
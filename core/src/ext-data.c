@@ -2,12 +2,21 @@
 
 #include <stdio.h>
 #include <string.h>
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
 
 #include "consts.h"
 
 void crsql_clear_stmt_cache(crsql_ExtData *pExtData);
 void crsql_init_table_info_vec(crsql_ExtData *pExtData);
 void crsql_drop_table_info_vec(crsql_ExtData *pExtData);
+void crsql_init_stats(crsql_ExtData *pExtData);
+void crsql_drop_stats(crsql_ExtData *pExtData);
+void crsql_init_alter_snapshots(crsql_ExtData *pExtData);
+void crsql_drop_alter_snapshots(crsql_ExtData *pExtData);
 
 crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer) {
   crsql_ExtData *pExtData = sqlite3_malloc(sizeof *pExtData);
@@ -44,6 +53,10 @@ crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer) {
       sqlite3_prepare_v3(db, CLOCK_TABLES_SELECT, -1, SQLITE_PREPARE_PERSISTENT,
                          &(pExtData->pSelectClockTablesStmt), 0);
 
+  pExtData->pSetDbVersionStmt = 0;
+  rc += sqlite3_prepare_v3(db, SET_DB_VERSION, -1, SQLITE_PREPARE_PERSISTENT,
+                           &(pExtData->pSetDbVersionStmt), 0);
+
   pExtData->dbVersion = -1;
   pExtData->pendingDbVersion = -1;
   pExtData->seq = 0;
@@ -52,9 +65,14 @@ crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer) {
   pExtData->pragmaSchemaVersionForTableInfos = -1;
   pExtData->pDbVersionStmt = 0;
   pExtData->tableInfos = 0;
+  pExtData->tableInfosByName = 0;
   pExtData->rowsImpacted = 0;
   pExtData->updatedTableInfosThisTx = 0;
+  pExtData->dataVersionCheckedThisTx = 0;
+  pExtData->stmtUseClock = 0;
   crsql_init_table_info_vec(pExtData);
+  crsql_init_stats(pExtData);
+  crsql_init_alter_snapshots(pExtData);
 
   sqlite3_stmt *pStmt;
 
@@ -70,6 +88,8 @@ crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer) {
 
   // set defaults!
   pExtData->mergeEqualValues = 0;
+  pExtData->stmtCacheSize = 0;
+  pExtData->coalesceLocalWrites = 0;
 
   while (sqlite3_step(pStmt) == SQLITE_ROW) {
     const unsigned char *name = sqlite3_column_text(pStmt, 0);
@@ -84,6 +104,22 @@ crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer) {
         crsql_freeExtData(pExtData);
         return 0;
       }
+    } else if (strcmp("stmt-cache-size", (char *)name) == 0) {
+      if (colType == SQLITE_INTEGER) {
+        pExtData->stmtCacheSize = sqlite3_column_int(pStmt, 1);
+      } else {
+        // broken setting...
+        crsql_freeExtData(pExtData);
+        return 0;
+      }
+    } else if (strcmp("coalesce-local-writes", (char *)name) == 0) {
+      if (colType == SQLITE_INTEGER) {
+        pExtData->coalesceLocalWrites = sqlite3_column_int(pStmt, 1);
+      } else {
+        // broken setting...
+        crsql_freeExtData(pExtData);
+        return 0;
+      }
     } else {
       // unhandled config setting
     }
@@ -110,8 +146,11 @@ void crsql_freeExtData(crsql_ExtData *pExtData) {
   sqlite3_finalize(pExtData->pSetSiteIdOrdinalStmt);
   sqlite3_finalize(pExtData->pSelectSiteIdOrdinalStmt);
   sqlite3_finalize(pExtData->pSelectClockTablesStmt);
+  sqlite3_finalize(pExtData->pSetDbVersionStmt);
   crsql_clear_stmt_cache(pExtData);
   crsql_drop_table_info_vec(pExtData);
+  crsql_drop_stats(pExtData);
+  crsql_drop_alter_snapshots(pExtData);
   sqlite3_free(pExtData);
 }
 
@@ -129,6 +168,7 @@ void crsql_finalize(crsql_ExtData *pExtData) {
   sqlite3_finalize(pExtData->pSetSiteIdOrdinalStmt);
   sqlite3_finalize(pExtData->pSelectSiteIdOrdinalStmt);
   sqlite3_finalize(pExtData->pSelectClockTablesStmt);
+  sqlite3_finalize(pExtData->pSetDbVersionStmt);
   crsql_clear_stmt_cache(pExtData);
   pExtData->pDbVersionStmt = 0;
   pExtData->pPragmaSchemaVersionStmt = 0;
@@ -138,6 +178,7 @@ void crsql_finalize(crsql_ExtData *pExtData) {
   pExtData->pSetSiteIdOrdinalStmt = 0;
   pExtData->pSelectSiteIdOrdinalStmt = 0;
   pExtData->pSelectClockTablesStmt = 0;
+  pExtData->pSetDbVersionStmt = 0;
 }
 
 #define DB_VERSION_SCHEMA_VERSION 0
@@ -186,3 +227,19 @@ int crsql_fetchPragmaDataVersion(sqlite3 *db, crsql_ExtData *pExtData) {
 
   return 0;
 }
+
+// Monotonic clock, in nanoseconds, for timing the counters in crsql_stats.
+sqlite3_int64 crsql_now_ns(void) {
+#ifdef _WIN32
+  LARGE_INTEGER freq, now;
+  QueryPerformanceFrequency(&freq);
+  QueryPerformanceCounter(&now);
+  return (sqlite3_int64)(now.QuadPart / freq.QuadPart) * 1000000000 +
+         (sqlite3_int64)(now.QuadPart % freq.QuadPart) * 1000000000 /
+             freq.QuadPart;
+#else
+  struct timespec ts;
+  clock_gettime(CLOCK_MONOTONIC, &ts);
+  return (sqlite3_int64)ts.tv_sec * 1000000000 + ts.tv_nsec;
+#endif
+}
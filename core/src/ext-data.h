@@ -13,9 +13,9 @@ struct crsql_ExtData {
   sqlite3_stmt *pPragmaDataVersionStmt;
   int pragmaDataVersion;
 
-  // this gets set at the start of each transaction on the first invocation
-  // to crsql_next_db_version()
-  // and re-set on transaction commit or rollback.
+  // the version of the db as of the last committed transaction.
+  // Kept across transactions and only re-read from the clock tables when
+  // PRAGMA data_version reports a commit from another connection.
   sqlite3_int64 dbVersion;
   // the version that the db will be set to at the end of the transaction
   // if that transaction were to commit at the time this value is checked.
@@ -44,9 +44,41 @@ struct crsql_ExtData {
   sqlite3_stmt *pSelectClockTablesStmt;
 
   int mergeEqualValues;
+
+  // name -> index into tableInfos. Rebuilt whenever tableInfos is.
+  void *tableInfosByName;
+
+  // set once the write path has checked PRAGMA data_version in the current
+  // transaction. No other connection can commit while we hold the write lock
+  // so later writes in the transaction skip the check. Reset on commit or
+  // rollback.
+  int dataVersionCheckedThisTx;
+
+  // raises the version persisted in `crsql_db_version` to the version being
+  // written.
+  sqlite3_stmt *pSetDbVersionStmt;
+
+  // instrumentation counters, read through the crsql_stats virtual table.
+  void *stats;
+
+  // max number of statements kept prepared across all table infos. 0 for no
+  // limit. Set with crsql_config_set('stmt-cache-size', n).
+  int stmtCacheSize;
+  // bumped on every use of a cached statement to order them for eviction.
+  sqlite3_int64 stmtUseClock;
+
+  // table name -> columns and total_changes() recorded by crsql_begin_alter
+  // so crsql_commit_alter can tell what the alter changed. Cleared on commit
+  // or rollback.
+  void *alterSnapshots;
+
+  // skip re-marking a column already marked by this transaction. Set with
+  // crsql_config_set('coalesce-local-writes', 1).
+  int coalesceLocalWrites;
 };
 
 crsql_ExtData *crsql_newExtData(sqlite3 *db, unsigned char *siteIdBuffer);
+sqlite3_int64 crsql_now_ns(void);
 void crsql_freeExtData(crsql_ExtData *pExtData);
 int crsql_fetchPragmaSchemaVersion(sqlite3 *db, crsql_ExtData *pExtData,
                                    int which);
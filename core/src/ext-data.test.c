@@ -215,9 +215,9 @@ static void testRecreateDbVersionStmt() {
 
   rc = crsql_recreate_db_version_stmt(db, pExtData);
 
-  // there are no clock tables yet. nothing to create.
-  assert(rc == -1);
-  assert(pExtData->pDbVersionStmt == 0);
+  // the version is read from crsql_db_version so no clock tables are needed.
+  assert(rc == 0);
+  assert(pExtData->pDbVersionStmt != 0);
 
   sqlite3_exec(db, "CREATE TABLE foo (a primary key not null, b);", 0, 0, 0);
   sqlite3_exec(db, "SELECT crsql_as_crr('foo')", 0, 0, 0);
@@ -0,0 +1,15 @@
+import sqlite3
+
+extension = '../../core/dist/crsqlite'
+
+
+def connect(db_file, extension=extension):
+    c = sqlite3.connect(db_file)
+    c.enable_load_extension(True)
+    c.load_extension(extension)
+    return c
+
+
+def close(c):
+    c.execute("select crsql_finalize()")
+    c.close()
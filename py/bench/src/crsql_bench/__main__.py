@@ -0,0 +1,125 @@
+import argparse
+import itertools
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import time
+
+from crsql_bench import close, connect, extension
+from crsql_bench.scenarios import SCENARIOS
+
+DEFAULTS = {
+    "rows": [1000, 10000],
+    "tables": [1, 10, 50],
+}
+
+
+def int_list(s):
+    return [int(v) for v in s.split(",") if v]
+
+
+def param_sets(scenario, params):
+    names = scenario.params
+    for values in itertools.product(*(params[name] for name in names)):
+        yield dict(zip(names, values))
+
+
+def run_once(scenario, ext, params):
+    timed = scenario.fn(lambda: connect(":memory:", ext), **params)
+    try:
+        start = time.perf_counter()
+        timed.run()
+        return time.perf_counter() - start, timed.ops
+    finally:
+        for c in timed.cleanup:
+            close(c)
+
+
+def bench(name, ext, params, repeat):
+    scenario = SCENARIOS[name]
+    times = []
+    ops = 0
+    for _ in range(repeat):
+        t, ops = run_once(scenario, ext, params)
+        times.append(t)
+    median = statistics.median(times)
+    return {
+        "scenario": name,
+        "params": params,
+        "ops": ops,
+        "repeat": repeat,
+        "times_s": times,
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.mean(times),
+        "ops_per_s": ops / median if median > 0 else None,
+    }
+
+
+def environment(ext):
+    c = connect(":memory:", ext)
+    try:
+        version = c.execute(
+            "SELECT value FROM crsql_master WHERE key = 'crsqlite_version'").fetchone()[0]
+    finally:
+        close(c)
+    return {
+        "extension": ext,
+        "crsqlite_version": version,
+        "sqlite_version": sqlite3.sqlite_version,
+        "python_version": platform.python_version(),
+        "platform": platform.platform(),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="crsql_bench", description="Benchmark cr-sqlite's write, merge and read paths.")
+    parser.add_argument("scenarios", nargs="*",
+                        help="scenarios to run. Defaults to all of them.")
+    parser.add_argument("--list", action="store_true",
+                        help="list the scenarios and exit")
+    parser.add_argument("--extension", default=extension,
+                        help="path of the extension to load")
+    parser.add_argument("--rows", type=int_list, default=DEFAULTS["rows"],
+                        help="comma separated row or change counts")
+    parser.add_argument("--tables", type=int_list, default=DEFAULTS["tables"],
+                        help="comma separated table counts")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="times to run each scenario and parameter set")
+    parser.add_argument("--output", help="write the JSON results to this file")
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name, scenario in SCENARIOS.items():
+            print("{:<18} {} ({})".format(
+                name, scenario.description, ", ".join(scenario.params)))
+        return 0
+
+    unknown = [name for name in args.scenarios if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenarios: {}".format(", ".join(unknown)))
+
+    params = {"rows": args.rows, "tables": args.tables}
+    results = []
+    for name in args.scenarios or list(SCENARIOS):
+        for p in param_sets(SCENARIOS[name], params):
+            result = bench(name, args.extension, p, args.repeat)
+            print("{:<18} {:<28} median {:.4f}s".format(
+                name, json.dumps(p), result["median_s"]), file=sys.stderr)
+            results.append(result)
+
+    report = json.dumps(
+        {"environment": environment(args.extension), "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,159 @@
+"""
+Benchmark scenarios.
+
+Each scenario is a function taking a connection factory and its parameters. It does
+its setup, then returns a `Timed` holding the callable to measure and the number of
+operations it performs. Only the callable is timed.
+"""
+from collections import namedtuple
+
+Timed = namedtuple("Timed", ["run", "ops", "cleanup"])
+Scenario = namedtuple("Scenario", ["fn", "params", "description"])
+
+SITE_ID = b"\x01" * 16
+
+
+def _create_issues(c, name="issue"):
+    c.execute(
+        f"CREATE TABLE {name} (id INTEGER PRIMARY KEY NOT NULL, title TEXT, owner TEXT, status INTEGER, priority INTEGER)")
+
+
+def _fill_issues(c, rows, name="issue"):
+    c.executemany(
+        f"INSERT INTO {name} (id, title, owner, status, priority) VALUES (?, ?, ?, ?, ?)",
+        ((i, "title {}".format(i), "owner", i % 5, i % 3) for i in range(rows)))
+    c.commit()
+
+
+def _issues_crr(connect, rows):
+    c = connect()
+    _create_issues(c)
+    c.execute("SELECT crsql_as_crr('issue')")
+    c.commit()
+    if rows > 0:
+        _fill_issues(c, rows)
+    return c
+
+
+def local_insert(connect, rows):
+    c = _issues_crr(connect, 0)
+
+    def run():
+        _fill_issues(c, rows)
+
+    return Timed(run, rows, [c])
+
+
+def local_update(connect, rows):
+    c = _issues_crr(connect, rows)
+
+    def run():
+        c.execute("UPDATE issue SET status = status + 1, title = 'updated'")
+        c.commit()
+
+    return Timed(run, rows, [c])
+
+
+def local_delete(connect, rows):
+    c = _issues_crr(connect, rows)
+
+    def run():
+        c.execute("DELETE FROM issue")
+        c.commit()
+
+    return Timed(run, rows, [c])
+
+
+def changes_pull(connect, rows, tables):
+    c = connect()
+    for t in range(tables):
+        name = "issue_{}".format(t)
+        _create_issues(c, name)
+        c.execute("SELECT crsql_as_crr(?)", (name,))
+        _fill_issues(c, rows, name)
+
+    def run():
+        c.execute("SELECT * FROM crsql_changes WHERE db_version > 0").fetchall()
+
+    # Each row has a change per non primary key column.
+    return Timed(run, rows * tables * 4, [c])
+
+
+def _changes(connect, rows):
+    src = _issues_crr(connect, rows)
+    changes = src.execute(
+        "SELECT [table], pk, cid, val, col_version, db_version, ?, cl, seq FROM crsql_changes",
+        (SITE_ID,)).fetchall()
+    return src, changes
+
+
+def merge(connect, rows):
+    src, changes = _changes(connect, rows)
+    dst = _issues_crr(connect, 0)
+
+    def run():
+        dst.executemany(
+            "INSERT INTO crsql_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", changes)
+        dst.commit()
+
+    return Timed(run, len(changes), [src, dst])
+
+
+def merge_changeset(connect, rows):
+    src, changes = _changes(connect, rows)
+    changeset = src.execute("SELECT crsql_changeset_encode(0)").fetchone()[0]
+    dst = _issues_crr(connect, 0)
+
+    def run():
+        dst.execute("SELECT crsql_merge_changes(?)", (changeset,))
+        dst.commit()
+
+    return Timed(run, len(changes), [src, dst])
+
+
+def alter(connect, rows):
+    c = _issues_crr(connect, rows)
+
+    def run():
+        c.execute("SELECT crsql_begin_alter('issue')")
+        c.execute("ALTER TABLE issue ADD COLUMN description TEXT")
+        c.execute("SELECT crsql_commit_alter('issue')")
+        c.commit()
+
+    return Timed(run, rows, [c])
+
+
+def alter_no_change(connect, rows):
+    c = _issues_crr(connect, rows)
+
+    def run():
+        c.execute("SELECT crsql_begin_alter('issue')")
+        c.execute("SELECT crsql_commit_alter('issue')")
+        c.commit()
+
+    return Timed(run, rows, [c])
+
+
+def as_crr_backfill(connect, rows):
+    c = connect()
+    _create_issues(c)
+    _fill_issues(c, rows)
+
+    def run():
+        c.execute("SELECT crsql_as_crr('issue')")
+        c.commit()
+
+    return Timed(run, rows, [c])
+
+
+SCENARIOS = {
+    "local_insert": Scenario(local_insert, ["rows"], "insert rows through the crr triggers"),
+    "local_update": Scenario(local_update, ["rows"], "update every row through the crr triggers"),
+    "local_delete": Scenario(local_delete, ["rows"], "delete every row through the crr triggers"),
+    "changes_pull": Scenario(changes_pull, ["rows", "tables"], "read all of crsql_changes"),
+    "merge": Scenario(merge, ["rows"], "insert changes into crsql_changes"),
+    "merge_changeset": Scenario(merge_changeset, ["rows"], "apply a changeset with crsql_merge_changes"),
+    "alter": Scenario(alter, ["rows"], "add a column with crsql_begin_alter / crsql_commit_alter"),
+    "alter_no_change": Scenario(alter_no_change, ["rows"], "crsql_begin_alter / crsql_commit_alter with no schema change"),
+    "as_crr_backfill": Scenario(as_crr_backfill, ["rows"], "crsql_as_crr on a table that already has rows"),
+}
@@ -0,0 +1,40 @@
+import json
+
+from crsql_bench import connect, close
+from crsql_bench.__main__ import main, param_sets
+from crsql_bench.scenarios import SCENARIOS
+
+
+def test_param_sets():
+    sets = list(param_sets(SCENARIOS["changes_pull"], {
+                "rows": [1, 2], "tables": [3]}))
+    assert sets == [{"rows": 1, "tables": 3}, {"rows": 2, "tables": 3}]
+
+
+def test_scenarios_run():
+    for name, scenario in SCENARIOS.items():
+        params = {"rows": 10, "tables": 2}
+        timed = scenario.fn(lambda: connect(":memory:"),
+                            **{p: params[p] for p in scenario.params})
+        try:
+            timed.run()
+            assert timed.ops > 0, name
+        finally:
+            for c in timed.cleanup:
+                close(c)
+
+
+def test_json_output(tmp_path):
+    out = tmp_path / "out.json"
+    assert main(["local_insert", "changes_pull", "--rows", "5",
+                "--tables", "1,2", "--repeat", "2", "--output", str(out)]) == 0
+    report = json.loads(out.read_text())
+    assert [(r["scenario"], r["params"]) for r in report["results"]] == [
+        ("local_insert", {"rows": 5}),
+        ("changes_pull", {"rows": 5, "tables": 1}),
+        ("changes_pull", {"rows": 5, "tables": 2}),
+    ]
+    for r in report["results"]:
+        assert len(r["times_s"]) == 2
+        assert r["min_s"] <= r["median_s"]
+    assert "crsqlite_version" in report["environment"]
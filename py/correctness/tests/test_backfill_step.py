@@ -0,0 +1,207 @@
+from crsql_correctness import connect, close
+
+changes_query = "SELECT [table], pk, cid, val, col_version, cl FROM crsql_changes ORDER BY pk, cid"
+
+
+def create_db(rows, pk="id INTEGER PRIMARY KEY NOT NULL"):
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo ({}, a, b)".format(pk))
+    c.executemany("INSERT INTO foo (id, a, b) VALUES (?, ?, ?)",
+                  ((i, i * 2, str(i)) for i in range(rows)))
+    c.commit()
+    return c
+
+
+def backfill(c, batch_size):
+    steps = []
+    while True:
+        rows = c.execute("SELECT crsql_backfill_step('foo', ?)", (batch_size,)).fetchone()[0]
+        c.commit()
+        if rows == 0:
+            return steps
+        steps.append(rows)
+
+
+def test_matches_as_crr():
+    stepped = create_db(25)
+    assert backfill(stepped, 10) == [10, 10, 5]
+
+    whole = create_db(25)
+    whole.execute("SELECT crsql_as_crr('foo')")
+    whole.commit()
+
+    assert stepped.execute(changes_query).fetchall() == whole.execute(changes_query).fetchall()
+    assert stepped.execute(
+        "SELECT count(*) FROM crsql_master WHERE key LIKE 'backfill.%'").fetchone()[0] == 0
+    # further steps are no-ops
+    assert backfill(stepped, 10) == []
+    close(stepped)
+    close(whole)
+
+
+def test_text_primary_keys():
+    c = create_db(15, "id TEXT PRIMARY KEY NOT NULL")
+    assert backfill(c, 4) == [4, 4, 4, 3]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes").fetchone()[0] == 15
+    close(c)
+
+
+def test_writes_between_steps():
+    c = create_db(20)
+    assert c.execute("SELECT crsql_backfill_step('foo', 5)").fetchone()[0] == 5
+    c.commit()
+
+    # rows ahead of and behind the backfill are written to in between steps
+    c.execute("UPDATE foo SET a = -1 WHERE id IN (2, 12)")
+    c.execute("DELETE FROM foo WHERE id = 13")
+    c.execute("INSERT INTO foo VALUES (100, 1, 'new')")
+    c.commit()
+    backfill(c, 5)
+
+    rows = c.execute("SELECT count(*) FROM foo").fetchone()[0]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes WHERE cid != '-1'").fetchone()[0] == rows
+    # every live row has a clock for each of its columns
+    assert c.execute(
+        "SELECT count(*) FROM crsql_changes WHERE cid IN ('a', 'b')").fetchone()[0] == rows * 2
+    assert c.execute(
+        "SELECT val FROM crsql_changes WHERE cid = 'a' AND pk = crsql_pack_columns(12)").fetchone()[0] == -1
+    close(c)
+
+
+def test_resumes_after_rollback():
+    c = create_db(20)
+    assert c.execute("SELECT crsql_backfill_step('foo', 8)").fetchone()[0] == 8
+    c.commit()
+    assert c.execute("SELECT crsql_backfill_step('foo', 8)").fetchone()[0] == 8
+    c.rollback()
+
+    # the rolled back batch is done again
+    assert backfill(c, 8) == [8, 4]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes").fetchone()[0] == 20
+    close(c)
+
+
+def test_reports_rows():
+    c = create_db(12)
+    backfill(c, 5)
+    count, ns = c.execute(
+        "SELECT count, ns FROM crsql_stats WHERE name = 'backfilled_rows'").fetchone()
+    assert count == 12
+    assert ns > 0
+    close(c)
+
+
+def test_rejects_bad_batch_size():
+    c = create_db(1)
+    for batch_size in (0, -1, "ten"):
+        try:
+            c.execute("SELECT crsql_backfill_step('foo', ?)", (batch_size,))
+            assert False
+        except Exception:
+            pass
+    close(c)
+
+
+def test_failed_step_keeps_the_callers_writes():
+    c = create_db(1)
+    c.execute("INSERT INTO foo VALUES (1, 2, '1')")
+    try:
+        c.execute("SELECT crsql_backfill_step('missing', 10)")
+        assert False
+    except Exception:
+        pass
+    assert c.in_transaction
+    c.commit()
+    assert c.execute("SELECT count(*) FROM foo").fetchone()[0] == 2
+    close(c)
+
+
+def test_staged_primary_key_change():
+    c = create_db(20)
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.commit()
+
+    c.execute("SELECT crsql_begin_alter('foo')")
+    c.execute("CREATE TABLE new_foo (id NOT NULL, a NOT NULL, b, PRIMARY KEY (id, a))")
+    c.execute("INSERT INTO new_foo SELECT id, a, b FROM foo")
+    c.execute("DROP TABLE foo")
+    c.execute("ALTER TABLE new_foo RENAME TO foo")
+    c.execute("SELECT crsql_commit_alter('main', 'foo', 1)")
+    c.commit()
+
+    # the clock tables are re-created empty and filled in by later steps
+    assert c.execute("SELECT count(*) FROM crsql_changes").fetchone()[0] == 0
+    c.execute("UPDATE foo SET b = 'written' WHERE id = 3")
+    c.commit()
+    db_version = c.execute("SELECT crsql_db_version()").fetchone()[0]
+
+    assert backfill(c, 8) == [8, 8, 4]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes WHERE cid = 'b'").fetchone()[0] == 20
+    # backfilled clocks are at the current db version, like an unstaged alter's
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == db_version
+    assert c.execute(
+        "SELECT count(*) FROM crsql_changes WHERE db_version > ?", (db_version,)).fetchone()[0] == 0
+    assert c.execute(
+        "SELECT val FROM crsql_changes WHERE pk = crsql_pack_columns(3, 6)").fetchone()[0] == "written"
+    assert c.execute(
+        "SELECT count(*) FROM crsql_master WHERE key LIKE '%backfill.%'").fetchone()[0] == 0
+    close(c)
+
+
+def test_merge_before_staged_backfill():
+    c = create_db(20)
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.commit()
+
+    c.execute("SELECT crsql_begin_alter('foo')")
+    c.execute("CREATE TABLE new_foo (id NOT NULL, a NOT NULL, b, PRIMARY KEY (id, a))")
+    c.execute("INSERT INTO new_foo SELECT id, a, b FROM foo")
+    c.execute("DROP TABLE foo")
+    c.execute("ALTER TABLE new_foo RENAME TO foo")
+    c.execute("SELECT crsql_commit_alter('main', 'foo', 1)")
+    c.commit()
+
+    # Against a backfilled clock at col_version 1 this change would tie and lose on value.
+    peer = b"\x01" * 16
+    c.execute(
+        "INSERT INTO crsql_changes VALUES ('foo', crsql_pack_columns(3, 6), 'b', '0', 1, 1, ?, 1, 0)",
+        (peer,))
+    c.commit()
+    # Not yet backfilled rows have no clocks so the merge wins.
+    assert c.execute("SELECT b FROM foo WHERE id = 3").fetchone()[0] == "0"
+    assert c.execute("SELECT count(DISTINCT pk) FROM crsql_changes").fetchone()[0] == 1
+
+    assert backfill(c, 8) == [8, 8, 4]
+    # The backfill keeps the merged clock.
+    assert c.execute(
+        "SELECT val, col_version, site_id FROM crsql_changes WHERE pk = crsql_pack_columns(3, 6) AND cid = 'b'").fetchall() == [
+        ("0", 1, peer)]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes WHERE cid = 'b'").fetchone()[0] == 20
+    close(c)
+
+
+def test_primary_key_change_during_backfill():
+    c = create_db(20)
+    assert c.execute("SELECT crsql_backfill_step('foo', 5)").fetchone()[0] == 5
+    c.commit()
+
+    c.execute("SELECT crsql_begin_alter('foo')")
+    c.execute("CREATE TABLE new_foo (id NOT NULL, a NOT NULL, b, PRIMARY KEY (id, a))")
+    c.execute("INSERT INTO new_foo SELECT id, a, b FROM foo")
+    c.execute("DROP TABLE foo")
+    c.execute("ALTER TABLE new_foo RENAME TO foo")
+    c.execute("SELECT crsql_commit_alter('main', 'foo', 1)")
+    c.commit()
+
+    # the unfinished backfill's position was in the old primary key's layout
+    assert c.execute(
+        "SELECT key FROM crsql_master WHERE key LIKE '%backfill.%'").fetchall() == [("alter_backfill.foo",)]
+    assert backfill(c, 8) == [8, 8, 4]
+    assert c.execute(
+        "SELECT count(DISTINCT pk) FROM crsql_changes WHERE cid = 'b'").fetchone()[0] == 20
+    close(c)
@@ -0,0 +1,227 @@
+import pathlib
+from crsql_correctness import connect, close
+
+changes_query = "SELECT [table], pk, cid, val, col_version, db_version, site_id, cl, seq FROM crsql_changes"
+
+
+def setup_db():
+    c = connect(":memory:")
+    for tbl in ["a", "b", "c"]:
+        c.execute(
+            "CREATE TABLE {} (id PRIMARY KEY NOT NULL, x, y)".format(tbl))
+        c.execute("SELECT crsql_as_crr('{}')".format(tbl))
+    c.commit()
+
+    # interleave writes across tables so each db_version and each seq
+    # range spans several clock tables
+    for i in range(10):
+        for tbl in ["c", "a", "b"]:
+            c.execute("INSERT INTO {} VALUES (?, ?, ?)".format(tbl), (i, i, i))
+        if i % 3 == 0:
+            c.commit()
+    c.execute("UPDATE b SET x = 100 WHERE id < 5")
+    c.execute("DELETE FROM a WHERE id = 2")
+    c.commit()
+    return c
+
+
+def by_version(row):
+    return (row[5], row[8])
+
+
+def test_default_order_is_db_version_seq():
+    c = setup_db()
+    rows = c.execute(changes_query).fetchall()
+    assert len(rows) > 0
+    assert rows == sorted(rows, key=by_version)
+    close(c)
+
+
+def test_explicit_db_version_order():
+    c = setup_db()
+    expected = sorted(c.execute(changes_query).fetchall(), key=by_version)
+
+    rows = c.execute(changes_query + " ORDER BY db_version, seq ASC").fetchall()
+    assert rows == expected
+
+    rows = c.execute(changes_query + " ORDER BY db_version").fetchall()
+    assert [r[5] for r in rows] == [r[5] for r in expected]
+    assert sorted(rows) == sorted(expected)
+    close(c)
+
+
+def test_ordered_with_filters():
+    c = setup_db()
+    all_rows = sorted(c.execute(changes_query).fetchall(), key=by_version)
+    for v in range(0, 6):
+        rows = c.execute(
+            changes_query + " WHERE db_version > ?", (v,)).fetchall()
+        assert rows == [r for r in all_rows if r[5] > v]
+    close(c)
+
+
+def test_other_orderings_still_sorted():
+    c = setup_db()
+    all_rows = c.execute(changes_query).fetchall()
+
+    rows = c.execute(changes_query + " ORDER BY db_version DESC").fetchall()
+    assert [r[5] for r in rows] == sorted([r[5] for r in all_rows], reverse=True)
+
+    rows = c.execute(changes_query + " ORDER BY seq, db_version").fetchall()
+    assert [(r[8], r[5]) for r in rows] == sorted([(r[8], r[5]) for r in all_rows])
+    close(c)
+
+
+def test_values_of_consecutive_changes_to_a_row():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE w (id PRIMARY KEY NOT NULL, a, b, c, d)")
+    c.execute("SELECT crsql_as_crr('w')")
+    c.commit()
+    c.execute("INSERT INTO w VALUES (1, 'a1', 'b1', 'c1', 'd1')")
+    c.execute("INSERT INTO w VALUES (2, 'a2', 'b2', 'c2', 'd2')")
+    c.commit()
+    c.execute("UPDATE w SET c = 'c3' WHERE id = 1")
+    c.commit()
+
+    rows = c.execute(
+        "SELECT cid, val FROM crsql_changes WHERE cid != '-1'").fetchall()
+    assert rows == [('a', 'a1'), ('b', 'b1'), ('d', 'd1'),
+                    ('a', 'a2'), ('b', 'b2'), ('c', 'c2'), ('d', 'd2'),
+                    ('c', 'c3')]
+
+    # Dropping the row while clock entries for its columns remain still reports
+    # the columns that changed, with no value.
+    c.execute("SELECT crsql_internal_sync_bit(1)")
+    c.execute("DELETE FROM w WHERE id = 2")
+    c.execute("SELECT crsql_internal_sync_bit(0)")
+    rows = c.execute(
+        "SELECT cid, val FROM crsql_changes WHERE cid != '-1' AND db_version = 1").fetchall()
+    assert rows == [('a', 'a1'), ('b', 'b1'), ('d', 'd1'),
+                    ('a', None), ('b', None), ('c', None), ('d', None)]
+    close(c)
+
+
+def test_missing_row_is_not_reported_as_a_delete():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE w (id PRIMARY KEY NOT NULL, a)")
+    c.execute("SELECT crsql_as_crr('w')")
+    c.execute("INSERT INTO w VALUES (1, 'a1')")
+    c.commit()
+
+    c.execute("SELECT crsql_internal_sync_bit(1)")
+    c.execute("DELETE FROM w")
+    c.execute("SELECT crsql_internal_sync_bit(0)")
+    rows = c.execute("SELECT cid, val, cl FROM crsql_changes").fetchall()
+    assert rows == [('a', None, 1)]
+    close(c)
+
+
+def test_descending_order_is_merged_without_a_sort():
+    c = setup_db()
+    expected = sorted(c.execute(changes_query).fetchall(),
+                      key=by_version, reverse=True)
+
+    rows = c.execute(
+        changes_query + " ORDER BY db_version DESC, seq DESC").fetchall()
+    assert rows == expected
+
+    plan = c.execute("EXPLAIN QUERY PLAN " + changes_query +
+                     " ORDER BY db_version DESC LIMIT 100").fetchall()
+    assert not any("TEMP B-TREE" in row[3] for row in plan)
+    close(c)
+
+
+def test_mixed_directions():
+    c = setup_db()
+    all_rows = c.execute(changes_query).fetchall()
+
+    rows = c.execute(
+        changes_query + " ORDER BY db_version ASC, seq DESC").fetchall()
+    assert rows == sorted(all_rows, key=lambda r: (r[5], -r[8]))
+
+    rows = c.execute(
+        changes_query + " ORDER BY [table] DESC, db_version, seq").fetchall()
+    assert rows == sorted(
+        sorted(all_rows, key=by_version), key=lambda r: r[0], reverse=True)
+    close(c)
+
+
+def test_order_by_val_is_sorted_once():
+    c = setup_db()
+    rows = c.execute(
+        changes_query + " WHERE cid = 'x' ORDER BY val DESC").fetchall()
+    assert len(rows) > 0
+    assert [r[3] for r in rows] == sorted([r[3] for r in rows], reverse=True)
+
+    plan = c.execute("EXPLAIN QUERY PLAN " + changes_query +
+                     " WHERE cid = 'x' ORDER BY val DESC").fetchall()
+    assert len([row for row in plan if "TEMP B-TREE" in row[3]]) == 1
+    close(c)
+
+
+def test_limit_and_offset():
+    c = setup_db()
+    expected = sorted(c.execute(changes_query).fetchall(),
+                      key=by_version, reverse=True)
+
+    rows = c.execute(
+        changes_query + " ORDER BY db_version DESC LIMIT 5").fetchall()
+    assert rows == expected[:5]
+
+    rows = c.execute(
+        changes_query + " ORDER BY db_version DESC LIMIT 5 OFFSET 3").fetchall()
+    assert rows == expected[3:8]
+
+    rows = c.execute(
+        changes_query + " WHERE db_version < 4 ORDER BY db_version DESC LIMIT 4").fetchall()
+    assert rows == [r for r in expected if r[5] < 4][:4]
+
+    # Filters left to SQLite must see every change, not only the first few.
+    rows = c.execute(
+        changes_query + " WHERE val = 100 ORDER BY db_version DESC LIMIT 2").fetchall()
+    assert rows == [r for r in expected if r[3] == 100][:2]
+
+    pk = c.execute("SELECT crsql_pack_columns(1)").fetchone()[0]
+    rows = c.execute(changes_query + " WHERE pk = ? LIMIT 2", (pk,)).fetchall()
+    assert rows == [r for r in sorted(expected, key=by_version) if r[1] == pk][:2]
+    close(c)
+
+
+def clock_index_columns(c, tbl):
+    indices = [row[1] for row in c.execute(
+        "PRAGMA index_list('{}__crsql_clock')".format(tbl)).fetchall()
+        if row[3] == 'c']
+    return [[col[2] for col in c.execute("PRAGMA index_info('{}')".format(idx)).fetchall()]
+            for idx in indices]
+
+
+def test_clock_tables_are_indexed_by_db_version_and_seq():
+    c = setup_db()
+    assert clock_index_columns(c, "a") == [["db_version", "seq"]]
+
+    plan = c.execute(
+        "EXPLAIN QUERY PLAN SELECT * FROM a__crsql_clock ORDER BY db_version, seq").fetchall()
+    assert not any("TEMP B-TREE" in row[3] for row in plan)
+    close(c)
+
+
+def test_db_version_index_is_upgraded():
+    dbfile = "./clock_index_upgrade.db"
+    pathlib.Path(dbfile).unlink(missing_ok=True)
+    c = connect(dbfile)
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a)")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.execute("INSERT INTO foo VALUES (1, 2)")
+    c.commit()
+    expected = c.execute(changes_query).fetchall()
+    # clock tables used to be indexed on db_version alone
+    c.execute("DROP INDEX foo__crsql_clock_dbv_seq_idx")
+    c.execute(
+        "CREATE INDEX foo__crsql_clock_dbv_idx ON foo__crsql_clock (db_version)")
+    c.commit()
+    close(c)
+
+    c = connect(dbfile)
+    assert clock_index_columns(c, "foo") == [["db_version", "seq"]]
+    assert c.execute(changes_query).fetchall() == expected
+    close(c)
@@ -0,0 +1,131 @@
+from crsql_correctness import connect, close
+import pytest
+import sqlite3
+
+changes_query = "SELECT [table], pk, cid, val, col_version, db_version, site_id, cl, seq FROM crsql_changes"
+pack_query = "SELECT crsql_pack_columns([table], pk, cid, val, col_version, db_version, site_id, cl, seq) FROM crsql_changes"
+
+
+def create_db():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b)")
+    c.execute("CREATE TABLE bar (x NOT NULL, y NOT NULL, z, PRIMARY KEY (x, y))")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.execute("SELECT crsql_as_crr('bar')")
+    c.commit()
+    return c
+
+
+def write_data(c):
+    for i in range(20):
+        c.execute("INSERT INTO foo VALUES (?, ?, ?)", (i, "a{}".format(i), 1.5 * i))
+        c.execute("INSERT INTO bar VALUES (?, ?, ?)",
+                  (i, "y{}".format(i), b"\x00\xff" * i))
+    c.commit()
+    c.execute("UPDATE foo SET b = NULL WHERE id = 1")
+    c.execute("UPDATE foo SET a = -12345678901 WHERE id = 2")
+    c.execute("DELETE FROM bar WHERE x = 3")
+    c.commit()
+
+
+def encode(c, since=0):
+    return c.execute("SELECT crsql_changeset_encode(?)", (since,)).fetchone()[0]
+
+
+def decode(c, blob):
+    return c.execute(
+        "SELECT * FROM crsql_changeset_decode(?)", (blob,)).fetchall()
+
+
+def test_round_trip():
+    c = create_db()
+    write_data(c)
+    for since in [0, 1, 2]:
+        expected = c.execute(changes_query + " WHERE db_version > ?",
+                             (since,)).fetchall()
+        assert sorted(decode(c, encode(c, since))) == sorted(expected)
+    close(c)
+
+
+def test_decode_groups_changes_by_row():
+    c = create_db()
+    write_data(c)
+    rows = decode(c, encode(c))
+    keys = [(r[0], r[1]) for r in rows]
+    seen = set()
+    for i, key in enumerate(keys):
+        if i > 0 and keys[i - 1] == key:
+            continue
+        assert key not in seen
+        seen.add(key)
+
+    # changes to a single row keep the order they had in crsql_changes
+    for key in seen:
+        expected = [r for r in c.execute(changes_query) if (r[0], r[1]) == key]
+        assert [r for r in rows if (r[0], r[1]) == key] == expected
+    close(c)
+
+
+def test_encoding_is_smaller_than_packed_rows():
+    c = create_db()
+    write_data(c)
+    packed = b"".join(r[0] for r in c.execute(pack_query))
+    assert len(encode(c)) < len(packed)
+    close(c)
+
+
+def test_empty_changeset():
+    c = create_db()
+    blob = encode(c)
+    assert decode(c, blob) == []
+    assert c.execute("SELECT crsql_merge_changes(?)", (blob,)).fetchone()[0] == 0
+    close(c)
+
+
+def test_apply_decoded_and_merged():
+    src = create_db()
+    write_data(src)
+    blob = encode(src)
+
+    via_decode = create_db()
+    via_decode.execute(
+        "INSERT INTO crsql_changes SELECT * FROM crsql_changeset_decode(?)", (blob,))
+    via_decode.commit()
+
+    via_merge = create_db()
+    assert via_merge.execute(
+        "SELECT crsql_merge_changes(?)", (blob,)).fetchone()[0] > 0
+    via_merge.commit()
+
+    for c in [via_decode, via_merge]:
+        assert c.execute("SELECT * FROM foo ORDER BY id").fetchall() == src.execute(
+            "SELECT * FROM foo ORDER BY id").fetchall()
+        assert c.execute("SELECT * FROM bar ORDER BY x, y").fetchall() == src.execute(
+            "SELECT * FROM bar ORDER BY x, y").fetchall()
+    close(src)
+    close(via_decode)
+    close(via_merge)
+
+
+def test_filter_decoded_changes():
+    c = create_db()
+    write_data(c)
+    rows = c.execute(
+        "SELECT cid, val FROM crsql_changeset_decode(?) WHERE [table] = 'foo' AND pk = crsql_pack_columns(2) AND cid = 'a'", (encode(c),)).fetchall()
+    assert rows == [('a', -12345678901)]
+    close(c)
+
+
+def test_malformed_changeset():
+    c = create_db()
+    write_data(c)
+    blob = encode(c)
+    with pytest.raises(sqlite3.Error):
+        decode(c, blob[:-1])
+    with pytest.raises(sqlite3.Error):
+        decode(c, blob + b"\x00")
+    with pytest.raises(sqlite3.Error):
+        c.execute("SELECT crsql_merge_changes(?)", (blob[:len(blob) // 2],))
+    with pytest.raises(sqlite3.Error):
+        c.execute("SELECT * FROM crsql_changeset_decode")
+    close(c)
@@ -23,3 +23,76 @@ def test_config_merge_equal_values():
 
     value = db.execute("SELECT crsql_config_get('merge-equal-values')").fetchone()
     assert (value == (1,))
+
+
+def test_config_stmt_cache_size():
+    dbfile = "./config_stmt_cache.db"
+    pathlib.Path(dbfile).unlink(missing_ok=True)
+    db = connect(dbfile)
+    assert db.execute("SELECT crsql_config_get('stmt-cache-size')").fetchone() == (0,)
+    value = db.execute("SELECT crsql_config_set('stmt-cache-size', 8);").fetchone()
+    assert (value == (8,))
+    db.commit()
+
+    for bad in [-1, 'many', None]:
+        try:
+            db.execute("SELECT crsql_config_set('stmt-cache-size', ?)", (bad,))
+            assert False
+        except Exception:
+            pass
+
+    close(db)
+    db = connect(dbfile)
+    assert db.execute("SELECT crsql_config_get('stmt-cache-size')").fetchone() == (8,)
+    close(db)
+
+
+def test_config_coalesce_local_writes():
+    db = connect(":memory:")
+    db.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b)")
+    db.execute("SELECT crsql_as_crr('foo')")
+    db.execute("INSERT INTO foo VALUES (1, 0, 0)")
+    db.commit()
+    assert db.execute("SELECT crsql_config_set('coalesce-local-writes', 1)").fetchone() == (1,)
+    db.commit()
+
+    for i in range(1, 10):
+        db.execute("UPDATE foo SET a = ?", (i,))
+    db.commit()
+    # one bump for the transaction rather than one per update
+    assert db.execute(
+        "SELECT cid, val, col_version, db_version FROM crsql_changes ORDER BY cid").fetchall() == [
+        ("a", 9, 2, 2), ("b", 0, 1, 1)]
+
+    # a rolled back mark does not stop the column from being marked again
+    db.execute("UPDATE foo SET b = 1")
+    db.execute("SAVEPOINT s")
+    db.execute("UPDATE foo SET a = 10")
+    db.execute("ROLLBACK TO s")
+    db.execute("RELEASE s")
+    db.execute("UPDATE foo SET a = 11")
+    db.commit()
+    assert db.execute(
+        "SELECT cid, val, col_version, db_version FROM crsql_changes ORDER BY cid").fetchall() == [
+        ("a", 11, 3, 3), ("b", 1, 2, 3)]
+    close(db)
+
+
+def test_config_coalesce_local_writes_must_be_an_integer():
+    dbfile = "./config_coalesce.db"
+    pathlib.Path(dbfile).unlink(missing_ok=True)
+    db = connect(dbfile)
+    for bad in ['on', 1.5, None]:
+        try:
+            db.execute("SELECT crsql_config_set('coalesce-local-writes', ?)", (bad,))
+            assert False
+        except Exception:
+            pass
+    db.commit()
+    assert db.execute(
+        "SELECT count(*) FROM crsql_master WHERE key = 'config.coalesce-local-writes'").fetchone() == (0,)
+
+    close(db)
+    db = connect(dbfile)
+    assert db.execute("SELECT crsql_config_get('coalesce-local-writes')").fetchone() == (0,)
+    close(db)
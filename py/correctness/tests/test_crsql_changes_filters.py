@@ -94,3 +94,80 @@ def test_site_id_filter():
 # value type of the underlying storage rather than a stringified version
 # def test_val_filter():
 #     run_test("val")
+
+
+def test_packed_pk_and_table_filters():
+    (c, all_changes) = setup_db()
+    c.execute("CREATE TABLE other (id PRIMARY KEY NOT NULL, x)")
+    c.execute("SELECT crsql_as_crr('other')")
+    c.execute("INSERT INTO other VALUES (123, 1)")
+    c.commit()
+    all_changes = c.execute(changes_query + " ORDER BY db_version, seq ASC").fetchall()
+
+    for id in [123, 321, 411, 999]:
+        pk = c.execute("SELECT crsql_pack_columns(?)", (id,)).fetchone()[0]
+        assert c.execute(
+            changes_query + " WHERE pk = ? ORDER BY db_version, seq ASC", (pk,)).fetchall() == [
+            row for row in all_changes if row[1] == pk]
+        for tbl in ["item", "other", "nope"]:
+            assert c.execute(
+                changes_query + " WHERE [table] = ? AND pk = ? ORDER BY db_version, seq ASC",
+                (tbl, pk)).fetchall() == [
+                row for row in all_changes if row[0] == tbl and row[1] == pk]
+
+    # a real pk packs to a different value than the integer one and matches nothing
+    pk = c.execute("SELECT crsql_pack_columns(123.0)").fetchone()[0]
+    assert c.execute(changes_query + " WHERE pk = ?", (pk,)).fetchall() == []
+
+    for tbl in ["item", "other"]:
+        assert c.execute(
+            changes_query + " WHERE [table] = ? ORDER BY db_version, seq ASC", (tbl,)).fetchall() == [
+            row for row in all_changes if row[0] == tbl]
+    close(c)
+
+
+def test_filters_after_analyze():
+    (c, all_changes) = setup_db()
+    c.execute("ANALYZE")
+    c.commit()
+    joined = c.execute(
+        "SELECT item.id, crsql_changes.cid FROM item JOIN crsql_changes ON " +
+        "crsql_changes.[table] = 'item' AND crsql_changes.pk = crsql_pack_columns(item.id) " +
+        "ORDER BY item.id, crsql_changes.cid").fetchall()
+    assert joined == [(123, "desc"), (123, "x"), (123, "y"),
+                      (321, "desc"), (321, "x"), (321, "y")]
+    assert c.execute(
+        changes_query + " WHERE db_version > 1 ORDER BY db_version, seq ASC").fetchall() == [
+        row for row in all_changes if row[5] > 1]
+    close(c)
+
+
+def test_estimate_follows_reanalyze():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b)")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.execute("CREATE TABLE t (v)")
+    c.execute("CREATE INDEX t_v ON t (v)")
+    c.executemany("INSERT INTO t VALUES (?)", ((i,) for i in range(100)))
+    c.execute("INSERT INTO foo VALUES (1, 2, 3)")
+    c.commit()
+
+    # Vary the sql so each plan is prepared after the latest ANALYZE.
+    def outer_loop(run):
+        plan = c.execute(
+            "EXPLAIN QUERY PLAN SELECT count(*) FROM t JOIN crsql_changes " +
+            "ON crsql_changes.db_version = t.v /* {} */".format(run)).fetchall()
+        return plan[0][3]
+
+    c.execute("ANALYZE")
+    c.commit()
+    # A handful of clock rows are cheapest to scan once.
+    assert "crsql_changes" in outer_loop(1)
+
+    c.executemany("INSERT INTO foo VALUES (?, ?, ?)", ((i, i, i) for i in range(2, 5000)))
+    c.commit()
+    c.execute("ANALYZE")
+    c.commit()
+    # Now it is cheaper to look up the clock rows for each row of t.
+    assert "crsql_changes" not in outer_loop(2)
+    close(c)
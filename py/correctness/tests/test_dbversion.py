@@ -105,3 +105,156 @@ def test_rollback_does_not_move_db_version():
     assert c.execute("SELECT crsql_db_version()").fetchone()[0] == min_db_v + 2
 
     close(c)
+
+
+def test_version_survives_commits_without_crr_writes():
+    c = connect(":memory:")
+    c.execute("create table foo (id primary key not null, a)")
+    c.execute("create table plain (a)")
+    c.execute("select crsql_as_crr('foo')")
+    c.execute("insert into foo values (1, 2)")
+    c.commit()
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == min_db_v + 1
+
+    c.execute("insert into plain values (1)")
+    c.commit()
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == min_db_v + 1
+
+    c.execute("insert into foo values (2, 2)")
+    c.commit()
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == min_db_v + 2
+    close(c)
+
+
+def test_sees_versions_written_by_other_connections():
+    dbfile = "./dbversion_other_conn.db"
+    pathlib.Path(dbfile).unlink(missing_ok=True)
+    a = connect(dbfile)
+    a.execute("create table foo (id primary key not null, a)")
+    a.execute("select crsql_as_crr('foo')")
+    a.commit()
+    b = connect(dbfile)
+
+    for i in range(6):
+        writer = a if i % 2 == 0 else b
+        writer.execute("insert into foo values (?, 2)", (i,))
+        # several writes in one tx share the version
+        writer.execute("update foo set a = 3 where id = ?", (i,))
+        writer.commit()
+        for c in [a, b]:
+            assert c.execute(
+                "SELECT crsql_db_version()").fetchone()[0] == min_db_v + i + 1
+
+    versions = a.execute(
+        "SELECT DISTINCT db_version FROM crsql_changes ORDER BY db_version").fetchall()
+    assert versions == [(min_db_v + i + 1,) for i in range(6)]
+    close(a)
+    close(b)
+
+
+def stored_db_version(c):
+    return c.execute("SELECT db_version FROM crsql_db_version").fetchone()[0]
+
+
+def test_db_version_is_stored_on_write():
+    c = connect(":memory:")
+    assert stored_db_version(c) == min_db_v
+    c.execute("create table foo (id primary key not null, a)")
+    c.execute("select crsql_as_crr('foo')")
+    c.execute("insert into foo values (1, 2)")
+    c.commit()
+    assert stored_db_version(c) == min_db_v + 1
+
+    # merged changes raise the stored version to the version they were merged at
+    c.execute("INSERT INTO crsql_changes VALUES ('foo', crsql_pack_columns(2), 'a', 3, 1, 7, X'01010101010101010101010101010101', 1, 0)")
+    c.commit()
+    assert stored_db_version(c) == c.execute(
+        "SELECT crsql_db_version()").fetchone()[0]
+    assert stored_db_version(c) > min_db_v + 1
+    close(c)
+
+
+def test_stored_db_version_follows_rollback():
+    c = connect(":memory:")
+    c.execute("create table foo (id primary key not null, a)")
+    c.execute("select crsql_as_crr('foo')")
+    c.commit()
+
+    c.execute("insert into foo values (1, 2)")
+    c.rollback()
+    assert stored_db_version(c) == min_db_v
+
+    c.execute("SAVEPOINT s")
+    c.execute("insert into foo values (1, 2)")
+    c.execute("ROLLBACK TO s")
+    c.execute("insert into foo values (2, 2)")
+    c.execute("RELEASE s")
+    c.commit()
+    assert stored_db_version(c) == c.execute(
+        "SELECT max(db_version) FROM crsql_changes").fetchone()[0]
+    close(c)
+
+
+def test_backfill_stores_db_version():
+    c = connect(":memory:")
+    c.execute("create table foo (id primary key not null, a)")
+    c.execute("insert into foo values (1, 2)")
+    c.execute("select crsql_as_crr('foo')")
+    c.commit()
+    assert stored_db_version(c) == c.execute(
+        "SELECT max(db_version) FROM crsql_changes").fetchone()[0]
+    close(c)
+
+
+def test_next_db_version_does_not_write():
+    c = connect(":memory:")
+    c.execute("PRAGMA query_only = 1")
+    v = c.execute("SELECT crsql_next_db_version()").fetchone()[0]
+    assert c.execute("SELECT crsql_next_db_version(?)", (v + 5,)).fetchone()[0] == v + 5
+    assert not c.in_transaction
+    c.execute("PRAGMA query_only = 0")
+    close(c)
+
+
+def test_db_version_seeded_from_clock_tables():
+    dbfile = "./dbversion_seeded.db"
+    pathlib.Path(dbfile).unlink(missing_ok=True)
+    c = connect(dbfile)
+    c.execute("create table foo (id primary key not null, a)")
+    c.execute("select crsql_as_crr('foo')")
+    for i in range(3):
+        c.execute("insert into foo values (?, 2)", (i,))
+        c.commit()
+    # a db written before the version was stored has no crsql_db_version table
+    c.execute("DROP TABLE crsql_db_version")
+    c.commit()
+    close(c)
+
+    c = connect(dbfile)
+    assert stored_db_version(c) == min_db_v + 3
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == min_db_v + 3
+    close(c)
+
+
+def test_db_version_does_not_go_back_when_clock_rows_are_removed():
+    c = connect(":memory:")
+    c.execute("create table foo (id primary key not null, a, b)")
+    c.execute("select crsql_as_crr('foo')")
+    c.execute("insert into foo values (1, 2, 3)")
+    c.commit()
+    c.execute("update foo set b = 4")
+    c.commit()
+    version = c.execute("SELECT crsql_db_version()").fetchone()[0]
+
+    # dropping `b` compacts away the clock rows holding the latest version
+    c.execute("SELECT crsql_begin_alter('foo')")
+    c.execute("ALTER TABLE foo DROP COLUMN b")
+    c.execute("SELECT crsql_commit_alter('foo')")
+    c.commit()
+    assert c.execute("SELECT max(db_version) FROM crsql_changes").fetchone()[0] < version
+
+    assert stored_db_version(c) == version
+    c.execute("insert into foo values (2, 2)")
+    c.commit()
+    assert c.execute("SELECT crsql_db_version()").fetchone()[0] == version + 1
+    close(c)
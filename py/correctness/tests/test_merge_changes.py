@@ -0,0 +1,192 @@
+from crsql_correctness import connect, close
+import pytest
+import sqlite3
+
+changes_query = "SELECT [table], pk, cid, val, col_version, db_version, site_id, cl, seq FROM crsql_changes"
+pack_query = "SELECT crsql_pack_columns([table], pk, cid, val, col_version, db_version, site_id, cl, seq) FROM crsql_changes WHERE db_version > ?"
+
+
+def create_db():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b)")
+    c.execute("CREATE TABLE bar (x NOT NULL, y NOT NULL, z, PRIMARY KEY (x, y))")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.execute("SELECT crsql_as_crr('bar')")
+    c.commit()
+    return c
+
+
+def write_data(c, offset):
+    for i in range(5):
+        c.execute("INSERT INTO foo VALUES (?, ?, ?)",
+                  (i, "a{}".format(i + offset), 1.5 * i))
+        c.execute("INSERT INTO bar VALUES (?, ?, ?)",
+                  (i, "y{}".format(i), b"\x00\x01" * (i + offset)))
+    c.commit()
+    c.execute("UPDATE foo SET b = NULL WHERE id = 1")
+    c.execute("UPDATE foo SET a = 'changed' WHERE id < 3")
+    c.execute("DELETE FROM bar WHERE x = 2")
+    c.commit()
+
+
+def changeset(c, since=0):
+    return b"".join(row[0] for row in c.execute(pack_query, (since,)))
+
+
+def sync_with_inserts(l, r, since=0):
+    for change in l.execute(changes_query + " WHERE db_version > ?", (since,)):
+        r.execute(
+            "INSERT INTO crsql_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", change)
+    r.commit()
+
+
+def sync_with_merge_changes(l, r, since=0):
+    impacted = r.execute("SELECT crsql_merge_changes(?)",
+                         (changeset(l, since),)).fetchone()[0]
+    r.commit()
+    return impacted
+
+
+def state(c):
+    return (c.execute("SELECT * FROM foo ORDER BY id").fetchall(),
+            c.execute("SELECT * FROM bar ORDER BY x, y").fetchall(),
+            sorted(c.execute(
+                "SELECT [table], pk, cid, val, col_version, site_id, cl FROM crsql_changes").fetchall()))
+
+
+def test_merge_matches_row_by_row_inserts():
+    src = create_db()
+    write_data(src, 0)
+
+    via_inserts = create_db()
+    via_merge = create_db()
+    sync_with_inserts(src, via_inserts)
+    impacted = sync_with_merge_changes(src, via_merge)
+
+    assert impacted > 0
+    assert state(via_merge) == state(via_inserts)
+    assert state(via_merge)[0] == state(src)[0]
+    assert state(via_merge)[1] == state(src)[1]
+
+    # re-applying the same changeset is a no-op
+    assert sync_with_merge_changes(src, via_merge) == 0
+    assert state(via_merge) == state(via_inserts)
+
+    close(src)
+    close(via_inserts)
+    close(via_merge)
+
+
+def test_merge_resolves_conflicts_like_inserts():
+    left = create_db()
+    right = create_db()
+    write_data(left, 0)
+    write_data(right, 10)
+
+    via_inserts = create_db()
+    via_merge = create_db()
+    for target, sync in [(via_inserts, sync_with_inserts), (via_merge, sync_with_merge_changes)]:
+        sync(left, target)
+        sync(right, target)
+    assert state(via_merge) == state(via_inserts)
+
+    # merging into a db that already has conflicting writes
+    sync_with_inserts(right, left)
+    sync_with_merge_changes(left, right)
+    assert state(left)[0] == state(right)[0]
+    assert state(left)[1] == state(right)[1]
+
+    close(left)
+    close(right)
+    close(via_inserts)
+    close(via_merge)
+
+
+def test_merge_only_changes_since_a_version():
+    src = create_db()
+    dst = create_db()
+    write_data(src, 0)
+    sync_with_merge_changes(src, dst)
+
+    src.execute("UPDATE foo SET a = 'later' WHERE id = 4")
+    src.commit()
+    since = src.execute("SELECT crsql_db_version()").fetchone()[0] - 1
+    assert sync_with_merge_changes(src, dst, since) == 1
+    assert dst.execute("SELECT a FROM foo WHERE id = 4").fetchone()[0] == "later"
+    close(src)
+    close(dst)
+
+
+def test_empty_changeset():
+    c = create_db()
+    assert c.execute("SELECT crsql_merge_changes(?)",
+                     (b"",)).fetchone()[0] == 0
+    assert c.execute("SELECT crsql_merge_changes(NULL)").fetchone()[0] == 0
+    close(c)
+
+
+def test_malformed_changeset_is_rejected():
+    src = create_db()
+    write_data(src, 0)
+    dst = create_db()
+    blob = changeset(src)
+
+    with pytest.raises(sqlite3.Error):
+        dst.execute("SELECT crsql_merge_changes(?)", (blob[:-3],))
+    with pytest.raises(sqlite3.Error):
+        dst.execute("SELECT crsql_merge_changes(crsql_pack_columns(1, 2, 3))")
+    with pytest.raises(sqlite3.Error):
+        dst.execute("SELECT crsql_merge_changes('not a blob')")
+    assert dst.execute("SELECT count(*) FROM foo").fetchone()[0] == 0
+    close(src)
+    close(dst)
+
+
+def test_merge_into_unknown_table_rolls_back():
+    src = create_db()
+    write_data(src, 0)
+    src.execute("CREATE TABLE baz (id PRIMARY KEY NOT NULL, a)")
+    src.execute("SELECT crsql_as_crr('baz')")
+    src.execute("INSERT INTO baz VALUES (1, 2)")
+    src.commit()
+
+    dst = create_db()
+    with pytest.raises(sqlite3.Error):
+        dst.execute("SELECT crsql_merge_changes(?)", (changeset(src),))
+    dst.rollback()
+    assert dst.execute("SELECT count(*) FROM foo").fetchone()[0] == 0
+    close(src)
+    close(dst)
+
+
+def test_failed_merge_keeps_the_callers_writes():
+    src = create_db()
+    write_data(src, 0)
+    src.execute("CREATE TABLE baz (id PRIMARY KEY NOT NULL, a)")
+    src.execute("SELECT crsql_as_crr('baz')")
+    src.execute("INSERT INTO baz VALUES (1, 2)")
+    src.commit()
+
+    dst = create_db()
+    dst.execute("INSERT INTO foo VALUES (100, 'mine', 1)")
+    with pytest.raises(sqlite3.Error):
+        dst.execute("SELECT crsql_merge_changes(?)", (changeset(src),))
+    assert dst.in_transaction
+    dst.commit()
+    assert dst.execute("SELECT * FROM foo").fetchall() == [(100, 'mine', 1)]
+    # Changes to bar sort before those to the unknown table and are undone too.
+    assert dst.execute("SELECT count(*) FROM bar").fetchone()[0] == 0
+    close(src)
+    close(dst)
+
+
+def test_merge_changes_cannot_be_called_from_a_trigger():
+    c = create_db()
+    c.execute("CREATE TABLE inbox (changeset BLOB)")
+    c.execute(
+        "CREATE TRIGGER inbox_merge AFTER INSERT ON inbox BEGIN SELECT crsql_merge_changes(NEW.changeset); END")
+    c.commit()
+
+    with pytest.raises(sqlite3.Error):
+        c.execute("INSERT INTO inbox VALUES (?)", (b"",))
+    close(c)
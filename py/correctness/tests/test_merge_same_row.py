@@ -0,0 +1,130 @@
+from crsql_correctness import connect, close
+
+changes_query = "SELECT [table], pk, cid, val, col_version, db_version, site_id, cl, seq FROM crsql_changes"
+insert_change = "INSERT INTO crsql_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def create_db():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b, c)")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.commit()
+    return c
+
+
+def pk(c, id):
+    return c.execute("SELECT crsql_pack_columns(?)", (id,)).fetchone()[0]
+
+
+def history(c):
+    # A row that is created, deleted and resurrected, all in one run of changes.
+    site = b"\x01" * 16
+    p = pk(c, 1)
+    return [
+        ("foo", p, "a", "a1", 1, 1, site, 1, 0),
+        ("foo", p, "b", "b1", 1, 1, site, 1, 1),
+        ("foo", p, "-1", None, 2, 2, site, 2, 0),
+        ("foo", p, "c", "c3", 1, 3, site, 3, 0),
+        ("foo", p, "a", "a3", 1, 3, site, 3, 1),
+        ("foo", p, "a", "stale", 1, 1, site, 1, 2),
+        ("foo", p, "-1", None, 4, 4, site, 4, 0),
+        ("foo", p, "-1", None, 5, 5, site, 5, 0),
+        ("foo", p, "b", "b5", 1, 5, site, 5, 1),
+    ]
+
+
+def state(c):
+    return (c.execute("SELECT * FROM foo").fetchall(),
+            sorted(c.execute(
+                "SELECT [table], pk, cid, val, col_version, site_id, cl FROM crsql_changes").fetchall()))
+
+
+def test_run_in_one_tx_matches_separate_txs():
+    separate = create_db()
+    for change in history(separate):
+        separate.execute(insert_change, change)
+        separate.commit()
+
+    one_tx = create_db()
+    for change in history(one_tx):
+        one_tx.execute(insert_change, change)
+    one_tx.commit()
+
+    assert state(one_tx) == state(separate)
+    assert state(one_tx)[0] == [(1, None, "b5", None)]
+    close(separate)
+    close(one_tx)
+
+
+def test_every_prefix_matches():
+    changes = history(create_db())
+    for i in range(1, len(changes) + 1):
+        separate = create_db()
+        one_tx = create_db()
+        for change in changes[:i]:
+            separate.execute(insert_change, change)
+            separate.commit()
+            one_tx.execute(insert_change, change)
+        one_tx.commit()
+        assert state(one_tx) == state(separate)
+        close(separate)
+        close(one_tx)
+
+
+def test_local_delete_between_merges():
+    c = create_db()
+    site = b"\x01" * 16
+    p = pk(c, 1)
+    c.execute(insert_change, ("foo", p, "a", "a1", 1, 1, site, 1, 0))
+    c.execute("DELETE FROM foo WHERE id = 1")
+    # cl 1 is older than the local delete and must be ignored
+    c.execute(insert_change, ("foo", p, "b", "b1", 1, 1, site, 1, 1))
+    c.commit()
+    assert c.execute("SELECT * FROM foo").fetchall() == []
+    assert c.execute(
+        "SELECT cl FROM crsql_changes WHERE cid = '-1'").fetchall() == [(2,)]
+    close(c)
+
+
+def test_rollback_to_savepoint_between_merges():
+    c = create_db()
+    site = b"\x01" * 16
+    p = pk(c, 1)
+    c.execute("SAVEPOINT s")
+    c.execute(insert_change, ("foo", p, "a", "a1", 1, 1, site, 1, 0))
+    c.execute("ROLLBACK TO s")
+    c.execute(insert_change, ("foo", p, "b", "b1", 1, 1, site, 1, 1))
+    c.execute("RELEASE s")
+    c.commit()
+    assert c.execute("SELECT * FROM foo").fetchall() == [(1, None, "b1", None)]
+    assert c.execute("SELECT cid, val FROM crsql_changes").fetchall() == [
+        ("b", "b1")]
+    close(c)
+
+
+def test_failed_statement_between_merges():
+    c = create_db()
+    site = b"\x01" * 16
+    p = pk(c, 1)
+    c.execute("CREATE TABLE src (tbl, pk, cid, val, col_version, db_version, site_id, cl, seq)")
+    c.execute("INSERT INTO src VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              ("foo", p, "a", "a1", 1, 1, site, 1, 0))
+    c.execute("INSERT INTO src VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+              ("nope", p, "a", "a1", 1, 1, site, 1, 1))
+    c.commit()
+    try:
+        c.execute("INSERT INTO crsql_changes SELECT * FROM src")
+    except Exception:
+        pass
+    c.execute(insert_change, ("foo", p, "b", "b1", 1, 1, site, 1, 1))
+    c.commit()
+    # whether or not the first change survived the failed statement,
+    # the row and its clocks must agree.
+    changes = c.execute("SELECT cid, val FROM crsql_changes").fetchall()
+    assert ("b", "b1") in changes
+    row = c.execute("SELECT id, a, b, c FROM foo").fetchall()
+    assert len(row) == 1
+    columns = dict(zip(["id", "a", "b", "c"], row[0]))
+    for cid, val in changes:
+        assert columns[cid] == val
+    close(c)
@@ -109,6 +109,69 @@ def test_drop_clock_on_col_remove():
     )
 
 
+def test_noop_alter_keeps_clocks():
+    c = setup_alter_test()
+    clock_entries = c.execute(clock_query).fetchall()
+
+    c.execute("SELECT crsql_begin_alter('todo');")
+    c.execute("SELECT crsql_commit_alter('todo');")
+    c.commit()
+    assert c.execute(clock_query).fetchall() == clock_entries
+
+    # triggers are back in place
+    c.execute("INSERT INTO todo VALUES (2, 'clean', 0, 'home');")
+    c.commit()
+    assert c.execute(
+        "SELECT count(*) FROM crsql_changes WHERE pk = crsql_pack_columns(2)").fetchone()[0] == 3
+
+
+def test_alter_several_tables_at_once():
+    c = setup_alter_test()
+    c.execute("CREATE TABLE other (id PRIMARY KEY NOT NULL, a, b);")
+    c.execute("SELECT crsql_as_crr('other');")
+    c.execute("INSERT INTO other VALUES (1, 2, 3);")
+    c.commit()
+
+    c.execute("SELECT crsql_begin_alter('todo');")
+    c.execute("SELECT crsql_begin_alter('other');")
+    c.execute("ALTER TABLE todo ADD COLUMN due;")
+    c.execute("ALTER TABLE other DROP COLUMN b;")
+    c.execute("SELECT crsql_commit_alter('other');")
+    c.execute("SELECT crsql_commit_alter('todo');")
+    c.commit()
+
+    assert c.execute(
+        "SELECT [table], cid, val FROM crsql_changes ORDER BY 1, 2").fetchall() == [
+        ('other', 'a', 2),
+        ('todo', 'complete', 0),
+        ('todo', 'list', 'home'),
+        ('todo', 'name', 'cook')]
+
+
+def test_add_and_drop_in_one_alter():
+    c = setup_alter_test()
+    c.execute("SELECT crsql_begin_alter('todo');")
+    c.execute("ALTER TABLE todo DROP COLUMN list;")
+    c.execute("ALTER TABLE todo ADD COLUMN due;")
+    c.execute("SELECT crsql_commit_alter('todo');")
+    c.commit()
+
+    assert c.execute(clock_query).fetchall() == [
+        (1, 1, 1, 'complete', 0), (1, 1, 1, 'name', 0)]
+
+
+def test_drop_and_recreate_in_one_alter():
+    c = setup_alter_test()
+    c.execute("SELECT crsql_begin_alter('todo');")
+    c.execute("DROP TABLE todo;")
+    c.execute("CREATE TABLE todo (id PRIMARY KEY NOT NULL, name, complete, list);")
+    c.execute("SELECT crsql_commit_alter('todo');")
+    c.commit()
+
+    # the dropped rows' clocks go with them
+    assert c.execute(clock_query).fetchall() == []
+
+
 def test_backfill_col_add():
     # Nulls do not need a backfill given the row will
     # just be created in the target with null
@@ -392,6 +455,37 @@ def test_add_col_through_12step():
                         ('foo', b'\x01\t\x03', 'age', 44, 1, 1, site_id)])
 
 
+def test_backfill_several_cols_through_12step():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, name TEXT);")
+    c.execute("INSERT INTO foo VALUES (1, 'a'), (2, 'b'), (3, 'c');")
+    c.execute("SELECT crsql_as_crr('foo');")
+    c.commit()
+
+    c.execute("SELECT crsql_begin_alter('foo');")
+    c.execute(
+        "CREATE TABLE new_foo(id PRIMARY KEY NOT NULL, name TEXT, age INTEGER DEFAULT 0, \"odd \"\"col\" TEXT NOT NULL DEFAULT 'x');")
+    c.execute("INSERT INTO new_foo (id, name) SELECT id, name FROM foo;")
+    # values that differ from the defaults need clocks, the rest do not
+    c.execute("UPDATE new_foo SET age = 40 WHERE id = 1;")
+    c.execute("UPDATE new_foo SET \"odd \"\"col\" = 'y' WHERE id IN (1, 2);")
+    c.execute("UPDATE new_foo SET age = 0 WHERE id = 3;")
+    c.execute("DROP TABLE foo;")
+    c.execute("ALTER TABLE new_foo RENAME TO foo;")
+    c.execute("SELECT crsql_commit_alter('foo');")
+    c.commit()
+
+    ids = {c.execute("SELECT crsql_pack_columns(?)", (id,)).fetchone()[0]: id for id in (1, 2, 3)}
+    changes = sorted((ids[pk], cid, val, db_version) for (pk, cid, val, db_version) in c.execute(
+        "SELECT pk, cid, val, db_version FROM crsql_changes").fetchall())
+    assert (changes == [(1, 'age', 40, 1),
+                        (1, 'name', 'a', 1),
+                        (1, 'odd "col', 'y', 1),
+                        (2, 'name', 'b', 1),
+                        (2, 'odd "col', 'y', 1),
+                        (3, 'name', 'c', 1)])
+
+
 def test_pk_only_table_backfill():
     c = connect(":memory:")
     c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL);")
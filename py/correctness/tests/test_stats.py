@@ -0,0 +1,156 @@
+from crsql_correctness import connect, close
+
+
+def stats(c):
+    return {(name, tbl): (count, ns) for (name, tbl, count, ns) in c.execute(
+        "SELECT name, tbl, count, ns FROM crsql_stats")}
+
+
+def create_db():
+    c = connect(":memory:")
+    c.execute("CREATE TABLE foo (id PRIMARY KEY NOT NULL, a, b)")
+    c.execute("SELECT crsql_as_crr('foo')")
+    c.commit()
+    return c
+
+
+def test_counts_local_writes():
+    c = create_db()
+    for i in range(3):
+        c.execute("INSERT INTO foo VALUES (?, 1, 2)", (i,))
+    c.execute("UPDATE foo SET a = 2 WHERE id < 2")
+    c.execute("DELETE FROM foo WHERE id = 0")
+    c.commit()
+
+    s = stats(c)
+    assert s[("insert_triggers", "foo")][0] == 3
+    assert s[("update_triggers", "foo")][0] == 2
+    assert s[("delete_triggers", "foo")][0] == 1
+    assert s[("insert_triggers", "foo")][1] > 0
+    assert s[("table_info_rebuilds", None)][0] >= 1
+    # statements are prepared once and then reused from the table info
+    assert s[("stmts_reused", "foo")][0] > s[("stmts_prepared", "foo")][0]
+    close(c)
+
+
+def test_counts_merges():
+    src = create_db()
+    src.execute("INSERT INTO foo VALUES (1, 1, 2)")
+    src.commit()
+    changes = src.execute(
+        "SELECT [table], pk, cid, val, col_version, db_version, crsql_site_id(), cl, seq FROM crsql_changes").fetchall()
+
+    dst = create_db()
+    for _ in range(2):
+        for change in changes:
+            dst.execute(
+                "INSERT INTO crsql_changes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", change)
+        dst.commit()
+
+    s = stats(dst)
+    assert s[("merges", None)][0] == 2 * len(changes)
+    assert s[("merges_won", None)][0] == len(changes)
+    assert s[("merges_lost", None)][0] == len(changes)
+    assert s[("merges", None)][1] > 0
+    assert s[("db_version_fetches", None)][0] >= 1
+    close(src)
+    close(dst)
+
+
+def test_per_connection():
+    a = create_db()
+    b = create_db()
+    a.execute("INSERT INTO foo VALUES (1, 1, 2)")
+    a.commit()
+    assert stats(a)[("insert_triggers", "foo")][0] == 1
+    assert ("insert_triggers", "foo") not in stats(b) or stats(
+        b)[("insert_triggers", "foo")][0] == 0
+    close(a)
+    close(b)
+
+
+def cached_stmts(c):
+    return c.execute(
+        "SELECT sum(count) FROM crsql_stats WHERE name = 'stmts_cached'").fetchone()[0]
+
+
+def test_stmt_cache_budget():
+    c = connect(":memory:")
+    for t in range(10):
+        c.execute("CREATE TABLE t{} (id PRIMARY KEY NOT NULL, a, b)".format(t))
+        c.execute("SELECT crsql_as_crr('t{}')".format(t))
+    c.commit()
+
+    def write_all():
+        for t in range(10):
+            c.execute("INSERT OR REPLACE INTO t{} VALUES (1, 2, 3)".format(t))
+            c.execute("UPDATE t{} SET a = a + 1".format(t))
+            c.commit()
+
+    write_all()
+    unbounded = cached_stmts(c)
+    assert unbounded > 8
+
+    c.execute("SELECT crsql_config_set('stmt-cache-size', 8)")
+    c.commit()
+    assert cached_stmts(c) <= 8
+    assert c.execute(
+        "SELECT sum(count) FROM crsql_stats WHERE name = 'stmts_evicted'").fetchone()[0] > 0
+
+    # evicted statements are prepared again when needed and results don't change
+    write_all()
+    assert c.execute("SELECT a FROM t9").fetchone()[0] == 3
+    assert c.execute(
+        "SELECT count(*) FROM crsql_changes WHERE [table] = 't9'").fetchone()[0] == 2
+
+    c.execute("INSERT INTO t1 VALUES (2, 2, 3)")
+    c.commit()
+
+    # the most recently used statements are the ones kept
+    c.execute("SELECT crsql_config_set('stmt-cache-size', 1)")
+    c.commit()
+    assert cached_stmts(c) == 1
+    assert c.execute(
+        "SELECT tbl FROM crsql_stats WHERE name = 'stmts_cached' AND count = 1").fetchone()[0] == "t1"
+    close(c)
+
+
+def test_unrelated_schema_changes_keep_table_infos():
+    c = create_db()
+    c.execute("CREATE TABLE bar (id PRIMARY KEY NOT NULL, a)")
+    c.execute("SELECT crsql_as_crr('bar')")
+    c.execute("INSERT INTO foo VALUES (1, 1, 2)")
+    c.execute("INSERT INTO bar VALUES (1, 1)")
+    c.commit()
+    prepared = stats(c)[("stmts_prepared", "foo")][0]
+    rebuilds = stats(c)[("table_info_rebuilds", None)][0]
+
+    c.execute("CREATE TABLE local (x)")
+    c.execute("CREATE INDEX foo_a ON foo (a)")
+    c.execute("INSERT INTO foo VALUES (2, 1, 2)")
+    c.commit()
+    s = stats(c)
+    assert s[("stmts_prepared", "foo")][0] == prepared
+    assert s[("table_info_rebuilds", None)][0] == rebuilds
+
+    # only the altered table is pulled again
+    c.execute("SELECT crsql_begin_alter('bar')")
+    c.execute("ALTER TABLE bar ADD COLUMN b")
+    c.execute("SELECT crsql_commit_alter('bar')")
+    c.execute("INSERT INTO bar VALUES (2, 1, 2)")
+    c.execute("INSERT INTO foo VALUES (3, 1, 2)")
+    c.commit()
+    s = stats(c)
+    assert s[("stmts_prepared", "foo")][0] == prepared
+    assert s[("table_info_rebuilds", None)][0] == rebuilds + 1
+    assert c.execute(
+        "SELECT count(*) FROM crsql_changes WHERE [table] = 'bar' AND cid = 'b'").fetchone()[0] == 1
+
+    # tables that stop being crrs are forgotten
+    c.execute("DROP TABLE bar")
+    c.execute("DROP TABLE bar__crsql_clock")
+    c.execute("DROP TABLE bar__crsql_pks")
+    c.execute("INSERT INTO foo VALUES (4, 1, 2)")
+    c.commit()
+    assert ("stmts_prepared", "bar") not in stats(c)
+    close(c)
@@ -1,2 +1,29 @@
 from crsql_correctness import connect
 
+
+def test_update_marks_only_changed_columns():
+    c = connect(":memory:")
+    cols = ["c{}".format(i) for i in range(70)]
+    c.execute("CREATE TABLE wide (id PRIMARY KEY NOT NULL, s TEXT COLLATE NOCASE, {})".format(
+        ", ".join(cols)))
+    c.execute("SELECT crsql_as_crr('wide')")
+    c.execute("INSERT INTO wide (id, s, c0, c66) VALUES (1, 'a', 1, 1)")
+    c.commit()
+
+    def changed():
+        return sorted(r[0] for r in c.execute(
+            "SELECT cid FROM crsql_changes WHERE db_version = crsql_db_version()"))
+
+    c.execute("UPDATE wide SET c66 = 2")
+    c.commit()
+    assert changed() == ["c66"]
+
+    # same value through the column's collation and numeric comparison
+    # but a different value for cr-sqlite
+    c.execute("UPDATE wide SET s = 'A', c0 = 1.0")
+    c.commit()
+    assert changed() == ["c0", "s"]
+
+    c.execute("UPDATE wide SET c1 = NULL, c65 = 3")
+    c.commit()
+    assert changed() == ["c65"]